@@ -12,6 +12,7 @@ import chess.polyglot
 import random
 import os
 import evaluation
+from sunfish import Stats
 import concurrent.futures
 import logging
 
@@ -43,12 +44,18 @@ MATE_LOWER = pieces[chess.KING] - 10*pieces[chess.QUEEN]
 MATE_UPPER = pieces[chess.KING] + 10*pieces[chess.QUEEN]
 
 # The table size is the maximum number of elements in the transposition table.
-TABLE_SIZE = 1e7
+# The table is kept between searches, and an entry, with its key and principal
+# variation, takes about 300 bytes, so this is some 160MB.
+TABLE_SIZE = 1 << 19
+# The number of static evaluations kept by a searcher
+EVAL_CACHE_SIZE = 1 << 18
 
 # Constants for tuning search
 QS_LIMIT = 219
 EVAL_ROUGHNESS = 50
 DRAW_TEST = True
+# Skip captures that lose material in qs, and order the others by it
+QS_SEE = True
 
 ###############################################################################
 # Chess logic
@@ -59,13 +66,15 @@ class Position(object):
     board -- a 120 char representation of the board
     evaluation
     """
-    def __init__(self, board, evalfunction=None, depth=0):
+    def __init__(self, board, evalfunction=None, depth=0, cache=None):
         if evalfunction is None:
             evalfunction = evaluation.Classical()
         self.board = board
         self.evaluation = evalfunction
         self.depth = depth
         self._score = None
+        # An EvalCache for the static evaluations, or None
+        self.cache = cache
 
     def gen_moves(self):
         for move in self.board.legal_moves:
@@ -91,7 +100,14 @@ class Position(object):
             return color * MATE_UPPER
         if self.board.is_variant_draw():
             return 0
-        return self.evaluation(self)
+        if self.cache is None:
+            return self.evaluation(self)
+        key = self.board._transposition_key()
+        score = self.cache.get(key)
+        if score is None:
+            score = self.evaluation(self)
+            self.cache.put(key, score)
+        return score
 
 
     def value(self, move):
@@ -123,6 +139,45 @@ class Position(object):
 class TimoutException(Exception):
     pass
 
+
+def see(board, move):
+    """ Static exchange evaluation: the material won on the target square when
+    both sides keep capturing there, least valuable piece first, and each may
+    stop when that pays. """
+    to = move.to_square
+    occupied = board.occupied
+    if move.drop:
+        on_square = move.drop
+    else:
+        on_square = board.piece_type_at(move.from_square)
+        occupied &= ~chess.BB_SQUARES[move.from_square]
+    victim = board.piece_type_at(to)
+    gain = [pieces[victim] if victim else 0]
+    if board.is_en_passant(move):
+        gain[0] = pieces[chess.PAWN]
+        occupied &= ~chess.BB_SQUARES[to + (-8 if board.turn == chess.WHITE else 8)]
+    if move.promotion:
+        gain[0] += pieces[move.promotion] - pieces[chess.PAWN]
+        on_square = move.promotion
+    color = not board.turn
+    while True:
+        # Pieces that captured already are off occupied, x-rays behind them count
+        attackers = board.attackers_mask(color, to, occupied) & occupied
+        if not attackers:
+            break
+        for piece_type in chess.PIECE_TYPES:
+            mask = attackers & board.pieces_mask(piece_type, color)
+            if mask:
+                break
+        gain.append(pieces[on_square] - gain[-1])
+        on_square = piece_type
+        occupied &= ~chess.BB_SQUARES[chess.lsb(mask)]
+        color = not color
+    while len(gain) > 1:
+        last = gain.pop()
+        gain[-1] = -max(-gain[-1], last)
+    return gain[0]
+
 def hashBoard(board):
     # representation = ""
     # representation += str(board.pawns)
@@ -145,20 +200,74 @@ def hashBoard(board):
 Entry = namedtuple('Entry', 'lower upper')
 
 
+class EvalCache(object):
+    """ Static evaluations by position, in a fixed number of slots. When it is
+    full, a clock hand sweeps the slots, clearing the flags of the ones used
+    since its last pass, and evicts the first one that was not. Quiescence
+    stand pats and move ordering both score positions through it, and the
+    MTD-f re-searches visit the same leaves many times. """
+
+    def __init__(self, size=EVAL_CACHE_SIZE):
+        self.size = size
+        self.clear()
+
+    def clear(self):
+        self.slots = {}
+        self.keys = [None] * self.size
+        self.values = [None] * self.size
+        self.used = [False] * self.size
+        self.hand = 0
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        slot = self.slots.get(key)
+        if slot is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.used[slot] = True
+        return self.values[slot]
+
+    def put(self, key, value):
+        if len(self.slots) < self.size:
+            slot = len(self.slots)
+        else:
+            while self.used[self.hand]:
+                self.used[self.hand] = False
+                self.hand = (self.hand + 1) % self.size
+            slot = self.hand
+            self.hand = (slot + 1) % self.size
+            del self.slots[self.keys[slot]]
+        self.slots[key] = slot
+        self.keys[slot], self.values[slot], self.used[slot] = key, value, False
+
+
 class Searcher:
 
     CHECK_TIME_AFTER_NODES = 200
 
-    def __init__(self):
+    def __init__(self, stats=None):
         self.tp_score = {}
         self.tp_move = {}
         self.nodes = 0
+        self.stats = stats
         self.best_move = None
         self._timeout = None
+        self._maxnodes = None
+        # The cache maps a position to (entry, depth, move, moves, generation) and
+        # is kept between searches of the same variant with the same evaluation.
+        # The generation tells which search last wrote an entry, so we can age
+        # out old entries when the cache is full.
         self._cache = {}
+        self.generation = 0
         self.maxdepth = 3
         self.extradepth = 3
         self.score = 0
+        # Kept between searches with the same evaluation function, None disables it
+        self.evalcache = EvalCache()
+        self._evaluation = self._variant = None
+        # Set per search, for the variant specific parts
+        self.antichess = self.crazyhouse = False
 
     def setTimeout(self, timeout=None):
         LOGGER.info("COnfiguring timeout to {}".format(timeout))
@@ -167,19 +276,33 @@ class Searcher:
         else:
             self._timeout = None
 
+    def setNodeLimit(self, nodes=None):
+        self._maxnodes = nodes
+
     def checkTimeout(self, depth, alpha, beta):
         if self._timeout is not None and time.process_time() >= self._timeout:
             LOGGER.warning("Depth = {}, alpha={}, beta={}, nodes={}".format(depth, alpha, beta, self.nodes))
             raise TimoutException
+        if self._maxnodes is not None and self.nodes >= self._maxnodes:
+            raise TimoutException
+
+    def age(self):
+        """ Makes room in the cache by dropping entries written before the current
+        search. If the current search alone fills the cache, we clear it. """
+        gen = self.generation
+        self._cache = {k: v for k, v in self._cache.items() if v[4] == gen}
+        if len(self._cache) > TABLE_SIZE/2:
+            self._cache.clear()
 
     def log(self, msg, indent=0):
         LOGGER.debug(indent * " " + msg)
 
-    def search(self, board, evaluation, maxdepth=1000, maxtime=None):
+    def search(self, board, evaluation, maxdepth=1000, maxtime=None, maxnodes=None):
         """ Iterative deepening MTD-bi search """
         self.setTimeout(None)
         #depth, move, score = next(self._search(board, evaluation, 2))
         self.setTimeout(maxtime)
+        self.setNodeLimit(maxnodes)
         # with chess.polyglot.open_reader("gm2001.bin") as reader:
         #     try:
         #         move = reader.choice(board)
@@ -199,6 +322,7 @@ class Searcher:
         maximizingPlayer = pos.board.turn == chess.WHITE
         epd = hashBoard(pos.board)
         depth = max(0, depth)
+        stats = self.stats
 
         if self.nodes % Searcher.CHECK_TIME_AFTER_NODES == 0:
             self.checkTimeout(depth, alpha, beta)
@@ -211,12 +335,18 @@ class Searcher:
         if pos.board.is_variant_draw():
             return (0, None, [])
 
+        if stats:
+            stats.tt_probes += 1
         try:
-            entry, _depth, _move, _moves = self._cache[epd]
+            entry, _depth, _move, _moves, _ = self._cache[epd]
             if depth <= _depth:
+                if stats:
+                    stats.tt_hits += 1
                 if entry.lower > beta:
+                    if stats: stats.tt_cutoffs += 1
                     return entry.lower, _move, _moves
                 if entry.upper < alpha:
+                    if stats: stats.tt_cutoffs += 1
                     return entry.upper, _move, _moves
 
             else:
@@ -229,6 +359,9 @@ class Searcher:
 
 
         self.nodes += 1
+        if stats:
+            stats.nodes += 1
+            stats.qnodes += depth == 0
 
         def save(epd, score, depth, move, moveList):
             if score >= beta:
@@ -242,7 +375,9 @@ class Searcher:
             #     if cachedDepth <= depth:
             #          self._cache[epd] = (newEntry, depth, move, [move] + moveList)
             # except KeyError:
-            self._cache[epd] = (newEntry, depth, move, [move] + moveList)
+            if len(self._cache) > TABLE_SIZE:
+                self.age()
+            self._cache[epd] = (newEntry, depth, move, [move] + moveList, self.generation)
 
         best = -MATE_UPPER if maximizingPlayer else MATE_UPPER
         bestMove = None
@@ -255,27 +390,72 @@ class Searcher:
                 yield score, None, []
 
             try:
-                _, _, killer_move, _ = self._cache[epd]
+                _, _, killer_move, _, _ = self._cache[epd]
             except KeyError:
                 killer_move = None
 
             moves = list(pos.board.legal_moves)
-            data = { move: pos.value(move) for move in moves }
-            def key(move):
-                return data[move]
-            sortedMoves = sorted(moves, key=key, reverse=maximizingPlayer)
+            childDepth = depth - 1
+            if self.antichess:
+                # Captures are forced, so either all moves are captures, which
+                # qs searches all, or none are and qs stops. Scoring every move
+                # for the order costs more than it saves. A single forced capture
+                # is not a choice, and is searched without using up depth.
+                data = None
+                if depth == 0 and not (moves and pos.board.is_capture(moves[0])):
+                    return
+                if len(moves) == 1 and depth > 0 and pos.board.is_capture(moves[0]):
+                    childDepth = depth
+                sortedMoves = moves
+            else:
+                drops = []
+                if self.crazyhouse:
+                    # Drops are not scored, so qs never searches them
+                    drops = [move for move in moves if move.drop]
+                    moves = [move for move in moves if not move.drop]
+                data = { move: pos.value(move) for move in moves }
+                def key(move):
+                    return data[move]
+                sortedMoves = sorted(moves, key=key, reverse=maximizingPlayer)
+                if drops and depth > 0:
+                    sortedMoves += self.order_drops(pos.board, drops)
+                if depth == 0:
+                    # In qs only the moves that score well enough, and of the
+                    # captures only those that do not lose the exchange, the
+                    # best exchange first
+                    sortedMoves = [move for move in sortedMoves if color * data[move] > 200]
+                    if QS_SEE:
+                        gains = {move: see(pos.board, move) if pos.board.is_capture(move) else 0
+                                 for move in sortedMoves}
+                        sortedMoves = sorted((move for move in sortedMoves if gains[move] >= 0),
+                                             key=gains.get, reverse=True)
+                    if killer_move not in sortedMoves:
+                        killer_move = None
             if killer_move:
                 sortedMoves.insert(0, killer_move)
+            # Drops may be the only way out of check, and a node must search
+            # at least one move, or it saves a false mate
+            prune_drops = self.crazyhouse and not pos.board.is_check()
+            searched = False
             for move in sortedMoves:
-                if depth > 0 or color * data[move] > 200:
-                    try:
-                        pos.board.push(move)
-                        bestScore, _, mvs = self.minimax(pos, depth-1, alpha, beta)
-                    finally: # pop the move, even when there is a timeout
-                        pos.board.pop()
-                    yield bestScore, move, mvs
-
-        for score, move, moves in genMoves():
+                moveDepth = childDepth
+                if prune_drops and move.drop and not self.is_tactical_drop(pos.board, move):
+                    # Quiet drops only change the piece-square score, so they
+                    # are not searched at the frontier, and one ply less deep
+                    # before it
+                    if depth > 1:
+                        moveDepth -= 1
+                    elif searched:
+                        continue
+                searched = True
+                try:
+                    pos.board.push(move)
+                    bestScore, _, mvs = self.minimax(pos, moveDepth, alpha, beta)
+                finally: # pop the move, even when there is a timeout
+                    pos.board.pop()
+                yield bestScore, move, mvs
+
+        for n, (score, move, moves) in enumerate(genMoves()):
             #print("--> ", move, moves, score, maximizingPlayer, best, alpha, beta)
             if maximizingPlayer:
                 if score >= best:
@@ -293,6 +473,10 @@ class Searcher:
             if alpha >= beta:
                 #best = upper_bound
                 bestMove = move
+                if stats and move is not None:
+                    stats.cutoffs += 1
+                    # In qs the stand pat comes before the first move
+                    stats.first_cutoffs += n == (depth == 0)
                 LOGGER.info("Saving {} with score {}, depth={} ({} > {})".format(move, score, depth, alpha, beta))
                 LOGGER.debug("Move stack 1 {}".format(pos.board.move_stack))
                 #self._cache[hashBoard(pos.board)] = (best, depth, move, pos.board.fullmove_number)
@@ -302,10 +486,26 @@ class Searcher:
         save(epd, best, depth, bestMove, moveStack)
         return best, bestMove, [bestMove] + moveStack
 
+    @staticmethod
+    def is_tactical_drop(board, move):
+        """ Drops that check, or land next to the enemy king or on a square the
+        enemy attacks and we defend """
+        enemy_king = board.king(not board.turn)
+        square = move.to_square
+        if enemy_king is not None and chess.square_distance(square, enemy_king) <= 1:
+            return True
+        if board.is_attacked_by(not board.turn, square) and board.is_attacked_by(board.turn, square):
+            return True
+        return board.gives_check(move)
+
+    def order_drops(self, board, drops):
+        """ Tactical drops first, and within both groups the heavier pieces """
+        return sorted(drops, key=lambda move: (not self.is_tactical_drop(board, move), -move.drop))
+
     def get_variation(self, pos, depth):
 
         try:
-            _, _, move, _ = self._cache[hashBoard(pos.board)]
+            _, _, move, _, _ = self._cache[hashBoard(pos.board)]
             if move:
                 try:
                     pos.board.push(move)
@@ -339,17 +539,37 @@ class Searcher:
         return g, best, moves
 
     def _search(self, board, evaluation, maxdepth=1000):
-        pos = Position(board, evaluation, depth=0)
+        # Scores of another evaluation or variant are of no use. As
+        # evaluation.get_evaluation_function returns the same object for a
+        # variant, this only happens when the engine is configured differently.
+        if evaluation is not self._evaluation or type(board) is not self._variant:
+            self._cache.clear()
+            if self.evalcache is not None:
+                self.evalcache.clear()
+            self._evaluation, self._variant = evaluation, type(board)
+        pos = Position(board, evaluation, depth=0, cache=self.evalcache)
+        self.antichess = isinstance(board, chess.variant.SuicideBoard)
+        self.crazyhouse = isinstance(board, chess.variant.CrazyhouseBoard)
         self.nodes = 0
-        #self.tp_score.clear()
-        self.tp_move.clear()
+        if self.stats:
+            self.stats.reset()
+        # Otherwise the cache is kept: after the opponent's reply most of the
+        # subtree searched for our previous move is still valid. Amwafish has
+        # no repetition detection, so no entry depends on the game history.
+        self.generation += 1
 
         # In finished games, we could potentially go far enough to cause a recursion
         # limit exception. Hence we bound the ply.
-        self._cache = {}
         self.cache_hits = 0
         # lower_bound = -MATE_UPPER
         # upper_bound = MATE_UPPER
+        if self.antichess:
+            moves = list(board.legal_moves)
+            if len(moves) == 1:
+                # A forced move needs no search
+                self.score = pos.value(moves[0])
+                yield 1, moves[0], self.score, moves
+                return
         for depth in range(1, maxdepth):
             #self.tp_score.clear()
             # The inner loop is a binary search on the score of the position.
@@ -358,16 +578,18 @@ class Searcher:
             LOGGER.info("Trying depth {}".format(depth))
             #score, best, moves = self.minimax(pos, depth, alpha, beta)
             self.score, best, moves = self.MTDF(pos, self.score, depth)
-            print(self.get_variation(pos, depth))
+            if self.stats:
+                self.stats.iteration(depth, self.nodes)
+            LOGGER.debug("Variation {}".format(self.get_variation(pos, depth)))
             yield depth, best, self.score, moves
 
 
-def search(searcher, pos, secs, variant=None):
+def search(searcher, pos, secs, variant=None, nodes=None):
     """ Search for a position """
     eval_function = evaluation.get_evaluation_function(variant)
 
     try:
-        for depth, move, score, moves in searcher.search(pos, eval_function, maxtime=secs):
+        for depth, move, score, moves in searcher.search(pos, eval_function, maxtime=secs, maxnodes=nodes):
             LOGGER.info("Found move {} for depth {} with score {}".format(move, depth, score))
             yield depth, move, score
     except TimoutException:
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import argparse
+import functools
+import importlib
+import itertools
+import json
+import multiprocessing
+import re
+import sys
+import time
+
+import chess
+
+import bench
+import suite
+import tools
+
+################################################################################
+# Batch analysis. Positions are read from FEN, EPD or PGN files, searched in
+# worker processes under a per-position budget, and written as a JSON line each,
+# as soon as they finish:
+#
+#   {"index": 0, "id": "...", "fen": "...", "move": "e2e4", "score": 31,
+#    "depth": 6, "nodes": 12345, "pv": ["e2e4", "e7e5"], "time": 0.8}
+#
+# Scores are in centipawns from the point of view of the side to move.
+################################################################################
+
+def sunfish_pv(searcher, pos, depth):
+    ''' Follows the moves of the table from pos '''
+    pv, seen = [], set()
+    while len(pv) < depth and pos not in seen:
+        seen.add(pos)
+        move = searcher.tp_move.get(pos)
+        if move is None:
+            break
+        pv.append(tools.mrender(pos, move))
+        pos = pos.move(move)
+    return pv
+
+
+def iterations(module, board, secs=None, nodes=None, depth=None, searcher=None, history=()):
+    ''' Searches board and yields a dict for every finished iteration. The
+        budgets of sunfish style engines are checked between iterations only. '''
+    searcher = searcher or module.Searcher()
+    start = time.time()
+    if bench.engine_kind(module) == 'sunfish':
+        pos = tools.parseFEN(board.fen())
+        for d, move, score in searcher.search(pos, history or (pos,)):
+            yield {'depth': d, 'move': move and tools.mrender(pos, move), 'score': score,
+                   'nodes': searcher.nodes, 'time': time.time() - start,
+                   'pv': sunfish_pv(searcher, pos, d)}
+            if depth is not None and d >= depth \
+                    or nodes is not None and searcher.nodes >= nodes \
+                    or secs is not None and time.time() - start >= secs:
+                break
+    else:
+        variant = board.uci_variant if board.uci_variant != 'chess' else None
+        for d, move, score, moves in searcher.search(
+                board, module.evaluation.get_evaluation_function(variant),
+                maxdepth=(depth or 999) + 1, maxtime=secs, maxnodes=nodes):
+            yield {'depth': d, 'move': move and move.uci(),
+                   'score': suite.relative_score(board, score), 'nodes': searcher.nodes,
+                   'time': time.time() - start, 'pv': [m.uci() for m in moves if m]}
+
+
+def analyse_position(job, module='amwafish', secs=None, nodes=None, depth=None):
+    ''' Returns the info dict of the last iteration, with the fields of job '''
+    info = {'move': None, 'score': None, 'depth': 0, 'nodes': 0, 'pv': [], 'time': 0}
+    for info in iterations(importlib.import_module(module), chess.Board(job['fen']),
+                           secs, nodes, depth):
+        pass
+    return dict(job, **info)
+
+
+def analyse_game(job, module='amwafish', secs=None, nodes=None, depth=None,
+                 reverse=False, blunder=200):
+    ''' Analyses all positions of a game with one searcher, such that every search
+        starts with the table of the previous one. In reverse, the searches of
+        later positions fill the table with the subtree of the move played.
+        Either way the last iteration, which costs most, finds little in the
+        table: forward, the previous search stopped a ply short of it, and in
+        reverse only the move played is cached. On the first 40 plies of
+        tests/pgns.pgn, reverse saves 11% of the nodes (sunfish, depth 5) and
+        8% (amwafish, depth 3), forward 9% and 6%.
+        Returns a dict per move, with the score of the best move, the score of
+        the move played, the difference (loss), and whether that is a blunder. '''
+    module = importlib.import_module(module)
+    searcher = module.Searcher()
+    # The position after the last move is searched too, for the score of that move
+    fens = job['fens'] + [job['final']]
+    history = [tools.parseFEN(fen) for fen in fens]
+    infos, scores = [None] * len(fens), [None] * len(fens)
+    for i in (reversed(range(len(fens))) if reverse else range(len(fens))):
+        info = {'move': None, 'score': None, 'depth': 0, 'nodes': 0, 'pv': [], 'time': 0}
+        scores[i] = {}
+        for info in iterations(module, chess.Board(fens[i]), secs, nodes, depth,
+                               searcher, history[:i+1]):
+            scores[i][info['depth']] = info['score']
+        infos[i] = info
+    moves = []
+    for ply, played in enumerate(job['played']):
+        info, after = infos[ply], infos[ply+1]
+        res = dict(info, game=job['game'], ply=ply, fen=fens[ply], played=played)
+        if after['score'] is not None and info['score'] is not None:
+            # Compare with the move played at the same horizon, so one ply less
+            # after it, as scores at odd and even depths differ a lot.
+            res['played_score'] = -scores[ply+1].get(info['depth'] - 1, after['score'])
+            res['loss'] = max(0, info['score'] - res['played_score']) if played != info['move'] else 0
+            res['blunder'] = res['loss'] >= blunder
+        moves.append(res)
+    return moves
+
+
+################################################################################
+# Input
+################################################################################
+
+def read_positions(file, pgn=None):
+    ''' Yields a job dict for every position of a FEN/EPD file, or every position
+        before a move in a PGN file. '''
+    lines = iter(file)
+    if pgn is None:
+        # Peek at the first non empty line
+        first = next((line for line in lines if line.strip()), '')
+        lines = itertools.chain([first], lines)
+        pgn = re.match(r'\[|\d+\.', first) is not None
+    if pgn:
+        for g, game in enumerate(tools.readGames(lines)):
+            try:
+                positions, _, _ = tools.parseGame(*game)
+            except tools.PARSE_ERRORS:
+                print('Skipping game {}, which sunfish can\'t read'.format(g+1), file=sys.stderr)
+                continue
+            for ply, (pos, move) in enumerate(positions):
+                yield {'game': g, 'ply': ply, 'fen': tools.renderFEN(pos),
+                       'played': tools.mrender(pos, move)}
+    else:
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            board, opts = suite.parse_position(line)
+            job = {'fen': board.fen()}
+            if 'id' in opts:
+                job['id'] = opts['id']
+            yield job
+
+
+def read_games(file):
+    ''' Yields a job dict for every game of a PGN file '''
+    for g, game in enumerate(tools.readGames(file)):
+        try:
+            positions, _, _ = tools.parseGame(*game)
+        except tools.PARSE_ERRORS:
+            print('Skipping game {}, which sunfish can\'t read'.format(g+1), file=sys.stderr)
+            continue
+        if not positions:
+            continue
+        pos, move = positions[-1]
+        yield {'game': g, 'headers': game[0],
+               'fens': [tools.renderFEN(pos) for pos, _ in positions],
+               'played': [tools.mrender(pos, move) for pos, move in positions],
+               'final': tools.renderFEN(pos.move(move))}
+
+
+def analyse(jobs, task, processes=None, batch=1000):
+    ''' Yields task(job) for every job, in order of completion. Jobs are sent to
+        the pool in batches, so long inputs are never all in memory. '''
+    jobs = (dict(job, index=i) for i, job in enumerate(jobs))
+    if processes == 1:
+        for job in jobs:
+            yield task(job)
+        return
+    pool = multiprocessing.Pool(processes)
+    try:
+        while True:
+            chunk = list(itertools.islice(jobs, batch))
+            if not chunk:
+                break
+            for res in pool.imap_unordered(task, chunk):
+                yield res
+    finally:
+        pool.terminate()
+
+
+def add_budget_arguments(parser):
+    parser.add_argument('--engine', type=str, default='amwafish',
+        help='sunfish.py or amwafish.py style module. Default=%(default)s.')
+    parser.add_argument('--secs', type=float, default=None,
+        help='seconds per position.')
+    parser.add_argument('--nodes', type=int, default=None,
+        help='nodes per position.')
+    parser.add_argument('--depth', type=int, default=None,
+        help='depth per position.')
+    parser.add_argument('--processes', type=int, default=0,
+        help='number of worker processes, 0 for all cores. Default=%(default)s.')
+    parser.add_argument('--output', type=argparse.FileType('w'), default=sys.stdout,
+        help='file to write the json lines to. Default is stdout.')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Analyse every position of FEN, EPD or PGN files, writing a json line per position.')
+    parser.add_argument('files', nargs='+', type=argparse.FileType('r'))
+    parser.add_argument('--pgn', action='store_true', default=None,
+        help='read the files as PGN. Default is to guess from the first line.')
+    parser.add_argument('--games', action='store_true',
+        help='analyse PGN games as a whole, with one searcher per game, and flag blunders.')
+    parser.add_argument('--reverse', action='store_true',
+        help='with --games, analyse the positions of a game from the last to the first.')
+    parser.add_argument('--blunder', type=int, default=200,
+        help='with --games, the loss in centipawns that makes a move a blunder. Default=%(default)s.')
+    add_budget_arguments(parser)
+    args = parser.parse_args()
+    if args.secs is None and args.nodes is None and args.depth is None:
+        args.secs = 1
+
+    budget = dict(module=args.engine, secs=args.secs, nodes=args.nodes, depth=args.depth)
+    if args.games:
+        task = functools.partial(analyse_game, reverse=args.reverse, blunder=args.blunder, **budget)
+        jobs = itertools.chain.from_iterable(read_games(f) for f in args.files)
+    else:
+        task = functools.partial(analyse_position, **budget)
+        jobs = itertools.chain.from_iterable(read_positions(f, args.pgn) for f in args.files)
+    for res in analyse(jobs, task, args.processes or None):
+        for line in res if args.games else [res]:
+            args.output.write(json.dumps(line) + '\n')
+        args.output.flush()
+
+
+if __name__ == '__main__':
+    main()
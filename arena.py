@@ -0,0 +1,242 @@
+#!/usr/bin/env pypy
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+from __future__ import division
+import argparse
+import importlib
+import math
+import multiprocessing
+import os
+import random
+import time
+
+import chess
+
+import bench
+import tools
+
+################################################################################
+# Arena. Two engine modules play each other in long-lived worker processes that
+# import them once. Every opening is played twice, with colors reversed, and the
+# pairs are scored together, which cancels most of the bias of the openings.
+# A sequential probability ratio test stops the match as soon as one of two Elo
+# hypotheses can be accepted.
+################################################################################
+
+OPENINGS = os.path.join(os.path.dirname(__file__), 'tests/chessathome_openings.fen')
+
+MAX_PLIES = 400
+
+# Set in every worker by init()
+_modules = None
+
+
+def init(names):
+    global _modules
+    _modules = [importlib.import_module(name) for name in names]
+
+
+################################################################################
+# Playing
+################################################################################
+
+def think(module, searcher, board, history, secs=None, nodes=None):
+    ''' Returns the move of the last iteration finished within the budget. Sunfish
+        style engines can't be interrupted, so their last iteration may go over. '''
+    start, move = time.time(), None
+    if bench.engine_kind(module) == 'sunfish':
+        pos = history[-1]
+        for _, m, _ in searcher.search(pos, history):
+            move = m and chess.Move.from_uci(tools.mrender(pos, m))
+            if secs is not None and time.time() - start > secs \
+                    or nodes is not None and searcher.nodes >= nodes:
+                break
+    else:
+        for _, m, _ in module.search(searcher, board.copy(), secs, nodes=nodes):
+            move = m
+    return move
+
+
+def play_game(fen, white, secs=None, plus=0, nodes=None):
+    ''' Plays a game between the two modules, where white is the index of the one
+        playing white. The clock starts at secs and gets plus after every move,
+        unless nodes is given. Returns the score of the first module. '''
+    board = chess.Board(fen)
+    searchers = [module.Searcher() for module in _modules]
+    players = [white, 1 - white] if board.turn == chess.WHITE else [1 - white, white]
+    clocks = [secs, secs]
+    history = [tools.parseFEN(board.fen())]
+    for ply in range(MAX_PLIES):
+        if board.is_game_over(claim_draw=True):
+            break
+        side = players[ply % 2]
+        use = None
+        if nodes is None:
+            # The time management of the old arena: a 30th of the clock, a bit
+            # more when ahead of the opponent
+            use = max(clocks[side]/30 + plus + (clocks[side] - clocks[1-side])/10, plus)
+        start = time.time()
+        move = think(_modules[side], searchers[side], board, history, use, nodes)
+        if nodes is None:
+            clocks[side] += plus - (time.time() - start)
+            # Losing on time, or by forfeit below, scores side for the first module
+            if clocks[side] < 0:
+                return side
+        if move is None or move not in board.legal_moves:
+            # Forfeit by an illegal or missing move
+            return side
+        board.push(move)
+        history.append(tools.parseFEN(board.fen()))
+    result = board.result(claim_draw=True)
+    if result == '1-0':
+        return 1 if white == 0 else 0
+    if result == '0-1':
+        return 0 if white == 0 else 1
+    return .5
+
+
+def play_task(args):
+    pair, fen, white, secs, plus, nodes = args
+    return pair, play_game(fen, white, secs, plus, nodes)
+
+
+################################################################################
+# Statistics
+################################################################################
+
+def expected_score(elo):
+    return 1 / (1 + 10**(-elo/400))
+
+
+def elo(score):
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1/score - 1)
+
+
+def mean_var(xs):
+    n = len(xs)
+    mean = sum(xs) / n
+    return mean, sum((x - mean)**2 for x in xs) / n
+
+
+def elo_interval(pairs):
+    ''' Elo and the half width of its 95% confidence interval, from pair scores '''
+    if not pairs:
+        return 0, float('inf')
+    mean, var = mean_var(pairs)
+    err = 1.96 * math.sqrt(var / len(pairs))
+    return elo(mean), (elo(mean + err) - elo(mean - err)) / 2
+
+
+def llr(pairs, elo0, elo1):
+    ''' Log likelihood ratio of elo1 against elo0 of the pair scores (0, .25, .5,
+        .75 or 1), using the normal approximation of the generalized SPRT. '''
+    if len(pairs) < 2:
+        return 0
+    mean, var = mean_var(pairs)
+    if var == 0:
+        return 0
+    s0, s1 = expected_score(elo0), expected_score(elo1)
+    return len(pairs) * (s1 - s0) * (2*mean - s0 - s1) / (2*var)
+
+
+def sprt_bounds(alpha, beta):
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+
+################################################################################
+# Match
+################################################################################
+
+def run(name1, name2, pairs, secs=None, plus=0, nodes=None, sprt=None, alpha=.05, beta=.05,
+        processes=None, seed=None, openings=OPENINGS, verbose=True):
+    ''' Plays up to pairs pairs of games. With sprt=(elo0, elo1), stops as soon
+        as the test accepts one of the two. Returns a summary dict. '''
+    if secs is None and nodes is None:
+        raise ValueError('Need a time control or a node limit')
+    with open(openings) as f:
+        fens = [line.strip() for line in f if line.strip()]
+    fens = random.Random(seed).sample(fens, min(pairs, len(fens)))
+    jobs = [(i, fen, white, secs, plus, nodes) for i, fen in enumerate(fens) for white in (0, 1)]
+    lower, upper = sprt_bounds(alpha, beta)
+    games, halves, finished = [], {}, []
+    verdict, ratio = None, 0
+    pool = multiprocessing.Pool(processes, initializer=init, initargs=((name1, name2),))
+    try:
+        for pair, score in pool.imap_unordered(play_task, jobs):
+            games.append(score)
+            if verbose:
+                print('wdl'[{1: 0, .5: 1, 0: 2}[score]], end='', flush=True)
+            if pair in halves:
+                finished.append((halves.pop(pair) + score) / 2)
+            else:
+                halves[pair] = score
+            if verbose and len(games) % 80 == 0:
+                print()
+                print(status(games, finished))
+            if sprt is not None:
+                ratio = llr(finished, *sprt)
+                if ratio <= lower or ratio >= upper:
+                    verdict = 'H1 accepted' if ratio >= upper else 'H0 accepted'
+                    break
+    finally:
+        pool.terminate()
+    e, err = elo_interval(finished)
+    summary = {'games': len(games), 'pairs': len(finished), 'wins': games.count(1),
+               'draws': games.count(.5), 'losses': games.count(0), 'elo': e,
+               'elo_error': err, 'llr': ratio, 'bounds': (lower, upper),
+               'verdict': verdict}
+    if verbose:
+        print()
+        print('{} vs {}: {}'.format(name1, name2, status(games, finished)))
+        if sprt is not None:
+            print('SPRT elo0={} elo1={}: LLR {:.2f} ({:.2f}, {:.2f}) {}'.format(
+                sprt[0], sprt[1], ratio, lower, upper, verdict or 'inconclusive'))
+    return summary
+
+
+def status(games, pairs):
+    e, err = elo_interval(pairs)
+    return '{} wins, {} draws, {} losses out of {}, Elo {:.1f} +/- {:.1f}'.format(
+        games.count(1), games.count(.5), games.count(0), len(games), e, err)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Play two engine modules against each other on paired openings.')
+    parser.add_argument('fish1', type=str, help='sunfish.py or amwafish.py style module')
+    parser.add_argument('fish2', type=str, help='module to play against')
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    run_args(args)
+
+
+def add_arguments(parser):
+    parser.add_argument('--pairs', type=int, default=500,
+        help='maximum number of pairs of games. Default=%(default)s.')
+    parser.add_argument('--seconds', type=float, default=20,
+        help='seconds on the clock per game. Default=%(default)s.')
+    parser.add_argument('--plus', type=float, default=.1,
+        help='seconds time increment per move. Default=%(default)s.')
+    parser.add_argument('--nodes', type=int, default=None,
+        help='search every move to this many nodes instead of using a clock.')
+    parser.add_argument('--sprt', type=float, nargs=2, metavar=('ELO0', 'ELO1'), default=None,
+        help='stop as soon as the SPRT accepts elo0 or elo1.')
+    parser.add_argument('--alpha', type=float, default=.05)
+    parser.add_argument('--beta', type=float, default=.05)
+    parser.add_argument('--processes', type=int, default=0,
+        help='number of worker processes, 0 for all cores. Default=%(default)s.')
+    parser.add_argument('--seed', type=int, default=None,
+        help='seed for the choice of openings.')
+
+
+def run_args(args):
+    if args.nodes is not None:
+        args.seconds = None
+    return run(args.fish1, args.fish2, args.pairs, args.seconds, args.plus, args.nodes,
+               args.sprt, args.alpha, args.beta, args.processes or None, args.seed)
+
+
+if __name__ == '__main__':
+    main()
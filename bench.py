@@ -0,0 +1,198 @@
+#!/usr/bin/env pypy
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+from __future__ import division
+import argparse
+import importlib
+import json
+import math
+import statistics
+import time
+
+import chess
+
+import evaluation
+import tools
+
+################################################################################
+# Deterministic benchmark. Every position is searched with a fresh Searcher (so
+# a cold table) to a fixed depth or node count. The total number of nodes is a
+# signature of the search behaviour: it only changes when the search does.
+################################################################################
+
+# Bump the version whenever the positions change, as signatures are only
+# comparable within one version.
+BENCH_VERSION = 1
+
+BENCH_POSITIONS = (
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+    'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+    'r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4',
+    'rnbqkb1r/pp1p1ppp/4pn2/2p5/2PP4/5N2/PP2PPPP/RNBQKB1R w KQkq - 0 4',
+    'r1bq1rk1/ppp2ppp/2np1n2/2b1p3/2B1P3/2NP1N2/PPP2PPP/R1BQ1RK1 w - - 0 7',
+    '1k1r4/pp1b1R2/3q2pp/4p3/2B5/4Q3/PPP2B2/2K5 b - - 0 1',
+    '2q1rr1k/3bbnnp/p2p1pp1/2pPp3/PpP1P1P1/1P2BNNP/2BQ1PRK/7R b - - 0 1',
+    'r1b2rk1/2q1b1pp/p2ppn2/1p6/3QP3/1BN1B3/PPP3PP/R4RK1 w - - 0 1',
+    'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+    '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+    '8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1',
+    '6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1',
+)
+
+# Sunfish searches far more (and cheaper) nodes per depth than amwafish.
+DEFAULT_DEPTH = {'sunfish': 5, 'amwafish': 3}
+
+
+def engine_kind(module):
+    ''' Sunfish style engines work on the 120 char board, amwafish style engines
+        on python-chess boards. '''
+    return 'sunfish' if hasattr(module, 'initial') else 'amwafish'
+
+
+def iterate(module, fen):
+    ''' Starts a search of fen with a fresh searcher. Returns the searcher and a
+        generator of (depth, move, score) with moves in uci notation. '''
+    searcher = module.Searcher()
+    if engine_kind(module) == 'sunfish':
+        pos = tools.parseFEN(fen)
+        def gen():
+            for depth, move, score in searcher.search(pos, (pos,)):
+                yield depth, move and tools.mrender(pos, move), score
+    else:
+        board = chess.Board(fen)
+        def gen():
+            for depth, move, score, _ in searcher.search(board, evaluation.get_evaluation_function()):
+                yield depth, move and move.uci(), score
+    return searcher, gen()
+
+
+def search_position(module, fen, depth=None, nodes=None):
+    ''' Searches until the given depth is finished, or until the first finished
+        iteration that used at least the given number of nodes. '''
+    searcher, results = iterate(module, fen)
+    start = time.time()
+    d, move, score = 0, None, 0
+    for d, move, score in results:
+        if depth is not None and d >= depth or nodes is not None and searcher.nodes >= nodes:
+            break
+    return {'fen': fen, 'move': move, 'score': score, 'depth': d,
+            'nodes': searcher.nodes, 'time': time.time() - start}
+
+
+def run(module, depth=None, nodes=None, verbose=True):
+    if depth is None and nodes is None:
+        depth = DEFAULT_DEPTH[engine_kind(module)]
+    results = []
+    for i, fen in enumerate(BENCH_POSITIONS):
+        res = search_position(module, fen, depth, nodes)
+        results.append(res)
+        if verbose:
+            print('Position {:>2}/{}: {:<6} depth {:>2} nodes {:>9,} time {:.3f}'.format(
+                i+1, len(BENCH_POSITIONS), str(res['move']), res['depth'],
+                res['nodes'], res['time']))
+    total_nodes = sum(r['nodes'] for r in results)
+    total_time = sum(r['time'] for r in results)
+    return {'version': BENCH_VERSION, 'module': module.__name__,
+            'depth': depth, 'nodes_limit': nodes, 'positions': results,
+            'signature': total_nodes, 'time': total_time,
+            'nps': int(round(total_nodes / total_time)) if total_time else 0}
+
+
+def print_summary(report):
+    print('Bench v{} {}: {:.3f}s'.format(report['version'], report['module'], report['time']))
+    print('Signature: {}'.format(report['signature']))
+    print('Speed: {:,}N/s'.format(report['nps']))
+
+
+################################################################################
+# Comparing modules
+################################################################################
+
+def t_value(df):
+    ''' Two sided 95% quantiles of the t-distribution '''
+    table = (12.71, 4.30, 3.18, 2.78, 2.57, 2.45, 2.36, 2.31, 2.26, 2.23)
+    if df <= len(table):
+        return table[df-1]
+    return 2.09 if df <= 20 else 2.04 if df <= 30 else 1.96
+
+
+def confidence(xs):
+    ''' Mean and half width of the 95% confidence interval '''
+    mean = statistics.mean(xs)
+    if len(xs) < 2:
+        return mean, float('inf')
+    return mean, t_value(len(xs)-1) * statistics.stdev(xs) / math.sqrt(len(xs))
+
+
+def compare(module1, module2, runs=5, depth=None, nodes=None):
+    ''' Benches both modules runs times, interleaved such that changes in machine
+        load affect both equally, and compares their speed. '''
+    if depth is None and nodes is None and engine_kind(module1) != engine_kind(module2):
+        raise ValueError('Comparing different kinds of engine needs an explicit depth or nodes')
+    names = [module1.__name__, module2.__name__]
+    if names[0] == names[1]:
+        names[1] += ' (2)'
+    reports = ([], [])
+    for i in range(runs):
+        for name, module, rs in zip(names, (module1, module2), reports):
+            report = run(module, depth, nodes, verbose=False)
+            rs.append(report)
+            print('Run {}/{} {}: signature {}, {:,}N/s'.format(
+                i+1, runs, name, report['signature'], report['nps']))
+    result = {'version': BENCH_VERSION, 'runs': runs, 'modules': {}}
+    for name, rs in zip(names, reports):
+        mean, err = confidence([r['nps'] for r in rs])
+        result['modules'][name] = {'signature': rs[0]['signature'], 'nps': mean, 'nps_error': err}
+        print('{}: signature {}, {:,.0f} +/- {:,.0f}N/s'.format(name, rs[0]['signature'], mean, err))
+    # The runs are paired, so the ratio of each pair cancels most of the noise
+    ratios = [r2['nps'] / r1['nps'] for r1, r2 in zip(*reports)]
+    mean, err = confidence(ratios)
+    result['speedup'], result['speedup_error'] = mean, err
+    print('Speed of {} relative to {}: {:.3f} +/- {:.3f}'.format(names[1], names[0], mean, err))
+    if reports[0][0]['signature'] != reports[1][0]['signature']:
+        print('Signatures differ, so the modules do not search the same tree.')
+    return result
+
+
+################################################################################
+# Command line
+################################################################################
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Search a fixed set of positions with a cold table and print a node signature.')
+    parser.add_argument('module', help='sunfish.py or amwafish.py file (without .py)',
+        type=str, default='sunfish', nargs='?')
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    run_args(args)
+
+
+def add_arguments(parser):
+    parser.add_argument('--compare', metavar='MODULE', type=str, default=None,
+        help='second module to compare the speed against.')
+    parser.add_argument('--depth', type=int, default=None,
+        help='depth to search each position to. Default depends on the module.')
+    parser.add_argument('--nodes', type=int, default=None,
+        help='search each position until an iteration has used this many nodes.')
+    parser.add_argument('--runs', type=int, default=5,
+        help='number of runs per module when comparing. Default=%(default)s.')
+    parser.add_argument('--json', metavar='FILE', type=str, default=None,
+        help='write the results as json to this file.')
+
+
+def run_args(args):
+    module = importlib.import_module(args.module)
+    if args.compare:
+        report = compare(module, importlib.import_module(args.compare),
+                         args.runs, args.depth, args.nodes)
+    else:
+        report = run(module, args.depth, args.nodes)
+        print_summary(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
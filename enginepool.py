@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import argparse
+import gc
+import importlib
+import itertools
+import multiprocessing
+import os
+import queue
+import socket
+import sys
+import threading
+
+import uci
+
+################################################################################
+# A pool of warm UCI engines. The engine module and its tables are imported
+# once, in the pool process, and frozen (gc.freeze) so the forked workers share
+# them copy-on-write. A game leases a worker and talks UCI to it over a pipe;
+# on quit, or when the client goes away, the worker is handed to the next game.
+# Every ucinewgame starts a fresh searcher, so no state leaks between games.
+# Workers are replaced after max_games leases to bound their memory, and when
+# they die, which ends the lease with EngineDied.
+################################################################################
+
+def _worker(conn, module):
+    while True:
+        # None marks the end of a lease, and an empty lease asks us to stop
+        commands = iter(conn.recv, None)
+        first = next(commands, None)
+        if first is None:
+            break
+        uci.session(itertools.chain([first], commands), conn.send, module, fresh_games=True)
+        # Drain what the client sent after quit, up to the end of the lease
+        for _ in commands:
+            pass
+        conn.send(None)
+
+
+class EngineDied(Exception):
+    ''' The worker process of a lease died '''
+
+
+class Engine(object):
+    ''' A leased worker. Send commands with send() and read the lines the
+        engine outputs with readline(). Returns to the pool when closed. '''
+
+    def __init__(self, pool, worker):
+        self._pool = pool
+        self._worker = worker
+        self._ended = self._done = False
+        self._lock = threading.Lock()
+
+    def send(self, command):
+        worker = self._worker
+        if worker is None:
+            raise EngineDied('the engine of this lease died')
+        try:
+            worker.conn.send(command)
+        except OSError:
+            self._died(worker)
+
+    def readline(self):
+        ''' Returns the next line of output, or None when the lease has ended '''
+        worker = self._worker
+        if worker is None:
+            return None
+        try:
+            line = worker.conn.recv()
+        except (EOFError, OSError):
+            self._died(worker)
+        if line is None:
+            self._done = True
+        return line
+
+    def _died(self, worker):
+        ''' Ends the lease, and has the pool replace the worker '''
+        with self._lock:
+            if self._worker is worker:
+                self._worker = None
+                self._ended = self._done = True
+                self._pool._retire(worker)
+        raise EngineDied('engine process {} died'.format(worker.process.pid))
+
+    def end(self):
+        ''' Quits the session and ends the lease. The remaining output can still
+            be read, up to the None that acknowledges the end. '''
+        if not self._ended:
+            self._ended = True
+            self.send('quit')
+            self.send(None)
+
+    def close(self):
+        if self._worker is None:
+            return
+        self.end()
+        while not self._done:
+            self.readline()
+        worker, self._worker = self._worker, None
+        self._pool._release(worker)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class _Worker(object):
+    def __init__(self, context, module):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_worker, args=(child, module), daemon=True)
+        self.process.start()
+        child.close()
+        self.games = 0
+
+
+class EnginePool(object):
+
+    def __init__(self, size=None, module='amwafish', max_games=1000):
+        self.module = importlib.import_module(module)
+        self.max_games = max_games
+        # Everything imported so far is shared by the workers. Freezing keeps
+        # the garbage collector from touching, and so copying, these pages.
+        gc.collect()
+        gc.freeze()
+        self._context = multiprocessing.get_context('fork')
+        self._idle = queue.Queue()
+        self._workers = []
+        for _ in range(size or os.cpu_count()):
+            self._add_worker()
+
+    def _add_worker(self):
+        worker = _Worker(self._context, self.module)
+        self._workers.append(worker)
+        self._idle.put(worker)
+
+    def acquire(self, timeout=None):
+        ''' Leases an engine, waiting for one to become idle '''
+        return Engine(self, self._idle.get(timeout=timeout))
+
+    def _release(self, worker):
+        worker.games += 1
+        if worker.games < self.max_games and worker.process.is_alive():
+            self._idle.put(worker)
+            return
+        self._retire(worker)
+
+    def _retire(self, worker):
+        ''' Stops worker, and adds a fresh one in its place '''
+        self._stop(worker)
+        self._workers.remove(worker)
+        self._add_worker()
+
+    def _stop(self, worker):
+        try:
+            worker.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        worker.process.join(1)
+        if worker.process.is_alive():
+            worker.process.terminate()
+
+    def close(self):
+        for worker in self._workers:
+            self._stop(worker)
+        self._workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+################################################################################
+# Serving games on a unix socket, one lease per connection, e.g. for
+#   socat - UNIX-CONNECT:amwafish.sock
+################################################################################
+
+def serve_connection(pool, conn):
+    with conn, pool.acquire() as engine:
+        def pump():
+            # Engine output to the client, until the lease ends
+            try:
+                for line in iter(engine.readline, None):
+                    try:
+                        conn.sendall((line + '\n').encode())
+                    except OSError:
+                        pass
+            except EngineDied as e:
+                # Hang up, which also ends the loop below
+                print(e, file=sys.stderr)
+                conn.shutdown(socket.SHUT_RDWR)
+        thread = threading.Thread(target=pump, daemon=True)
+        thread.start()
+        try:
+            for line in conn.makefile('r'):
+                engine.send(line.strip())
+                if line.strip() == 'quit':
+                    break
+            engine.end()
+        except EngineDied:
+            pass
+        thread.join()
+
+
+def serve(path, size=None, module='amwafish'):
+    if os.path.exists(path):
+        os.remove(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen()
+    with EnginePool(size, module) as pool:
+        print('Serving {} workers on {}'.format(len(pool._workers), path), file=sys.stderr)
+        try:
+            while True:
+                conn, _ = server.accept()
+                threading.Thread(target=serve_connection, args=(pool, conn), daemon=True).start()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Serve UCI games from a pool of warm engine processes on a unix socket.')
+    parser.add_argument('socket', type=str, help='path of the unix socket.')
+    parser.add_argument('--module', type=str, default='amwafish',
+        help='engine module. Default=%(default)s.')
+    parser.add_argument('--workers', type=int, default=0,
+        help='number of engine processes, 0 for one per core. Default=%(default)s.')
+    args = parser.parse_args()
+    serve(args.socket, args.workers or None, args.module)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,26 +2,72 @@ import chess
 import functools
 
 def get_evaluation_function(variant=None):
-    if variant is None or variant == 'standard':
-        return Classical()
-    elif variant == 'suicide' or variant == 'giveaway' or variant == 'antichess':
-        return Antichess()
+    ''' The evaluation of a variant. The same object is returned every time, so
+        a searcher can tell that its tables were filled with the same one. '''
+    if variant == 'suicide' or variant == 'giveaway' or variant == 'antichess':
+        return _evaluation(Antichess)
     elif variant == 'crazyhouse':
-        return Classical()
+        return _evaluation(Crazyhouse)
     else:
-        return Classical()
+        return _evaluation(Classical)
         #raise TypeError('Unsupported variant {}'.format(variant))
 
 
-def attack_enemy_king(board, color):
-    score = 0
+@functools.lru_cache(maxsize=None)
+def _evaluation(cls):
+    return cls()
+
+
+class AttackMap(object):
+    ''' The attacks of every piece of a board. Computed once per evaluated node,
+        and read by all the terms that need attacks. '''
+
+    def __init__(self, board):
+        self.board = board
+        # Attacks of the piece on a square, and of all pieces of a type and color
+        self.piece_attacks = {}
+        self.by_type = ([0] * 7, [0] * 7)
+        self.attacked = [0, 0]
+        self._counts = None
+        for color in chess.COLORS:
+            by_type = self.by_type[color]
+            for piece_type in chess.PIECE_TYPES:
+                for square in chess.scan_forward(board.pieces_mask(piece_type, color)):
+                    mask = board.attacks_mask(square)
+                    self.piece_attacks[square] = mask
+                    by_type[piece_type] |= mask
+            self.attacked[color] = functools.reduce(int.__or__, by_type)
+
+    def is_attacked(self, color, square):
+        return bool(self.attacked[color] & chess.BB_SQUARES[square])
+
+    def mobility(self, square):
+        ''' The number of squares the piece on square attacks '''
+        return chess.popcount(self.piece_attacks.get(square, 0))
+
+    def count(self, color, square):
+        ''' The number of pieces of color attacking square '''
+        if self._counts is None:
+            self._counts = ([0] * 64, [0] * 64)
+            for square_from, mask in self.piece_attacks.items():
+                counts = self._counts[self.board.color_at(square_from)]
+                for target in chess.scan_forward(mask):
+                    counts[target] += 1
+        return self._counts[color][square]
+
+    def lowest_attacker(self, color, square):
+        ''' The type of the least valuable piece of color attacking square, or None '''
+        bb = chess.BB_SQUARES[square]
+        for piece_type in chess.PIECE_TYPES:
+            if self.by_type[color][piece_type] & bb:
+                return piece_type
+        return None
+
+
+def attack_enemy_king(board, color, attacks=None):
+    attacks = attacks or AttackMap(board)
     enemy_king = board.king(not color)
-    for offset in [9, 8, 7, 1, -9, -8, -7, -1]:
-        target_square = enemy_king + offset
-        if 0 <= target_square < 64:
-            if board.is_attacked_by(color, target_square):
-                score += 30
-    return score
+    return 30 * chess.popcount(attacks.attacked[color] & chess.BB_KING_ATTACKS[enemy_king])
 
 
 
@@ -42,8 +88,9 @@ class MaterialBalance(object):
         return score
 
 
-def piece_activity(board, color):
+def piece_activity(board, color, attacks=None):
     board = board.board
+    attacks = attacks or AttackMap(board)
     score = 0
     attack_factor = {
         chess.PAWN: 0,
@@ -53,15 +100,13 @@ def piece_activity(board, color):
         chess.QUEEN: 3,
         chess.KING: 0
     }
-    names = (chess.KNIGHT, chess.BISHOP, chess.ROOK, chess.QUEEN)
-    values = [board.knights, board.bishops, board.rooks, board.queens]
-    for pieces, piece_type in [(chess.SquareSet(piece & board.occupied_co[color]), name) for piece, name in zip(values, names)]:
-        for square in pieces:
-            score += attack_factor[piece_type] * len(board.attacks(square))
+    for piece_type in (chess.KNIGHT, chess.BISHOP, chess.ROOK, chess.QUEEN):
+        for square in chess.scan_forward(board.pieces_mask(piece_type, color)):
+            score += attack_factor[piece_type] * attacks.mobility(square)
 
     return score
 
-def activity(board, square):
+def activity(board, square, attacks=None):
     attack_factor = {
         chess.PAWN: 2,
         chess.KNIGHT: 6,
@@ -71,9 +116,12 @@ def activity(board, square):
         chess.KING: 1
     }
     try:
-        return attack_factor[board.piece_type_at(square)] * len(board.attacks(square))
+        factor = attack_factor[board.piece_type_at(square)]
     except KeyError:
         return 0
+    if attacks is None:
+        return factor * len(board.attacks(square))
+    return factor * attacks.mobility(square)
 
 
 class material(object):
@@ -99,29 +147,158 @@ class Space(object):
                 score += chess.square_rank(square)
         return 20*score
 
-class Evaluation(object):
-    def __init__(self):
-        self.evals = []
+def _front_spans():
+    ''' The squares in front of a pawn on its own and the adjacent files,
+        for each color and square '''
+    spans = ([0] * 64, [0] * 64)
+    for square in chess.SQUARES:
+        file, rank = chess.square_file(square), chess.square_rank(square)
+        files = 0
+        for f in (file - 1, file, file + 1):
+            if 0 <= f < 8:
+                files |= chess.BB_FILES[f]
+        for r in range(8):
+            if r > rank:
+                spans[chess.WHITE][square] |= files & chess.BB_RANKS[r]
+            elif r < rank:
+                spans[chess.BLACK][square] |= files & chess.BB_RANKS[r]
+    return spans
+
+FRONT_SPANS = _front_spans()
+ADJACENT_FILES = [(chess.BB_FILES[f - 1] if f > 0 else 0) | (chess.BB_FILES[f + 1] if f < 7 else 0)
+                  for f in range(8)]
+
+
+class PawnHash(object):
+    ''' Pawn structure scores, cached by the pawns of both sides. The table has a
+        fixed size and a new entry replaces the one at its slot. Entries are
+        (white pawns, black pawns, score for white, passed pawns by color). '''
+    ADVANCE = 20
+    DOUBLED = -10
+    ISOLATED = -15
+    # By rank, seen from the pawn's side
+    PASSED = (0, 5, 10, 20, 35, 60, 100, 0)
+
+    def __init__(self, size=1 << 16):
+        assert size & (size - 1) == 0, 'size must be a power of two'
+        self.mask = size - 1
+        self.table = [None] * size
+        self.hits = self.misses = 0
+
+    def probe(self, board):
+        white = board.pawns & board.occupied_co[chess.WHITE]
+        black = board.pawns & board.occupied_co[chess.BLACK]
+        # Multiplicative hashing, the low bits of hash((white, black)) collide a lot
+        slot = ((white * 0x9E3779B97F4A7C15 ^ black * 0xC2B2AE3D27D4EB4F) >> 40) & self.mask
+        entry = self.table[slot]
+        if entry is not None and entry[0] == white and entry[1] == black:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        pawns = (black, white)
+        passed = (self.passed_pawns(pawns, chess.BLACK), self.passed_pawns(pawns, chess.WHITE))
+        score = self.structure(pawns, passed, chess.WHITE) - self.structure(pawns, passed, chess.BLACK)
+        entry = self.table[slot] = (white, black, score, passed)
+        return entry
 
-    #@functools.lru_cache(maxsize=None)
     def __call__(self, pos):
-        #pass
-        # board = pos.board
+        return self.probe(pos.board)[2]
+
+    def passed(self, board, color):
+        return self.probe(board)[3][color]
+
+    @staticmethod
+    def passed_pawns(pawns, color):
+        enemy = pawns[not color]
+        return functools.reduce(int.__or__, (chess.BB_SQUARES[square]
+            for square in chess.scan_forward(pawns[color])
+            if not FRONT_SPANS[color][square] & enemy), 0)
+
+    def structure(self, pawns, passed, color):
+        own = pawns[color]
         score = 0
-        # for square in chess.SQUARES:
+        for square in chess.scan_forward(own):
+            file, rank = chess.square_file(square), chess.square_rank(square)
+            rank = rank if color == chess.WHITE else 7 - rank
+            score += self.ADVANCE * rank
+            if not own & ADJACENT_FILES[file]:
+                score += self.ISOLATED
+            if passed[color] & chess.BB_SQUARES[square]:
+                score += self.PASSED[rank]
+        for file in chess.BB_FILES:
+            count = chess.popcount(own & file)
+            if count > 1:
+                score += self.DOUBLED * (count - 1)
+        return score
+
+
+def fuse(terms=(), tables=()):
+    ''' Compiles evaluation terms into one function of a board, returning the
+        score for white. tables are dicts from piece type to a value, or to 64
+        values laid out like psqt. terms are per square callables
+        term(board, square), scoring the piece on square for its owner.
+        material and MaterialBalance terms are folded into the tables. All
+        tables are summed and flipped for black up front, such that evaluating
+        is one walk over the occupied squares. '''
+    tables = list(tables)
+    square_terms = []
+    for term in terms:
+        if isinstance(term, material):
+            tables.append(term._pieces)
+        elif isinstance(term, MaterialBalance):
+            tables.append({p: v for p, v in term._pieces.items() if p != chess.KING})
+        else:
+            square_terms.append(term)
+    # flipped[color][piece_type][square], negated for black
+    flipped = ([None] * 7, [None] * 7)
+    for color in chess.COLORS:
+        sign = 1 if color == chess.WHITE else -1
+        for piece_type in chess.PIECE_TYPES:
+            values = [0] * 64
+            for table in tables:
+                entry = table.get(piece_type, 0)
+                for square in chess.SQUARES:
+                    values[square] += entry if isinstance(entry, int) else entry[transform(square, color)]
+            flipped[color][piece_type] = [sign * v for v in values]
+    scan = chess.scan_forward
+    types = [(color, piece_type, flipped[color][piece_type])
+             for color in chess.COLORS for piece_type in chess.PIECE_TYPES]
+
+    if not square_terms:
+        def evaluate(board):
+            score = 0
+            for color, piece_type, table in types:
+                for square in scan(board.pieces_mask(piece_type, color)):
+                    score += table[square]
+            return score
+        return evaluate
+
+    def evaluate(board):
+        score = 0
+        for color, piece_type, table in types:
+            for square in scan(board.pieces_mask(piece_type, color)):
+                partial = table[square]
+                extra = 0
+                for term in square_terms:
+                    extra += term(board, square)
+                score += partial + extra if color == chess.WHITE else partial - extra
+        return score
+    return evaluate
+
 
-        #     def compute():
-        #         partial_score = 0
-        #         for ev in self.evals:
-        #             partial_score += ev(board, square)
-        #         return partial_score
+class Evaluation(object):
+    # Piece tables, fused with the per square terms of evals
+    tables = ()
 
-        #     if board.color_at(square) == chess.WHITE:
-        #         score += compute()
-        #     elif board.color_at(square) == chess.BLACK:
-        #         score -= compute()
+    def __init__(self):
+        self.evals = []
+        self._fused = None
 
-        return score #if pos.board.turn is chess.WHITE else -score
+    def __call__(self, pos):
+        # Built on first use, as subclasses fill in evals after __init__
+        if self._fused is None:
+            self._fused = fuse(self.evals, self.tables)
+        return self._fused(pos.board)
 
 class Classical(Evaluation):
     pieces = { chess.PAWN: 100,
@@ -131,8 +308,11 @@ class Classical(Evaluation):
                 chess.QUEEN: 929,
                 chess.KING: 60000 }
 
-    def __init__(self):
+    def __init__(self, pawns=None):
         super().__init__()
+        self.tables = (pieces, psqt)
+        # A PawnHash, to add the pawn structure
+        self.pawns = pawns
         # self.evals = [
         #     #material(Classical.pieces),
         #     #attack_enemy_king,
@@ -144,23 +324,38 @@ class Classical(Evaluation):
         score = super().__call__(pos)
         #score += MaterialBalance(Classical.pieces)(pos, chess.WHITE) - MaterialBalance(Classical.pieces)(pos, chess.BLACK)
         #score += Space()(pos, chess.WHITE) - Space()(pos, chess.BLACK)
-        score += PsqtEval(pos, chess.WHITE) - PsqtEval(pos, chess.BLACK)
         #score += piece_activity(pos, chess.WHITE) - piece_activity(pos, chess.BLACK)
+        if self.pawns is not None:
+            score += self.pawns(pos)
+        return score
+
+class Crazyhouse(Classical):
+    ''' Classical, plus the pieces in hand. A piece in hand is worth as much as
+        one on the board, so dropping it only changes the piece-square score,
+        and a capture wins the piece twice: off the board and into the pocket. '''
+
+    def __call__(self, pos):
+        score = super().__call__(pos)
+        pockets = getattr(pos.board, 'pockets', None)
+        if pockets is not None:
+            for piece_type in (chess.PAWN, chess.KNIGHT, chess.BISHOP, chess.ROOK, chess.QUEEN):
+                count = pockets[chess.WHITE].count(piece_type) - pockets[chess.BLACK].count(piece_type)
+                if count:
+                    score += count * pieces[piece_type]
         return score
 
 class MinimumPieceToCapture(object):
     def __init__(self, pieces):
         self._pieces = pieces
 
-    def __call__(self, pos, color):
+    def __call__(self, pos, color, attacks=None):
         # find the lowest piece that we attack
-        score = 0
+        attacks = attacks or AttackMap(pos.board)
         for piece in (chess.PAWN, chess.KNIGHT, chess.BISHOP, chess.ROOK, chess.QUEEN, chess.KING):
-            for square in pos.board.pieces(piece, not color):
-                if pos.board.is_attacked_by(color, square):
-                    # we attack the given piece at square
-                    score = max(score, self._pieces[piece])
-        return score
+            if pos.board.pieces_mask(piece, not color) & attacks.attacked[color]:
+                # we attack a piece of this type
+                return self._pieces[piece]
+        return 0
 
 class Antichess(Evaluation):
     pieces = { chess.PAWN: -100,
@@ -172,14 +367,15 @@ class Antichess(Evaluation):
 
     def __init__(self):
         super().__init__()
+        # Folded into the tables of the fused evaluation
         self.evals = [
             material(Antichess.pieces),
-
         ]
         self.minPiece = MinimumPieceToCapture(Antichess.pieces)
     def __call__(self, pos):
         score = super().__call__(pos)
-        score += self.minPiece(pos, chess.WHITE) - self.minPiece(pos, chess.BLACK)
+        attacks = AttackMap(pos.board)
+        score += self.minPiece(pos, chess.WHITE, attacks) - self.minPiece(pos, chess.BLACK, attacks)
         return score
 
 psqt = {
@@ -284,4 +480,53 @@ def PsqtEval(pos, color):
 
     # if color == chess.BLACK:
     #     return evaluate(pos.board.mirror())
-    # return evaluate(pos.board)
\ No newline at end of file
+    # return evaluate(pos.board)
+
+################################################################################
+# Batch evaluation with NumPy, for scoring many boards at once (labelling data,
+# checking tuned tables, scoring root moves). Material, piece-square and pawn
+# advance are all linear in the (color, piece, square) occupancy, so each term
+# is a table of 12*64 weights and a batch is one matrix product.
+################################################################################
+
+BATCH_TERMS = ('material', 'psqt', 'space')
+
+
+@functools.lru_cache(maxsize=None)
+def _batch_tables():
+    import numpy as np
+    tables = np.zeros((2, 6, 64, len(BATCH_TERMS)), dtype=np.int64)
+    for c, color in enumerate((chess.WHITE, chess.BLACK)):
+        sign = 1 if color == chess.WHITE else -1
+        for piece_type in chess.PIECE_TYPES:
+            for square in chess.SQUARES:
+                t = tables[c, piece_type - 1, square]
+                if piece_type != chess.KING:
+                    t[0] = sign * Classical.pieces[piece_type]
+                t[1] = sign * (psqt[piece_type][transform(square, color)] + pieces[piece_type])
+                if piece_type == chess.PAWN:
+                    rank = chess.square_rank(square)
+                    t[2] = sign * 20 * (rank if color == chess.WHITE else 7 - rank)
+    return tables.reshape(12 * 64, len(BATCH_TERMS))
+
+
+def board_features(boards):
+    ''' The occupancy of boards as an (n, 12*64) uint8 array, indexed by
+        color (white first), piece type and square '''
+    import numpy as np
+    bitboards = np.array([[bb & board.occupied_co[color]
+                           for color in (chess.WHITE, chess.BLACK)
+                           for bb in (board.pawns, board.knights, board.bishops,
+                                      board.rooks, board.queens, board.kings)]
+                          for board in boards], dtype=np.uint64).reshape(-1, 12)
+    bits = np.unpackbits(bitboards.astype('<u8').view(np.uint8), bitorder='little')
+    return bits.reshape(len(bitboards), 12 * 64)
+
+
+def evaluate_batch(boards):
+    ''' Scores boards (chess.Board, or anything with a .board) from white's point
+        of view. Returns a dict of (n,) arrays: material as MaterialBalance,
+        psqt as PsqtEval (so the Classical score), and space as Space. '''
+    boards = [getattr(board, 'board', board) for board in boards]
+    scores = board_features(boards) @ _batch_tables()
+    return {term: scores[:, i] for i, term in enumerate(BATCH_TERMS)}
@@ -0,0 +1,132 @@
+#!/usr/bin/env pypy
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import argparse
+import itertools
+import multiprocessing
+import sys
+
+import positions
+import sunfish
+import tools
+
+################################################################################
+# Streaming PGN ingestion. Games are read one at a time with tools.readGames,
+# parsed in worker processes, and turned into (position, move, result) records,
+# where the result is 1, 0.5 or 0 from the point of view of the side to move in
+# the (sunfish) position, or None if the game was not finished.
+################################################################################
+
+SCORES = {'1-0': 1, '0-1': 0, '1/2-1/2': .5}
+
+
+def game_records(game):
+    ''' Returns the records of a game, or None if it can't be read by sunfish,
+        e.g. because of minor promotions, or malformed moves or FEN. '''
+    headers, movetext = game
+    try:
+        positions, result, white = tools.parseGame(headers, movetext)
+    except tools.PARSE_ERRORS:
+        return None
+    score = SCORES.get(result)
+    records = []
+    for pos, move in positions:
+        records.append((pos, move, score if white or score is None else 1 - score))
+        white = not white
+    return records
+
+
+def game_lines(game):
+    ''' Like game_records, but rendered as 'fen;move;result' lines in the worker,
+        to save pickling the positions back. '''
+    records = game_records(game)
+    if records is None:
+        return None
+    return ['{};{};{}'.format(tools.renderFEN(pos), tools.mrender(pos, move),
+                              '*' if score is None else score)
+            for pos, move, score in records]
+
+
+def game_packed(game):
+    ''' Like game_records, but packed as positions.Writer arguments, with the
+        result from white's point of view. '''
+    records = game_records(game)
+    if records is None:
+        return None
+    packed = []
+    for pos, move, score in records:
+        color = tools.get_color(pos)
+        if score is not None and color == tools.BLACK:
+            score = 1 - score
+        promotion = pos.board[move[0]] == 'P' and sunfish.A8 <= move[1] <= sunfish.H8
+        packed.append((positions.from_position(pos, color),
+                       positions.encode_move(move, color, promotion),
+                       0, -1 if score is None else int(2*score)))
+    return packed
+
+
+def parallel(f, games, processes=None, batch=256):
+    ''' Yields f(game) for every game, in order. Games are sent to the pool in
+        batches, so only a few batches are ever in memory. '''
+    if processes == 1:
+        for game in games:
+            yield f(game)
+        return
+    pool = multiprocessing.Pool(processes)
+    try:
+        games = iter(games)
+        while True:
+            chunk = list(itertools.islice(games, batch))
+            if not chunk:
+                break
+            for res in pool.imap(f, chunk, chunksize=8):
+                yield res
+    finally:
+        pool.terminate()
+
+
+def records(file, processes=None):
+    ''' Yields (position, move, result) for every move of every game in file '''
+    for recs in parallel(game_records, tools.readGames(file), processes):
+        for rec in recs or ():
+            yield rec
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Turn PGN files into (position, move, result) records.')
+    parser.add_argument('files', nargs='+', type=argparse.FileType('r'),
+        help='pgn files, such as tests/pgns.pgn.')
+    parser.add_argument('--output', type=argparse.FileType('w'), default=sys.stdout,
+        help='file to write fen;move;result lines to. Default is stdout.')
+    parser.add_argument('--dataset', type=str, default=None,
+        help='append packed records to this dataset file instead of writing lines.')
+    parser.add_argument('--processes', type=int, default=0,
+        help='number of worker processes, 0 for all cores. Default=%(default)s.')
+    args = parser.parse_args()
+
+    writer = positions.Writer(args.dataset) if args.dataset else None
+    games = skipped = count = 0
+    for f in args.files:
+        results = parallel(game_packed if writer else game_lines, tools.readGames(f),
+                           args.processes or None)
+        for recs in results:
+            games += 1
+            if recs is None:
+                skipped += 1
+                continue
+            count += len(recs)
+            if writer:
+                for rec in recs:
+                    writer.write(*rec)
+            else:
+                args.output.write('\n'.join(recs) + '\n')
+    if writer:
+        writer.close()
+    print('Read {} games ({} skipped), {} positions'.format(games, skipped, count),
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
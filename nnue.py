@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+from __future__ import division
+import argparse
+
+import chess
+import numpy as np
+
+import evaluation
+
+################################################################################
+# A small efficiently updatable neural network evaluation for amwafish.
+#
+# The inputs are HalfKA features: for each perspective (the side to move, us,
+# and the other side, them) a (king square, piece, square) triple for every
+# piece on the board, seen from that side, so black's view is rotated, as in
+# sunfish and the tables of evaluation.py. The first layer sums the weight rows
+# of the active features into an accumulator per perspective, plus a linear
+# psqt column that skips the rest of the network. Between two positions only a
+# few features change, so the accumulators are updated by adding and
+# subtracting rows, rather than recomputed. The small dense layers after it are
+# computed with NumPy:
+#
+#   x = clip([acc_us, acc_them], 0, 127)
+#   h = clip((x @ l1_weight + l1_bias) >> L1_SHIFT, 0, 127)
+#   score = (psqt_us - psqt_them) / 2 + (h @ out_weight + out_bias) / OUT_SCALE
+#
+# Weights are int16 (biases and the psqt column int32) in an .npz file.
+################################################################################
+
+KINDS = 12
+NFEATURES = 64 * KINDS * 64
+L1_SHIFT = 6
+OUT_SCALE = 16
+# Beyond this many changed pieces a fresh accumulator is cheaper
+MAX_UPDATE = 6
+# In this order, the accumulators are indexed by color
+PERSPECTIVES = (chess.BLACK, chess.WHITE)
+
+
+def feature(perspective, king, color, piece_type, square):
+    ''' Index of a feature: own pieces are kinds 0-5, the other side's 6-11 '''
+    if perspective == chess.BLACK:
+        king, square = king ^ 63, square ^ 63
+    kind = piece_type - 1 + (0 if color == perspective else 6)
+    return (king * KINDS + kind) * 64 + square
+
+
+class Network(object):
+
+    def __init__(self, ft_weight, ft_bias, ft_psqt, l1_weight, l1_bias, out_weight, out_bias):
+        self.hidden = ft_weight.shape[1]
+        # The psqt column is kept as the last column of the first layer, such
+        # that one row addition updates both. Sums are done in int32.
+        self.ft = np.concatenate((ft_weight.astype(np.int32), ft_psqt.astype(np.int32)[:, None]), axis=1)
+        self.ft_bias = np.concatenate((ft_bias.astype(np.int32), [0]))
+        self.l1_weight = l1_weight.astype(np.int32)
+        self.l1_bias = l1_bias.astype(np.int32)
+        self.out_weight = out_weight.astype(np.int32)
+        self.out_bias = int(np.asarray(out_bias).reshape(-1)[0])
+
+    def accumulate(self, features):
+        return self.ft_bias + self.ft[features].sum(axis=0)
+
+    def forward(self, acc_us, acc_them):
+        ''' The score, from the point of view of us, of the two accumulators '''
+        h = self.hidden
+        # np.clip has a lot of overhead on small arrays
+        x = np.minimum(np.maximum(np.concatenate((acc_us[:h], acc_them[:h])), 0), 127)
+        x = np.minimum(np.maximum((x @ self.l1_weight + self.l1_bias) >> L1_SHIFT, 0), 127)
+        psqt = (int(acc_us[h]) - int(acc_them[h])) // 2
+        return psqt + int(x @ self.out_weight + self.out_bias) // OUT_SCALE
+
+
+def load(path):
+    data = np.load(path)
+    return Network(*(data[k] for k in ('ft_weight', 'ft_bias', 'ft_psqt', 'l1_weight',
+                                       'l1_bias', 'out_weight', 'out_bias')))
+
+
+def psqt_network(hidden=32, l1=16, seed=None):
+    ''' A network that evaluates exactly like evaluation.Classical: the psqt
+        column holds the piece-square tables and the rest is zero (or small
+        random numbers with a seed, as a starting point for training). '''
+    psqt = np.zeros(NFEATURES, dtype=np.int32)
+    for perspective in chess.COLORS:
+        for king in chess.SQUARES:
+            for color in chess.COLORS:
+                for piece_type in chess.PIECE_TYPES:
+                    for square in chess.SQUARES:
+                        value = evaluation.pieces[piece_type] \
+                            + evaluation.psqt[piece_type][evaluation.transform(square, color)]
+                        psqt[feature(perspective, king, color, piece_type, square)] = \
+                            value if color == perspective else -value
+    rng = np.random.default_rng(seed)
+    small = lambda *shape: (rng.integers(-8, 9, shape) if seed is not None else np.zeros(shape)).astype(np.int16)
+    return {'ft_weight': small(NFEATURES, hidden), 'ft_bias': np.zeros(hidden, dtype=np.int16),
+            'ft_psqt': psqt, 'l1_weight': small(2*hidden, l1), 'l1_bias': np.zeros(l1, dtype=np.int32),
+            'out_weight': small(l1), 'out_bias': np.zeros(1, dtype=np.int32)}
+
+
+def piece_boards(board):
+    ''' The 12 bitboards of (color, piece type) '''
+    boards = []
+    for color in chess.COLORS:
+        occ = board.occupied_co[color]
+        boards += [board.pawns & occ, board.knights & occ, board.bishops & occ,
+                   board.rooks & occ, board.queens & occ, board.kings & occ]
+    return boards
+
+
+class NNUE(evaluation.Evaluation):
+    ''' Evaluates with a Network. The accumulators of the last position seen at
+        every ply are kept, and the next position at the ply below is evaluated
+        by updating them with the pieces that differ. As the search pushes and
+        pops moves on one board, that is almost always the parent. '''
+
+    def __init__(self, network):
+        super().__init__()
+        if isinstance(network, str):
+            network = load(network)
+        self.network = network
+        self._plies = {}
+        self.refreshes = self.updates = 0
+
+    def features(self, boards, perspective):
+        king = chess.lsb(boards[5 if perspective == chess.WHITE else 11])
+        return [feature(perspective, king, PERSPECTIVES[i < 6], i % 6 + 1, square)
+                for i, bb in enumerate(boards) for square in chess.scan_forward(bb)]
+
+    def accumulators(self, board):
+        boards = piece_boards(board)
+        ply = len(board.move_stack)
+        parent = self._plies.get(ply - 1) or self._plies.get(ply)
+        accs = None
+        if parent is not None:
+            accs = self.update(parent, boards)
+        if accs is None:
+            self.refreshes += 1
+            accs = [self.network.accumulate(self.features(boards, p)) for p in PERSPECTIVES]
+        self._plies[ply] = (boards, accs)
+        return accs
+
+    def update(self, parent, boards):
+        ''' Updates the accumulators of parent to boards, or None when that is
+            not worth it. '''
+        old, accs = parent
+        changed = []
+        for i, (o, n) in enumerate(zip(old, boards)):
+            if o != n:
+                color, piece_type = PERSPECTIVES[i < 6], i % 6 + 1
+                changed += [(color, piece_type, sq, 1) for sq in chess.scan_forward(n & ~o)]
+                changed += [(color, piece_type, sq, -1) for sq in chess.scan_forward(o & ~n)]
+        if not changed:
+            return accs
+        if len(changed) > MAX_UPDATE:
+            return None
+        result = []
+        for p in PERSPECTIVES:
+            own_king = 5 if p == chess.WHITE else 11
+            if old[own_king] != boards[own_king]:
+                # The king moved, and every feature of this perspective with it
+                result.append(self.network.accumulate(self.features(boards, p)))
+                continue
+            king = chess.lsb(boards[own_king])
+            rows = self.network.ft[[feature(p, king, c, t, sq) for c, t, sq, _ in changed]]
+            result.append(accs[p] + np.array([sign for _, _, _, sign in changed], dtype=np.int32) @ rows)
+        self.updates += 1
+        return result
+
+    def __call__(self, pos):
+        board = pos.board
+        accs = self.accumulators(board)
+        us = board.turn
+        score = self.network.forward(accs[us], accs[not us])
+        # Amwafish scores are from white's point of view
+        return score if us == chess.WHITE else -score
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Create network files for nnue.NNUE.')
+    parser.add_argument('output', help='.npz file to write.')
+    parser.add_argument('--hidden', type=int, default=32,
+        help='size of the accumulator per perspective. Default=%(default)s.')
+    parser.add_argument('--l1', type=int, default=16,
+        help='size of the hidden dense layer. Default=%(default)s.')
+    parser.add_argument('--seed', type=int, default=None,
+        help='initialise the non psqt weights randomly with this seed, instead of with zeros.')
+    args = parser.parse_args()
+    np.savez_compressed(args.output, **psqt_network(args.hidden, args.l1, args.seed))
+
+
+if __name__ == '__main__':
+    main()
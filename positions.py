@@ -0,0 +1,269 @@
+#!/usr/bin/env pypy
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import argparse
+import os
+import re
+import struct
+import sys
+
+import chess
+import numpy as np
+
+import sunfish
+import tools
+
+################################################################################
+# Packed positions. A position takes 32 bytes:
+#
+#   0 - 7   occupancy bitboard, little endian, bit s is square s (a1 = 0)
+#   8 - 23  a nibble per occupied square, in square order, low nibble first:
+#           1-6 for white PNBRQK, 9-14 for black pnbrqk
+#   24      flags: bits 0-3 castling rights KQkq, bit 4 set if black to move
+#   25      en passant square, or 255
+#   26      half move clock (at most 255)
+#   27 - 28 full move number, little endian
+#   29 - 31 reserved
+#
+# A dataset is a file of fixed size records: a packed position, the move played
+# (from + 64*to, plus 4096 for a promotion), a score and the result, both for
+# white (the result is 0 loss, 1 draw, 2 win, -1 unknown). Datasets are memory mapped, so millions of
+# records can be accessed at random without reading or parsing them.
+################################################################################
+
+POSITION_SIZE = 32
+
+RECORD = np.dtype([('pos', 'u1', POSITION_SIZE), ('move', '<u2'), ('score', '<i2'),
+                   ('result', 'i1'), ('reserved', 'u1', 3)])
+
+RESULTS = {'1-0': 2, '1/2-1/2': 1, '0-1': 0}
+
+# Our nibbles for python-chess piece types, per color
+CODES = {(chess.WHITE, pt): pt for pt in chess.PIECE_TYPES}
+CODES.update({(chess.BLACK, pt): 8 + pt for pt in chess.PIECE_TYPES})
+LETTERS = ' PNBRQK  pnbrqk '
+
+
+def pack(squares, castling, black, ep=None, halfmove=0, fullmove=1):
+    ''' Packs a position given by a {square: nibble} dict. castling is a string
+        like 'KQkq'. '''
+    occupancy, nibbles = 0, 0
+    for k, square in enumerate(sorted(squares)):
+        occupancy |= 1 << square
+        nibbles |= squares[square] << 4*k
+    flags = sum(1 << i for i, c in enumerate('KQkq') if c in castling) | black << 4
+    return struct.pack('<Q16sBBBH3x', occupancy, nibbles.to_bytes(16, 'little'), flags,
+                       255 if ep is None else ep, min(halfmove, 255), fullmove)
+
+
+def unpack(data):
+    ''' Returns ({square: nibble}, castling, black, ep, halfmove, fullmove) '''
+    occupancy, nibbles, flags, ep, halfmove, fullmove = struct.unpack('<Q16sBBBH3x', bytes(data))
+    nibbles = int.from_bytes(nibbles, 'little')
+    squares, k = {}, 0
+    while occupancy:
+        square = (occupancy & -occupancy).bit_length() - 1
+        squares[square] = nibbles >> 4*k & 15
+        occupancy &= occupancy - 1
+        k += 1
+    castling = ''.join(c for i, c in enumerate('KQkq') if flags >> i & 1)
+    return squares, castling, bool(flags & 16), None if ep == 255 else ep, halfmove, fullmove
+
+
+################################################################################
+# Conversions
+################################################################################
+
+def from_board(board):
+    squares = {sq: CODES[p.color, p.piece_type] for sq, p in board.piece_map().items()}
+    castling = board.castling_xfen() if board.castling_rights else ''
+    return pack(squares, castling, board.turn == chess.BLACK, board.ep_square,
+                board.halfmove_clock, board.fullmove_number)
+
+
+def square(i):
+    ''' The square of sunfish board index i, seen from white '''
+    return (9 - i//10)*8 + i%10 - 1
+
+
+def from_position(pos, color=None):
+    ''' Packs a sunfish position. The color to move is taken from the board if not given. '''
+    if color is None:
+        color = tools.get_color(pos)
+    if color == tools.BLACK:
+        pos = pos.rotate()
+    squares = {square(i): LETTERS.index(p) for i, p in enumerate(pos.board) if p.isalpha()}
+    castling = ''.join(c for c, ok in zip('KQkq', (pos.wc[1], pos.wc[0], pos.bc[0], pos.bc[1])) if ok)
+    ep = square(pos.ep) if pos.ep else None
+    return pack(squares, castling, color == tools.BLACK, ep)
+
+
+def to_fen(data):
+    squares, castling, black, ep, halfmove, fullmove = unpack(data)
+    rows = []
+    for rank in range(7, -1, -1):
+        row = ''.join(LETTERS[squares[8*rank + f]] if 8*rank + f in squares else '1' for f in range(8))
+        for n in range(8, 1, -1):
+            row = row.replace('1'*n, str(n))
+        rows.append(row)
+    return '{} {} {} {} {} {}'.format('/'.join(rows), 'b' if black else 'w', castling or '-',
+                                      chess.SQUARE_NAMES[ep] if ep is not None else '-',
+                                      halfmove, fullmove)
+
+
+def to_board(data):
+    return chess.Board(to_fen(data))
+
+
+EMPTY = re.sub('[a-zA-Z]', '.', sunfish.initial)
+
+
+def index(square):
+    ''' The sunfish board index of square, seen from white '''
+    return 91 - 10*(square//8) + square%8
+
+
+def to_position(data):
+    ''' Builds the sunfish position directly, without going through a FEN '''
+    squares, castling, black, ep, _, _ = unpack(data)
+    board, score = list(EMPTY), 0
+    for sq, nibble in squares.items():
+        i, p = index(sq), LETTERS[nibble]
+        board[i] = p
+        score += sunfish.pst[p][i] if p.isupper() else -sunfish.pst[p.upper()][119-i]
+    pos = sunfish.Position(''.join(board), score, ('Q' in castling, 'K' in castling),
+                           ('k' in castling, 'q' in castling), index(ep) if ep is not None else 0, 0)
+    return pos.rotate() if black else pos
+
+
+def encode_move(move, color=tools.WHITE, promotion=False):
+    ''' Encodes a sunfish move, seen from the side to move, or a chess.Move '''
+    if isinstance(move, chess.Move):
+        return move.from_square + 64*move.to_square + 4096*bool(move.promotion)
+    i, j = move if color == tools.WHITE else (119-move[0], 119-move[1])
+    return square(i) + 64*square(j) + 4096*promotion
+
+
+def decode_move(code):
+    ''' Returns a chess.Move. Promotions are always to queens. '''
+    return chess.Move(code & 63, code >> 6 & 63, chess.QUEEN if code & 4096 else None)
+
+
+################################################################################
+# Datasets
+################################################################################
+
+class Dataset(object):
+    ''' Memory mapped, read only, random access to the records of a file '''
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.getsize(path):
+            self.records = np.memmap(path, dtype=RECORD, mode='r')
+        else:
+            self.records = np.zeros(0, dtype=RECORD)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        return self.records[index]
+
+    def fen(self, index):
+        return to_fen(self.records['pos'][index])
+
+    def board(self, index):
+        return to_board(self.records['pos'][index])
+
+    def position(self, index):
+        return to_position(self.records['pos'][index])
+
+    def pieces(self, start=0, stop=None):
+        ''' Decodes the records into an (n, 64) array of nibbles, without going
+            through python objects. '''
+        return decode_pieces(self.records['pos'][start:stop])
+
+
+def decode_pieces(pos):
+    ''' (n, 32) packed positions to (n, 64) nibbles per square '''
+    occupied = np.unpackbits(pos[:, :8], axis=1, bitorder='little').astype(bool)
+    nibbles = np.empty((len(pos), 32), dtype=np.uint8)
+    nibbles[:, 0::2] = pos[:, 8:24] & 15
+    nibbles[:, 1::2] = pos[:, 8:24] >> 4
+    # The k'th occupied square has the k'th nibble
+    index = np.cumsum(occupied, axis=1) - 1
+    return np.where(occupied, np.take_along_axis(nibbles, np.clip(index, 0, 31), axis=1), 0)
+
+
+class Writer(object):
+    ''' Appends records to a dataset file '''
+
+    def __init__(self, path):
+        self.file = open(path, 'ab')
+        self.count = 0
+
+    def write(self, pos, move=0, score=0, result=-1):
+        self.file.write(struct.pack('<32sHhb3x', pos, move, score, result))
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+################################################################################
+# Command line
+################################################################################
+
+def convert(lines, writer):
+    ''' Converts fen[;move[;result]] lines, like the ones ingest.py writes, where
+        result is from the point of view of the side to move. '''
+    for line in lines:
+        parts = line.strip().split(';')
+        if not parts[0]:
+            continue
+        board = chess.Board(parts[0])
+        move = encode_move(chess.Move.from_uci(parts[1])) if len(parts) > 1 and parts[1] else 0
+        result = -1
+        if len(parts) > 2 and parts[2] not in ('', '*'):
+            result = int(round(2*float(parts[2])))
+            if board.turn == chess.BLACK:
+                result = 2 - result
+        writer.write(from_board(board), move, 0, result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert and inspect packed position datasets.')
+    subparsers = parser.add_subparsers(dest='command')
+    p = subparsers.add_parser('convert', help='convert fen;move;result lines to a dataset.')
+    p.add_argument('input', type=argparse.FileType('r'))
+    p.add_argument('output', type=str)
+    p = subparsers.add_parser('show', help='print records of a dataset.')
+    p.add_argument('dataset', type=str)
+    p.add_argument('--start', type=int, default=0)
+    p.add_argument('--count', type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        with Writer(args.output) as writer:
+            convert(args.input, writer)
+        print('Wrote {} records'.format(writer.count), file=sys.stderr)
+    elif args.command == 'show':
+        data = Dataset(args.dataset)
+        print('{} records'.format(len(data)))
+        for i in range(args.start, min(len(data), args.start + args.count)):
+            rec = data[i]
+            print('{};{};{};{}'.format(data.fen(i), decode_move(int(rec['move'])).uci(),
+                                       rec['score'], rec['result']))
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
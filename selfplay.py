@@ -0,0 +1,148 @@
+#!/usr/bin/env pypy
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+from __future__ import division
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+import positions
+import sunfish
+import tools
+
+################################################################################
+# Self-play data generation. Worker processes play sunfish against itself at a
+# fixed depth or node count, from the chessathome openings followed by a few
+# random moves. Every searched position is appended to a dataset, with the score
+# and the final result, both from white's point of view.
+################################################################################
+
+OPENINGS = os.path.join(os.path.dirname(__file__), 'tests/chessathome_openings.fen')
+
+MAX_PLIES = 400
+# Scores are clipped to fit the dataset records
+MAX_SCORE = 32000
+
+
+def think(searcher, pos, history, depth=None, nodes=None):
+    ''' Returns the move and score of the last iteration, when the depth is
+        reached or when the next iteration would probably go over the node
+        limit. Its cost is estimated from the growth of the last one. '''
+    last = cost = 0
+    for d, move, score in searcher.search(pos, history):
+        cost, growth = searcher.nodes - last, (searcher.nodes - last) / max(cost, 1)
+        last = searcher.nodes
+        if depth is not None and d >= depth:
+            break
+        if nodes is not None and d > 1 and searcher.nodes + cost * growth > nodes:
+            break
+    return move, score
+
+
+def play_game(fen, seed=0, depth=None, nodes=None, random_plies=4):
+    ''' Plays a game from fen. Returns the records as positions.Writer arguments. '''
+    rng = random.Random(seed)
+    pos = tools.parseFEN(fen)
+    color = tools.get_color(pos)
+    history = [pos]
+    # A few random moves make sure we don't replay the same games
+    for _ in range(rng.randint(0, random_plies)):
+        moves = [move for move, _ in tools.gen_legal_moves(pos)]
+        if not moves:
+            break
+        pos = pos.move(rng.choice(moves))
+        color, history = 1 - color, history + [pos]
+    searcher = sunfish.Searcher()
+    records, result, clock = [], 1, 0
+    for ply in range(MAX_PLIES):
+        if not any(True for _ in tools.gen_legal_moves(pos)):
+            # Mated, or stalemate
+            if tools.can_kill_king(pos.nullmove()):
+                result = 0 if color == tools.WHITE else 2
+            break
+        move, score = think(searcher, pos, history, depth, nodes)
+        if move is None:
+            break
+        white = score if color == tools.WHITE else -score
+        promotion = pos.board[move[0]] == 'P' and sunfish.A8 <= move[1] <= sunfish.H8
+        records.append((positions.from_position(pos, color), positions.encode_move(move, color, promotion),
+                        max(-MAX_SCORE, min(MAX_SCORE, white))))
+        if abs(score) >= sunfish.MATE_LOWER:
+            result = 2 if white > 0 else 0
+            break
+        clock = 0 if pos.board[move[0]] == 'P' or pos.board[move[1]] != '.' else clock + 1
+        pos = pos.move(move)
+        color = 1 - color
+        if clock >= 100 or pos in history:
+            break
+        history.append(pos)
+    return [rec + (result,) for rec in records]
+
+
+def play_task(args):
+    fen, seed, depth, nodes, random_plies = args
+    return play_game(fen, seed, depth, nodes, random_plies)
+
+
+def generate(path, games, depth=None, nodes=None, processes=None, seed=0,
+             random_plies=4, openings=OPENINGS, verbose=True):
+    ''' Plays games over a pool of processes, and appends the records of every
+        finished game to the dataset at path. '''
+    with open(openings) as f:
+        fens = [line.strip() for line in f if line.strip()]
+    rng = random.Random(seed)
+    jobs = ((rng.choice(fens), seed*1000003 + i, depth, nodes, random_plies)
+            for i in range(games))
+    results, count = [0, 0, 0], 0
+    start = time.time()
+    pool = multiprocessing.Pool(processes)
+    try:
+        with positions.Writer(path) as writer:
+            for i, records in enumerate(pool.imap_unordered(play_task, jobs)):
+                for rec in records:
+                    writer.write(*rec)
+                writer.file.flush()
+                count += len(records)
+                if records:
+                    results[records[0][-1]] += 1
+                if verbose:
+                    print('Game {}/{}: +{} ={} -{}, {} positions, {:.0f} positions/s'.format(
+                        i+1, games, results[2], results[1], results[0], count,
+                        count / (time.time() - start)), end='\r', file=sys.stderr, flush=True)
+    finally:
+        pool.terminate()
+    if verbose:
+        print(file=sys.stderr)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Generate positions with scores and results by sunfish self-play.')
+    parser.add_argument('output', help='dataset file to append to.')
+    parser.add_argument('--games', type=int, default=100,
+        help='number of games to play. Default=%(default)s.')
+    parser.add_argument('--depth', type=int, default=None,
+        help='depth to search every move to.')
+    parser.add_argument('--nodes', type=int, default=None,
+        help='node budget per move; no iteration is started that would probably exceed it. Default=5000 without --depth.')
+    parser.add_argument('--random-plies', type=int, default=4,
+        help='play up to this many random moves after the opening. Default=%(default)s.')
+    parser.add_argument('--processes', type=int, default=0,
+        help='number of worker processes, 0 for all cores. Default=%(default)s.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--openings', type=str, default=OPENINGS,
+        help='file with a fen per line. Default is tests/chessathome_openings.fen.')
+    args = parser.parse_args()
+
+    nodes = args.nodes if args.nodes is not None or args.depth is not None else 5000
+    generate(args.output, args.games, args.depth, nodes, args.processes or None, args.seed,
+             args.random_plies, args.openings)
+
+
+if __name__ == '__main__':
+    main()
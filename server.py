@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import argparse
+import asyncio
+import ipaddress
+import json
+import multiprocessing
+import sys
+import time
+
+import chess
+
+import amwafish
+import analyse
+import uci
+
+################################################################################
+# Analysis server. Clients connect over local TCP or a unix socket and send JSON
+# lines:
+#
+#   {"op": "analyse", "id": 1, "fen": "...", "secs": 1, "nodes": null,
+#    "depth": null, "variant": null, "deadline": null}
+#   {"op": "cancel", "id": 1}
+#
+# and get back JSON lines with the same id: an "iteration" for every finished
+# depth, then a "result" (or an "error"). Searches run on a fixed number of
+# worker processes, each with an amwafish.Searcher. Identical requests that are
+# queued or running at the same time share one search. A search is stopped when
+# its deadline (seconds of wall time since it was submitted) passes, or when
+# every client that asked for it has cancelled or gone away. When a worker
+# process dies, its search fails with an error and a new worker takes its place.
+################################################################################
+
+# Searches without any budget are bounded by this
+MAX_SECS = 60
+
+
+class _Searcher(amwafish.Searcher):
+    ''' Stops the search when the server cancels it. The time check is called
+        every few hundred nodes, so polling the pipe there is cheap. '''
+
+    def __init__(self, conn, job):
+        super().__init__()
+        self.conn, self.job = conn, job
+        self.cancelled = False
+
+    def checkTimeout(self, depth, alpha, beta):
+        while self.conn.poll():
+            # Cancels for earlier jobs may still be in the pipe
+            if self.conn.recv() == ('cancel', self.job):
+                self.cancelled = True
+                raise amwafish.TimoutException
+        super().checkTimeout(depth, alpha, beta)
+
+
+def _board(fen, variant=None):
+    return uci.get_variant(variant)(fen) if variant else chess.Board(fen)
+
+
+def _worker(conn):
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            break
+        if msg[0] != 'search':
+            continue
+        _, job, params = msg
+        try:
+            board = _board(params['fen'], params.get('variant'))
+        except ValueError as e:
+            conn.send(('done', job, {'error': str(e)}))
+            continue
+        searcher = _Searcher(conn, job)
+        start = time.time()
+        last = {'move': None, 'score': None, 'depth': 0, 'pv': []}
+        for last in analyse.iterations(amwafish, board, params.get('secs'), params.get('nodes'),
+                                       params.get('depth'), searcher):
+            conn.send(('iteration', job, last))
+        last.update(nodes=searcher.nodes, time=time.time() - start, cancelled=searcher.cancelled)
+        conn.send(('done', job, last))
+
+
+class Job(object):
+    ''' A search and the (connection, id) pairs that wait for it '''
+
+    def __init__(self, key, params, submitted):
+        self.key, self.params = key, params
+        self.submitted = submitted
+        self.subscribers = set()
+        self.iterations = []
+        self.seq = self.worker = None
+        self.reason = None
+
+    def publish(self, message):
+        for client, rid in self.subscribers:
+            client.send(dict(message, id=rid))
+
+
+class Worker(object):
+
+    def __init__(self, context):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_worker, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+
+    async def recv(self):
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        loop.add_reader(self.conn.fileno(), lambda: ready.done() or ready.set_result(None))
+        try:
+            await ready
+        finally:
+            loop.remove_reader(self.conn.fileno())
+        return self.conn.recv()
+
+
+class Client(object):
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    def send(self, message):
+        if not self.writer.is_closing():
+            self.writer.write((json.dumps(message) + '\n').encode())
+
+
+class Server(object):
+
+    def __init__(self, processes=None, max_secs=MAX_SECS):
+        self.max_secs = max_secs
+        self.jobs = {}
+        self.queue = asyncio.Queue()
+        self.context = multiprocessing.get_context('fork')
+        self.workers = [Worker(self.context) for _ in range(processes or multiprocessing.cpu_count())]
+        self.runners = [asyncio.ensure_future(self.run(i)) for i in range(len(self.workers))]
+        self.searches = 0
+
+    def close(self):
+        for runner in self.runners:
+            runner.cancel()
+        for worker in self.workers:
+            worker.process.terminate()
+
+    ############################################################################
+    # Scheduling
+    ############################################################################
+
+    async def run(self, i):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            if not job.subscribers:
+                continue
+            worker = self.workers[i]
+            self.searches += 1
+            job.seq, job.worker = self.searches, worker
+            deadline = job.params.get('deadline')
+            # The deadline counts from the submission, so time in the queue is
+            # taken off. A job that expired in the queue is stopped at once.
+            timer = deadline and loop.call_later(max(0, deadline - (loop.time() - job.submitted)),
+                                                 self.stop, job, 'deadline')
+            try:
+                worker.conn.send(('search', job.seq, job.params))
+                while True:
+                    kind, _, data = await worker.recv()
+                    if kind == 'iteration':
+                        message = dict(data, type='iteration')
+                        job.iterations.append(message)
+                        job.publish(message)
+                    else:
+                        break
+            except (EOFError, OSError):
+                worker.process.terminate()
+                self.workers[i] = Worker(self.context)
+                data = {'error': 'the search process died'}
+            if timer:
+                timer.cancel()
+            if self.jobs.get(job.key) is job:
+                del self.jobs[job.key]
+            if 'error' in data:
+                job.publish({'type': 'error', 'error': data['error']})
+            else:
+                job.publish(dict(data, type='result', stopped=job.reason))
+
+    def stop(self, job, reason):
+        if job.reason is None:
+            job.reason = reason
+        if job.worker is not None:
+            try:
+                job.worker.conn.send(('cancel', job.seq))
+            except OSError:
+                # The worker died, which run() reports
+                pass
+
+    def submit(self, client, rid, params):
+        params = {k: params.get(k) for k in ('fen', 'variant', 'secs', 'nodes', 'depth', 'deadline')}
+        if not (params['secs'] or params['nodes'] or params['depth']):
+            params['secs'] = self.max_secs
+        key = json.dumps(params, sort_keys=True)
+        job = self.jobs.get(key)
+        if job is None or job.reason is not None:
+            job = self.jobs[key] = Job(key, params, asyncio.get_running_loop().time())
+            self.queue.put_nowait(job)
+        else:
+            # Catch up with the shared search
+            for message in job.iterations:
+                client.send(dict(message, id=rid))
+        job.subscribers.add((client, rid))
+
+    def unsubscribe(self, client, rid=None):
+        for job in list(self.jobs.values()):
+            job.subscribers = {(c, r) for c, r in job.subscribers
+                               if c is not client or rid is not None and r != rid}
+            if not job.subscribers:
+                # Queued jobs without subscribers are skipped by the runners
+                if job.worker is None:
+                    del self.jobs[job.key]
+                    continue
+                self.stop(job, 'cancelled')
+
+    ############################################################################
+    # Connections
+    ############################################################################
+
+    async def handle(self, reader, writer):
+        client = Client(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = None
+                try:
+                    request = json.loads(line)
+                    op = request.get('op', 'analyse')
+                    if op == 'analyse':
+                        if 'fen' not in request:
+                            raise ValueError('missing fen')
+                        self.submit(client, request.get('id'), request)
+                    elif op == 'cancel':
+                        self.unsubscribe(client, request.get('id'))
+                    else:
+                        raise ValueError('unknown op {}'.format(op))
+                except (ValueError, AttributeError) as e:
+                    client.send({'id': request.get('id') if isinstance(request, dict) else None,
+                                 'type': 'error', 'error': str(e)})
+                await writer.drain()
+        finally:
+            self.unsubscribe(client)
+            writer.close()
+
+
+async def start(server, host='127.0.0.1', port=0, path=None):
+    ''' Starts listening. Only loopback addresses are accepted, as there is no
+        authentication. '''
+    if path:
+        return await asyncio.start_unix_server(server.handle, path)
+    if not ipaddress.ip_address(host).is_loopback:
+        raise ValueError('Only loopback addresses are supported, not {}'.format(host))
+    return await asyncio.start_server(server.handle, host, port)
+
+
+async def serve(args):
+    server = Server(args.processes or None, args.max_secs)
+    listener = await start(server, args.host, args.port, args.socket)
+    print('Listening on {}'.format(args.socket or listener.sockets[0].getsockname()), file=sys.stderr)
+    try:
+        await listener.serve_forever()
+    finally:
+        server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve amwafish analysis as JSON lines.')
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+        help='loopback address to listen on. Default=%(default)s.')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--socket', type=str, default=None,
+        help='listen on this unix socket instead.')
+    parser.add_argument('--processes', type=int, default=0,
+        help='number of search processes, 0 for all cores. Default=%(default)s.')
+    parser.add_argument('--max-secs', type=float, default=MAX_SECS,
+        help='time budget of requests without one. Default=%(default)s.')
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
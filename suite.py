@@ -0,0 +1,193 @@
+#!/usr/bin/env pypy
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+from __future__ import division
+import functools
+import importlib
+import json
+import multiprocessing
+import time
+
+import chess
+
+################################################################################
+# Running test suites of positions in parallel.
+#
+# A task is a function (index, line) -> result dict, run in a worker process.
+# The results are printed as soon as they come in, and summarized at the end.
+# Every result has at least the keys index, id, fen, solved, move, score, depth,
+# nodes, time (the time spent) and solution_time (None if not solved).
+################################################################################
+
+def parse_position(line):
+    ''' Parses a line of FEN or EPD into a board and the EPD operations '''
+    parts = line.split()
+    board = chess.Board()
+    # EPD does not have clocks, but our files sometimes put them after the FEN
+    if len(parts) >= 6 and parts[4].isdigit() and parts[5].rstrip(';').isdigit():
+        opts = board.set_epd(' '.join(parts[:4] + parts[6:]))
+        board.halfmove_clock, board.fullmove_number = int(parts[4]), int(parts[5].rstrip(';'))
+    else:
+        opts = board.set_epd(line)
+    return board, opts
+
+
+def read_lines(f):
+    return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+def relative_score(board, score):
+    ''' Amwafish scores are from white's point of view. Returns score, from
+        white's point of view, relative to the side to move. '''
+    return score if board.turn == chess.WHITE else -score
+
+
+def iterate(module, board, secs=None, nodes=None):
+    ''' Starts a search with a fresh searcher. Returns the searcher and a generator
+        of (seconds, depth, move, score) for every finished iteration, with score
+        from the point of view of the side to move. '''
+    searcher = module.Searcher()
+    def gen():
+        start = time.time()
+        for depth, move, score in module.search(searcher, board, secs, nodes=nodes):
+            yield time.time() - start, depth, move, relative_score(board, score)
+    return searcher, gen()
+
+
+def result(index, board, opts, solved=False, move=None, score=None, depth=0,
+           nodes=0, spent=0, solution_time=None, **extra):
+    res = {'index': index, 'id': opts.get('id', str(index+1)), 'fen': board.fen(),
+           'solved': solved, 'move': move and move.uci(), 'score': score,
+           'depth': depth, 'nodes': nodes, 'time': spent,
+           'solution_time': solution_time}
+    res.update(extra)
+    return res
+
+
+################################################################################
+# Tasks
+################################################################################
+
+def findbest_task(index_line, module='amwafish', times=(1,), nodes=None):
+    ''' Searches once for max(times) seconds and reports, for each of the times,
+        the move of the last iteration finished by then. Solved when all these
+        moves satisfy the am/bm operations. The solution time is the time from
+        which on every iteration found a good move. '''
+    index, line = index_line
+    module = importlib.import_module(module)
+    board, opts = parse_position(line)
+    am, bm = opts.get('am', ()), opts.get('bm', ())
+    ok = lambda move: move is not None and move not in am and (not bm or move in bm)
+    start = time.time()
+    searcher, results = iterate(module, board, max(times), nodes)
+    iterations = list(results)
+    spent = time.time() - start
+    marks, points = [], 0
+    for t in sorted(times):
+        done = [it for it in iterations if it[0] <= t]
+        move = done[-1][2] if done else None
+        points += ok(move)
+        marks.append('{}({})'.format(board.san(move) if move else '-', int(ok(move))))
+    solution_time = None
+    for seconds, _, move, _ in reversed(iterations):
+        if not ok(move):
+            break
+        solution_time = seconds
+    _, depth, move, score = iterations[-1] if iterations else (0, 0, None, None)
+    return result(index, board, opts, points == len(times), move, score, depth,
+                  searcher.nodes, spent, solution_time, points=points, marks=marks)
+
+
+def mate_task(index_line, module='amwafish', secs=None, nodes=None):
+    ''' Solved when a mate score is found. '''
+    index, line = index_line
+    module = importlib.import_module(module)
+    board, opts = parse_position(line)
+    move, score, depth, solution_time = None, None, 0, None
+    start = time.time()
+    searcher, results = iterate(module, board, secs, nodes)
+    for spent, depth, move, score in results:
+        if score >= module.MATE_LOWER:
+            solution_time = spent
+            break
+    return result(index, board, opts, solution_time is not None, move, score, depth,
+                  searcher.nodes, time.time() - start, solution_time)
+
+
+def bound_task(index_line, module='amwafish', mindepth=1, maxdepth=99, secs=None,
+               nodes=None, gamma=None):
+    ''' Uses null window searches at increasing depths to decide if the score of the
+        side to move is at least gamma (quickmate), or, without gamma, exactly a
+        draw (quickdraw). This is much cheaper than finding the actual score. '''
+    index, line = index_line
+    module = importlib.import_module(module)
+    board, opts = parse_position(line)
+    searcher = module.Searcher()
+    searcher.setTimeout(secs)
+    searcher.setNodeLimit(nodes)
+    pos = module.Position(board, module.evaluation.get_evaluation_function())
+    sign = 1 if board.turn == chess.WHITE else -1
+    start = time.time()
+    solved, score, depth, move = False, None, 0, None
+    try:
+        for depth in range(mindepth, maxdepth+1):
+            if gamma is not None:
+                # Amwafish searches from white's point of view
+                g = sign * gamma
+                score, move, _ = searcher.minimax(pos, depth, g-1, g)
+                solved = sign * score >= gamma
+            else:
+                score, move, _ = searcher.minimax(pos, depth, -1, 1)
+                solved = score == 0
+            if solved:
+                break
+    except module.TimoutException:
+        pass
+    spent = time.time() - start
+    return result(index, board, opts, solved, move, score and sign * score, depth,
+                  searcher.nodes, spent, spent if solved else None)
+
+
+################################################################################
+# Runner
+################################################################################
+
+def run_suite(task, lines, processes=None, report=None, verbose=True, **budget):
+    ''' Runs task(index_line, **budget) for every line over a pool of processes.
+        Returns the summary, which is also written as json to report if given. '''
+    jobs = list(enumerate(lines))
+    results = []
+    start = time.time()
+    pool = multiprocessing.Pool(processes)
+    try:
+        for res in pool.imap_unordered(functools.partial(task, **budget), jobs):
+            results.append(res)
+            if verbose:
+                print('{:>4}/{} {:<10} {:<7} {:<6} depth {:>2} nodes {:>9} time {:.2f}{}'.format(
+                    len(results), len(jobs), res['id'], 'solved' if res['solved'] else 'failed',
+                    str(res['move']), res['depth'], res['nodes'], res['time'],
+                    ' ' + ' '.join(res['marks']) if 'marks' in res else ''), flush=True)
+    finally:
+        pool.terminate()
+    results.sort(key=lambda r: r['index'])
+    summary = summarize(results, time.time() - start)
+    if verbose:
+        print('-'*60)
+        print('Solved {solved}/{total}, average time to solution {avg_solution_time:.2f}s, '
+              'total nodes {nodes}, wall time {wall_time:.1f}s'.format(**summary))
+    if report:
+        with open(report, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return summary
+
+
+def summarize(results, wall_time):
+    solved = [r for r in results if r['solved']]
+    return {'total': len(results), 'solved': len(solved),
+            'avg_solution_time': sum(r['solution_time'] for r in solved) / len(solved) if solved else 0,
+            'nodes': sum(r['nodes'] for r in results),
+            'cpu_time': sum(r['time'] for r in results),
+            'wall_time': wall_time,
+            'unsolved': [r['id'] for r in results if not r['solved']],
+            'results': results}
@@ -2,7 +2,7 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import print_function
-import re, sys, time
+import re, sys, time, json
 from itertools import count
 from collections import namedtuple
 
@@ -115,6 +115,20 @@ TABLE_SIZE = 1e7
 QS_LIMIT = 219
 EVAL_ROUGHNESS = 13
 DRAW_TEST = True
+# Skip captures that lose material in QSearch, and order the others by it
+QS_SEE = True
+# Late move reductions: below the root and from LMR_DEPTH on, quiet moves after
+# the first LMR_MOVES are searched a ply shallower, and again at full depth if
+# they fail high
+LMR = True
+LMR_MOVES = 3
+LMR_DEPTH = 3
+# Margins per ply of depth for reverse futility pruning (up to FUTILITY_DEPTH)
+# and razoring (up to RAZOR_DEPTH). A margin of 0 turns it off.
+FUTILITY_MARGIN = 120
+FUTILITY_DEPTH = 3
+RAZOR_MARGIN = 300
+RAZOR_DEPTH = 1
 
 
 ###############################################################################
@@ -225,30 +239,198 @@ class Position(namedtuple('Position', 'board score wc bc ep kp')):
                 score += pst['P'][119-(j+S)]
         return score
 
+    def see(self, move):
+        ''' Static exchange evaluation: the material we win on the target square
+            when both sides keep capturing there, least valuable piece first,
+            and each may stop when that pays. '''
+        i, j = move
+        board = list(self.board)
+        gain = [piece[board[j].upper()] if board[j].islower() else 0]
+        board[j], board[i] = board[i], '.'
+        if board[j] == 'P':
+            if A8 <= j <= H8:
+                board[j] = 'Q'
+                gain[0] += piece['Q'] - piece['P']
+            if j == self.ep:
+                board[j+S] = '.'
+                gain[0] += piece['P']
+        ours = False
+        while True:
+            a = least_attacker(board, j, ours)
+            if a is None:
+                break
+            gain.append(piece[board[j].upper()] - gain[-1])
+            board[j], board[a] = board[a], '.'
+            ours = not ours
+        while len(gain) > 1:
+            last = gain.pop()
+            gain[-1] = -max(-gain[-1], last)
+        return gain[0]
+
+    def in_check(self):
+        ''' Whether the opponent attacks our king '''
+        return least_attacker(self.board, self.board.index('K'), False) is not None
+
+
+def least_attacker(board, j, ours):
+    ''' The square of the least valuable piece attacking j, of us (upper case)
+        if ours, else of the opponent, or None '''
+    P, Nt, B, R, Q, K = 'PNBRQK' if ours else 'pnbrqk'
+    # Our pawns capture north, so they attack from the south
+    for d in ((S+E, S+W) if ours else (N+E, N+W)):
+        if board[j+d] == P:
+            return j+d
+    for d in directions['N']:
+        if board[j+d] == Nt:
+            return j+d
+    best, best_value = None, None
+    for d in directions['Q']:
+        for k in count(j+d, d):
+            q = board[k]
+            if q == '.':
+                continue
+            diagonal = d in (N+E, S+E, S+W, N+W)
+            if q == Q or q == (B if diagonal else R) or q == K and k == j+d:
+                if best is None or piece[q.upper()] < best_value:
+                    best, best_value = k, piece[q.upper()]
+            break
+    return best
+
+
 ###############################################################################
 # Search logic
 ###############################################################################
 
+_PAWNS = str.maketrans('NBRQKnbrqk', '..........')
+_PIECES = str.maketrans('', '', ' \n.Pp')
+
+def irreversible(board):
+    ''' The pawns and the pieces of board, which only captures and pawn moves
+        change. Positions with other keys can't be reached without them. '''
+    return board.translate(_PAWNS), ''.join(sorted(board.translate(_PIECES)))
+
+
 # lower <= s(pos) <= upper
-Entry = namedtuple('Entry', 'lower upper')
+# gen -- the search generation in which the entry was last written
+# rep -- the bounds depend on a repetition draw against the game history, and
+#        are thus only valid within the search that wrote them.
+Entry = namedtuple('Entry', 'lower upper gen rep')
+
+class Stats:
+    ''' Optional counters describing the most recent search. Attach an instance
+        as Searcher.stats to collect them; they are reset by every search. '''
 
-class Searcher:
     def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.nodes = 0          # all calls to bound, including qs
+        self.qnodes = 0         # calls at depth <= 0
+        self.tt_probes = 0
+        self.tt_hits = 0        # probes that found a usable entry
+        self.tt_cutoffs = 0     # probes that answered the node without search
+        self.cutoffs = 0        # beta cutoffs by a real move
+        self.first_cutoffs = 0  # ... of which by the first move searched
+        self.null_tries = 0
+        self.null_cutoffs = 0
+        self.futile = 0         # nodes cut by reverse futility pruning
+        self.razored = 0        # nodes answered by QSearch after razoring
+        self.reductions = 0     # late moves searched a ply shallower
+        self.researches = 0     # ... of which failed high and were searched again
+        self.iterations = []    # (depth, nodes, seconds) per finished depth
+        self.start = time.time()
+
+    def iteration(self, depth, nodes):
+        self.iterations.append((depth, nodes, time.time() - self.start))
+
+    def ebf(self):
+        ''' Effective branching factor, the geometric mean of the growth in
+            nodes between consecutive iterations. '''
+        if len(self.iterations) < 2:
+            return None
+        (d0, n0, _), (d1, n1, _) = self.iterations[0], self.iterations[-1]
+        return (float(n1) / max(n0, 1)) ** (1. / (d1 - d0))
+
+    def as_dict(self):
+        ratio = lambda a, b: float(a) / b if b else None
+        return {
+            'nodes': self.nodes, 'qnodes': self.qnodes,
+            'qs_share': ratio(self.qnodes, self.nodes),
+            'tt_probes': self.tt_probes, 'tt_hits': self.tt_hits,
+            'tt_cutoffs': self.tt_cutoffs,
+            'tt_hit_rate': ratio(self.tt_hits, self.tt_probes),
+            'cutoffs': self.cutoffs, 'first_cutoffs': self.first_cutoffs,
+            'first_cutoff_rate': ratio(self.first_cutoffs, self.cutoffs),
+            'null_tries': self.null_tries, 'null_cutoffs': self.null_cutoffs,
+            'futile': self.futile, 'razored': self.razored,
+            'reductions': self.reductions, 'researches': self.researches,
+            'iterations': [{'depth': d, 'nodes': n, 'time': round(t, 4)}
+                           for d, n, t in self.iterations],
+            'ebf': self.ebf()}
+
+    def to_json(self):
+        return json.dumps(self.as_dict(), sort_keys=True)
+
+
+class Searcher:
+    def __init__(self, stats=None):
         self.tp_score = {}
         self.tp_move = {}
         self.history = set()
         self.nodes = 0
+        self.stats = stats
+        # The tables are kept between searches (and games). Every call to search
+        # starts a new generation, which is used for aging and for invalidating
+        # the entries that depended on the history of the previous search.
+        self.generation = 0
+        # The generation in which positions with a given irreversible() key
+        # joined the history. Older entries of positions with that key never
+        # checked those for repetitions.
+        self.history_gen = {}
+        # Counts the number of times a score has been influenced by the history.
+        # Comparing it before and after a subtree tells us if the subtree result
+        # is safe to reuse in later searches.
+        self.reps = 0
+
+    def probe(self, pos, depth, root=True):
+        ''' Returns the table entry for the node, ignoring entries from earlier
+            searches that depended on a different game history, or that were
+            written before the history gained positions the node can reach. '''
+        entry = self.tp_score.get((pos, depth, root))
+        if entry is None and not root:
+            # A root searches all its moves, so its bounds hold below it too.
+            # In reverse game analysis the move played was the last root.
+            entry = self.tp_score.get((pos, depth, True))
+        if entry is None or entry.rep and entry.gen != self.generation:
+            return None
+        if entry.gen < self.generation and self.history_gen \
+                and self.history_gen.get(irreversible(pos.board), 0) > entry.gen:
+            return None
+        return entry
+
+    def age(self):
+        ''' Makes room in the score table by dropping entries written before the
+            current search. If the current search alone fills the table, we fall
+            back to clearing it. '''
+        gen = self.generation
+        self.tp_score = {k: e for k, e in self.tp_score.items() if e.gen == gen}
+        if len(self.tp_score) > TABLE_SIZE/2:
+            self.tp_score.clear()
 
     def bound(self, pos, gamma, depth, root=True):
         """ returns r where
                 s(pos) <= r < gamma    if gamma > s(pos)
                 gamma <= r <= s(pos)   if gamma <= s(pos)"""
         self.nodes += 1
+        stats = self.stats
 
         # Depth <= 0 is QSearch. Here any position is searched as deeply as is needed for
         # calmness, and from this point on there is no difference in behaviour depending on
         # depth, so so there is no reason to keep different depths in the transposition table.
         depth = max(depth, 0)
+        if stats:
+            stats.nodes += 1
+            stats.qnodes += depth == 0
 
         # Sunfish is a king-capture engine, so we should always check if we
         # still have a king. Notice since this is the only termination check,
@@ -266,26 +448,60 @@ class Searcher:
         # the new values for all the drawn positions.
         if DRAW_TEST:
             if not root and pos in self.history:
+                self.reps += 1
                 return 0
 
         # Look in the table if we have already searched this position before.
         # We also need to be sure, that the stored search was over the same
         # nodes as the current search.
-        entry = self.tp_score.get((pos, depth, root), Entry(-MATE_UPPER, MATE_UPPER))
+        entry = self.probe(pos, depth, root)
+        if stats:
+            stats.tt_probes += 1
+            stats.tt_hits += entry is not None
+        entry = entry or Entry(-MATE_UPPER, MATE_UPPER, 0, False)
+        if entry.rep:
+            # Anything derived from this entry depends on the history as well
+            self.reps += 1
         if entry.lower >= gamma and (not root or self.tp_move.get(pos) is not None):
+            if stats: stats.tt_cutoffs += 1
             return entry.lower
         if entry.upper < gamma:
+            if stats: stats.tt_cutoffs += 1
             return entry.upper
+        reps = self.reps
 
         # Here extensions may be added
         # Such as 'if in_check: depth += 1'
 
+        # Close to the horizon, trust the static score when it is far from gamma.
+        # Reverse futility: it is so far above gamma that the opponent is not
+        # expected to get it back within the remaining plies. Razoring: it is so
+        # far below that only captures may help, so QSearch decides. Neither is
+        # done in check, as the static score means nothing there, nor when the
+        # search is after a mate, which no margin covers.
+        if not root and 0 < depth <= max(FUTILITY_DEPTH, RAZOR_DEPTH) and abs(gamma) < MATE_LOWER:
+            if FUTILITY_MARGIN and depth <= FUTILITY_DEPTH \
+                    and pos.score - FUTILITY_MARGIN*depth >= gamma and not pos.in_check():
+                if stats: stats.futile += 1
+                return pos.score
+            if RAZOR_MARGIN and depth <= RAZOR_DEPTH \
+                    and pos.score + RAZOR_MARGIN*depth < gamma and not pos.in_check():
+                score = self.bound(pos, gamma, 0, root=False)
+                if score < gamma:
+                    if stats: stats.razored += 1
+                    return score
+
+        # First try not moving at all. We only do this if there is at least one major
+        # piece left on the board, since otherwise zugzwangs are too dangerous.
+        null = depth > 0 and not root and any(c in pos.board for c in 'RBNQ')
+
+        qs_safe = lambda move: not QS_SEE or pos.see(move) >= 0
+
         # Generator of moves to search in order.
         # This allows us to define the moves, but only calculate them if needed.
         def moves():
-            # First try not moving at all. We only do this if there is at least one major
-            # piece left on the board, since otherwise zugzwangs are too dangerous.
-            if depth > 0 and not root and any(c in pos.board for c in 'RBNQ'):
+            if null:
+                if stats: stats.null_tries += 1
                 yield None, -self.bound(pos.nullmove(), 1-gamma, depth-3, root=False)
             # For QSearch we have a different kind of null-move, namely we can just stop
             # and not capture anythign else.
@@ -296,21 +512,47 @@ class Searcher:
             # before. Also note that in QS the killer must be a capture, otherwise we
             # will be non deterministic.
             killer = self.tp_move.get(pos)
-            if killer and (depth > 0 or pos.value(killer) >= QS_LIMIT):
+            if killer and (depth > 0 or pos.value(killer) >= QS_LIMIT and qs_safe(killer)):
                 yield killer, -self.bound(pos.move(killer), 1-gamma, depth-1, root=False)
             # Then all the other moves
-            for move in sorted(pos.gen_moves(), key=pos.value, reverse=True):
+            if depth == 0 and QS_SEE:
+                # In QSearch we only try moves with high intrinsic score (captures and
+                # promotions), and skip the captures that lose the exchange.
+                ordered = sorted(((pos.see(move), move) for move in pos.gen_moves()
+                                  if pos.value(move) >= QS_LIMIT), reverse=True)
+                for gain, move in ordered:
+                    if gain >= 0:
+                        yield move, -self.bound(pos.move(move), 1-gamma, depth-1, root=False)
+                return
+            for i, move in enumerate(sorted(pos.gen_moves(), key=pos.value, reverse=True)):
             #for val, move in sorted(((pos.value(move), move) for move in pos.gen_moves()), reverse=True):
                 # If depth == 0 we only try moves with high intrinsic score (captures and
                 # promotions). Otherwise we do all moves.
                 if depth > 0 or pos.value(move) >= QS_LIMIT:
+                    # Late quiet moves rarely refute, so they first get a cheaper
+                    # search, and the full one only if they do fail high.
+                    if LMR and not root and depth >= LMR_DEPTH and i >= LMR_MOVES \
+                            and pos.board[move[1]] == '.' and pos.value(move) < QS_LIMIT:
+                        if stats: stats.reductions += 1
+                        score = -self.bound(pos.move(move), 1-gamma, depth-2, root=False)
+                        if score < gamma:
+                            yield move, score
+                            continue
+                        if stats: stats.researches += 1
                     yield move, -self.bound(pos.move(move), 1-gamma, depth-1, root=False)
 
         # Run through the moves, shortcutting when possible
         best = -MATE_UPPER
-        for move, score in moves():
+        for n, (move, score) in enumerate(moves()):
             best = max(best, score)
             if best >= gamma:
+                if stats:
+                    if move is not None:
+                        stats.cutoffs += 1
+                        # The null move or stand pat, if any, comes before the first move
+                        stats.first_cutoffs += n == (null or depth == 0)
+                    elif null:
+                        stats.null_cutoffs += 1
                 # Clear before setting, so we always have a value
                 if len(self.tp_move) > TABLE_SIZE: self.tp_move.clear()
                 # Save the move for pv construction and killer heuristic
@@ -333,23 +575,36 @@ class Searcher:
                 in_check = is_dead(pos.nullmove())
                 best = -MATE_UPPER if in_check else 0
 
-        # Clear before setting, so we always have a value
-        if len(self.tp_score) > TABLE_SIZE: self.tp_score.clear()
+        # Age before setting, so we always have a value
+        if len(self.tp_score) > TABLE_SIZE: self.age()
         # Table part 2
+        rep = entry.rep or self.reps != reps
         if best >= gamma:
-            self.tp_score[pos, depth, root] = Entry(best, entry.upper)
+            self.tp_score[pos, depth, root] = Entry(best, entry.upper, self.generation, rep)
         if best < gamma:
-            self.tp_score[pos, depth, root] = Entry(entry.lower, best)
+            self.tp_score[pos, depth, root] = Entry(entry.lower, best, self.generation, rep)
 
         return best
 
     def search(self, pos, history=()):
         """ Iterative deepening MTD-bi search """
         self.nodes = 0
+        if self.stats:
+            self.stats.reset()
+        # Entries from earlier searches are reused, except those marked as
+        # depending on the old history, which probe() ignores from now on.
+        # Positions added to the history may be repeated in the subtrees of
+        # older entries. Without captures or pawn moves a position only reaches
+        # those with the same pawns and pieces, so only those entries are
+        # dropped. Reaching a new history position by captures is missed, the
+        # usual approximation of transposition tables.
+        self.generation += 1
         if DRAW_TEST:
-            self.history = set(history)
-            # print('# Clearing table due to new history')
-            self.tp_score.clear()
+            history = set(history)
+            for new in history - self.history:
+                for board in (new.board, new.rotate().board):
+                    self.history_gen[irreversible(board)] = self.generation
+            self.history = history
 
         # In finished games, we could potentially go far enough to cause a recursion
         # limit exception. Hence we bound the ply.
@@ -369,9 +624,11 @@ class Searcher:
             # We want to make sure the move to play hasn't been kicked out of the table,
             # So we make another call that must always fail high and thus produce a move.
             self.bound(pos, lower, depth)
+            if self.stats:
+                self.stats.iteration(depth, self.nodes)
             # If the game hasn't finished we can retrieve our move from the
             # transposition table.
-            yield depth, self.tp_move.get(pos), self.tp_score.get((pos, depth, True)).lower
+            yield depth, self.tp_move.get(pos), self.probe(pos, depth).lower
 
 
 ###############################################################################
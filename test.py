@@ -20,6 +20,9 @@ import chess.engine
 import pathlib
 
 import amwafish
+import arena
+import bench
+import suite
 import tools
 
 ###############################################################################
@@ -96,111 +99,6 @@ def selfplay(secs=1):
         print("\nmove", tools.mrender(pos, m))
         pos = pos.move(m)
 
-def self_arena(version1, version2, games, secs, plus):
-    print('Playing {} games of {} vs. {} at {} secs/game + {} secs/move'
-            .format(games, version1, version2, secs, plus))
-    openings_file = os.path.join(os.path.dirname(__file__), 'tests/chessathome_openings.fen')
-    openings = random.sample(list(open(openings_file)), games)
-    pool = multiprocessing.Pool()
-    instances = [random.choice([
-        (version1, version2, secs, plus, fen),
-        (version2, version1, secs, plus, fen),
-        ]) for fen in openings]
-    wins = 0
-    losses = 0
-    for i, r in enumerate(pool.imap_unordered(play, instances)):
-        if r is None:
-            print('-', end='', flush=True)
-        if r == version1:
-            wins += 1
-            print('w', end='', flush=True)
-        if r == version2:
-            losses += 1
-            print('l', end='', flush=True)
-        if i % 80 == 79:
-            print()
-            print('{} wins, {} draws, {} losses out of {}'.format(wins,i+1-wins-losses,losses,i+1))
-    print()
-
-    print('Result: {} wins, {} draws, {} losses out of {}'.format(wins,games-wins-losses,losses,games))
-
-
-def play(version1_version2_secs_plus_fen):
-    ''' returns 1 if fish1 won, 0 for draw and -1 otherwise '''
-    version1, version2, secs, plus, fen = version1_version2_secs_plus_fen
-    modules = [importlib.import_module(version1), importlib.import_module(version2)]
-    searchers = []
-    for module in modules:
-        if hasattr(module, 'Searcher'):
-            searchers.append(module.Searcher())
-        else: searchers.append(module)
-    times = [secs, secs]
-    efactor = [1, 1]
-    pos = tools.parseFEN(fen)
-    seen = set()
-    for d in range(200):
-        moves_remain = 30
-        use = times[d%2]/moves_remain + plus
-        # Use a bit more time, if we have more on the clock than our opponent
-        use += (times[d%2] - times[(d+1)%2])/10
-        use = max(use, plus)
-        t = time.time()
-        m, score, depth = tools.search(searchers[d%2], pos, use*efactor[d%2])
-        efactor[d%2] *= (use/(time.time() - t))**.5
-        times[d%2] -= time.time() - t
-        times[d%2] += plus
-        #print('Used {:.2} rather than {:.2}. Off by {:.2}. Remaining: {}'
-            #.format(time.time()-t, use, (time.time()-t)/use, times[d%2]))
-        if times[d%2] < 0:
-            print('{} ran out of time'.format(version2 if d%2 == 1 else version1))
-            return version1 if d%2 == 1 else version2
-            pass
-
-        if m is None:
-            print('Game not done, but no move? Score', score)
-            name = version1 if d%2 == 0 else version2
-            print(version1, tools.renderFEN(pos))
-            assert False
-
-        # Test move
-        is_dead = lambda pos: any(pos.value(m) >= amwafish.MATE_LOWER for m in pos.gen_moves())
-        if is_dead(pos.move(m)):
-            name = version1 if d%2 == 0 else version2
-            print('{} made an illegal move {} in position {}. Depth {}, Score {}'.
-                    format(name, tools.mrender(pos,m), tools.renderFEN(pos), depth, score))
-            return version2 if d%2 == 0 else version1
-            #assert False
-
-        # Make the move
-        pos = pos.move(m)
-
-        # Test repetition draws
-        # This is by far the most common type of draw
-        if pos in seen:
-            #print('Rep time at end', times)
-            return None
-        seen.add(pos)
-
-        any_moves = not all(is_dead(pos.move(m)) for m in pos.gen_moves())
-        in_check = is_dead(pos.nullmove())
-        if not any_moves:
-            if not in_check:
-                # This is actually a bit interesting. Why would we ever throw away a win like this?
-                name = version1 if d%2 == 0 else version2
-                print('{} stalemated? depth {} {}'.format(
-                    name, depth, tools.renderFEN(pos)))
-                if score != 0:
-                    print('it got the wrong score: {} != 0'.format(score))
-                return None
-            else:
-                name = version1 if d%2 == 0 else version2
-                if score < amwafish.MATE_LOWER:
-                    print('{} mated, but did not realize. Only scored {} in position {}, depth {}'.format(name, score, tools.renderFEN(pos), depth))
-                return name
-    print('Game too long', tools.renderFEN(pos))
-    return None
-
-
 ###############################################################################
 # Test Xboard
 ###############################################################################
@@ -295,9 +193,10 @@ def test_uci(python='python3', protocol='uci'):
 # Perft test
 ###############################################################################
 
-def allperft(f, depth=4, verbose=True):
-    import gc
+def allperft(f, depth=4, verbose=True, processes=1):
     lines = f.readlines()
+    # With more than one process, the root moves of each position are split over a pool
+    pool = multiprocessing.Pool(processes) if processes != 1 else None
     for d in range(1, depth+1):
         if verbose:
             print("Going to depth {}/{}".format(d, depth))
@@ -309,14 +208,13 @@ def allperft(f, depth=4, verbose=True):
                 print(parts[0])
 
             pos, score = tools.parseFEN(parts[0]), int(parts[d])
-            res = sum(1 for _ in tools.collect_tree_depth(tools.expand_position(pos), d))
+            res = sum(n for _, n in tools.divide(pos, d, pool))
             if res != score:
                 print('=========================================')
                 print('ERROR at depth %d. Gave %d rather than %d' % (d, res, score))
                 print('=========================================')
                 print(tools.renderFEN(pos,0))
-                for move in pos.gen_moves():
-                    split = sum(1 for _ in tools.collect_tree_depth(tools.expand_position(pos.move(move)),1))
+                for move, split in tools.divide(pos, d, pool):
                     print('{}: {}'.format(tools.mrender(pos, move), split))
                 return False
         if verbose:
@@ -328,104 +226,38 @@ def allperft(f, depth=4, verbose=True):
 # Find mate test
 ###############################################################################
 
-def allmate(path):
-    with open(path) as f:
-        for line in f:
-            line = line.strip()
-            print(line)
-
-            pos = chess.Board(line)
-            _, score, _ = amwafish.search(amwafish.Searcher(), pos, secs=3600)
-            if score < amwafish.MATE_LOWER:
-                print("Unable to find mate. Only got score = %d" % score)
-                break
+def allmate(f, secs=3600, nodes=None, processes=None, report=None, module='amwafish'):
+    """ Searches every position until a mate is found """
+    return suite.run_suite(suite.mate_task, suite.read_lines(f), processes, report,
+                           module=module, secs=secs, nodes=nodes)
 
-def quickdraw(f, depth):
-    k, n = 0, 0
-    for line in f:
-        line = line.strip()
-        print(line)
-        n += 1
+def quickdraw(f, depth, secs=None, nodes=None, processes=None, report=None, module='amwafish'):
+    """ Uses null window searches to show that positions are drawn """
+    return suite.run_suite(suite.bound_task, suite.read_lines(f), processes, report,
+                           module=module, mindepth=depth, maxdepth=9, secs=secs, nodes=nodes)
 
-        pos = amwafish.Position(chess.Board(line))
-        searcher = amwafish.Searcher()
-        for d in range(depth, 10):
-            s0 = searcher.bound(pos, 0, d, root=True)
-            s1 = searcher.bound(pos, 1, d, root=True)
-            if s0 >= 0 and s1 < 1:
-                k += 1
-                break
-            else:
-                print('depth {}, s0 {}, s1 {}'.format(d, s0, s1))
-            #print(d, s0, s1, tools.pv(0, pos))
-        else:
-            print("Fail: Unable to find draw!")
-            #return
-        #print(tools.pv(searcher, pos, False))
-    print('Found {}/{} draws'.format(k,n))
-
-def quickmate(f, min_depth=1):
-    """ Similar to allmate, but uses the `bound` function directly to only
+def quickmate(f, min_depth=1, secs=None, nodes=None, processes=None, report=None, module='amwafish'):
+    """ Similar to allmate, but uses null window searches to only
     search for moves that will win us the game """
-    for line in f:
-        line = line.strip()
-        print(line)
-
-        pos = amwafish.Position(chess.Board(line))
-        searcher = amwafish.Searcher()
-        for d in range(min_depth, 99):
-            score = searcher.bound(pos, amwafish.MATE_LOWER, d, d, root=True)
-            if score >= amwafish.MATE_LOWER:
-                print(searcher.tp_move.get(pos))
-                break
-            print('Score at depth {}: {}'.format(d, score))
-        else:
-            print("Unable to find mate. Only got score = %d" % score)
-            return
-        #print(tools.pv(searcher, pos, include_scores=False))
+    return suite.run_suite(suite.bound_task, suite.read_lines(f), processes, report,
+                           module=module, mindepth=min_depth, secs=secs, nodes=nodes,
+                           gamma=amwafish.MATE_LOWER)
 
 
 ###############################################################################
 # Best move test
 ###############################################################################
 
-def findbest(f, times):
-    pos = chess.Board()
-    searcher = amwafish.Searcher()
-
+def findbest(f, times, nodes=None, processes=None, report=None, module='amwafish'):
+    """ Searches each position once, for the longest of the times, and reports
+    the best move found at each of the times. """
     print('Printing best move after seconds', times)
     print('-'*60)
-    totalpoints = 0
-    totaltests = 0
-    for line in f:
-        opts = pos.set_epd(line)
-        #am = pos.epd()
-        # fen, opts = tools.parseEPD(line, opt_dict=True)
-        # if type(opts) != dict or ('am' not in opts and 'bm' not in opts):
-        #     print("Line didn't have am/bm in opts", line, opts)
-        #     continue
-        #pos = tools.parseFEN(fen)
-        # am -> avoid move; bm -> best move
-
-        am = opts['am'] if 'am' in opts else None
-        bm = opts['bm'] if 'bm' in opts else None
-        print('Looking for am/bm', opts.get('am'), opts.get('bm'))
-        points = 0
-        print(opts.get('id','unnamed'), end=' ', flush=True)
-        for t in times:
-            move, _, _ = amwafish.search(searcher, pos, t)
-            mark = pos.san(move)
-            if am and move != am or bm and move == bm:
-                mark += '(1)'
-                points += 1
-            else:
-                mark += '(0)'
-            print(mark, end=' ', flush=True)
-            totaltests += 1
-        print(points)
-        totalpoints += points
-    print('-'*60)
-    print('Total Points: %d/%d', totalpoints, totaltests)
+    summary = suite.run_suite(suite.findbest_task, suite.read_lines(f), processes, report,
+                              module=module, times=times, nodes=nodes)
+    totalpoints = sum(r['points'] for r in summary['results'])
+    print('Total Points: {}/{}'.format(totalpoints, len(times)*summary['total']))
+    return summary
 
 
 ###############################################################################
@@ -433,11 +265,22 @@ def findbest(f, times):
 ###############################################################################
 
 def add_action(parser, f):
-    class LambdaAction(argparse.Action):
-        def __call__(self, parser, namespace, values, option_string=None):
-            f(namespace)
-    parser.add_argument('_action', nargs='?',
-        help=argparse.SUPPRESS, action=LambdaAction)
+    # The action is run by main once all arguments are parsed, such that options
+    # given after the positional arguments are seen as well.
+    parser.set_defaults(_action=f)
+
+def add_suite_arguments(parser, secs=None):
+    if secs is not None:
+        parser.add_argument('--secs', type=float, default=secs,
+            help='maximum number of seconds to search each position. Default=%(default)s.')
+    parser.add_argument('--nodes', type=int, default=None,
+        help='maximum number of nodes to search each position.')
+    parser.add_argument('--processes', type=int, default=0,
+        help='number of positions to search in parallel, 0 for all cores. Default=%(default)s.')
+    parser.add_argument('--report', metavar='FILE', type=str, default=None,
+        help='write the results as json to this file.')
+    parser.add_argument('--module', type=str, default='amwafish',
+        help='amwafish.py file (without .py) to test. Default=%(default)s.')
 
 def main():
     parser = argparse.ArgumentParser(
@@ -449,15 +292,25 @@ def main():
     p.add_argument('--depth', type=int, default=2)
     p.add_argument('file', type=argparse.FileType('r'),
         help='such as tests/queen.fen.')
-    add_action(p, lambda n: allperft(n.file, n.depth))
+    p.add_argument('--processes', type=int, default=1,
+        help='number of processes to split the root moves over, 0 for all cores. Default=%(default)s.')
+    add_action(p, lambda n: allperft(n.file, n.depth, processes=n.processes or None))
+
+    p = subparsers.add_parser('allmate',
+        help='searches the positions until a mate is found.')
+    p.add_argument('file', type=argparse.FileType('r'),
+        help='such as tests/mate{1,2,3}.fen.')
+    add_suite_arguments(p, secs=60)
+    add_action(p, lambda n: allmate(n.file, n.secs, n.nodes, n.processes or None, n.report, n.module))
 
     p = subparsers.add_parser('quickmate',
-        help='uses the `bound` function directly to search for moves that will win us the game.')
+        help='uses null window searches directly to search for moves that will win us the game.')
     p.add_argument('file', type=argparse.FileType('r'),
         help='such as tests/mate{1,2,3}.fen.')
     p.add_argument('--mindepth', type=int, default=3, metavar='D',
         help='optional minimum number of plies to search for.')
-    add_action(p, lambda n: quickmate(n.file, n.mindepth))
+    add_suite_arguments(p, secs=60)
+    add_action(p, lambda n: quickmate(n.file, n.mindepth, n.secs, n.nodes, n.processes or None, n.report, n.module))
 
     p = subparsers.add_parser('quickdraw',
             help='solve draw puzzles')
@@ -465,7 +318,8 @@ def main():
         help='such as tests/stalemate2.fen.')
     p.add_argument('--mindepth', type=int, default=3, metavar='D',
         help='optional minimum number of plies to search for.')
-    add_action(p, lambda n: quickdraw(n.file, n.mindepth))
+    add_suite_arguments(p, secs=60)
+    add_action(p, lambda n: quickdraw(n.file, n.mindepth, n.secs, n.nodes, n.processes or None, n.report, n.module))
 
     p = subparsers.add_parser('xboard',
         help='starts the tools.py script and runs a few commands.')
@@ -480,16 +334,11 @@ def main():
     add_action(p, lambda n: selfplay(n.secs))
 
     p = subparsers.add_parser('arena',
-        help='run a number of games between two amwafish versions.')
+        help='play two engine versions against each other on paired openings, with optional SPRT.')
     p.add_argument('fish1', type=str, help='amwafish')
     p.add_argument('fish2', type=str, help='amwafish2')
-    p.add_argument('--games', type=int, default=10,
-        help='number of games to play. Default=%(default)s.')
-    p.add_argument('--seconds', type=float, default=20,
-        help='number of seconds to search per game. Default=%(default)s.')
-    p.add_argument('--plus', type=float, default=.1,
-        help='seconds time increment per move. Default=%(default)s.')
-    add_action(p, lambda n: self_arena(n.fish1, n.fish2, n.games, n.seconds, n.plus))
+    arena.add_arguments(p)
+    add_action(p, arena.run_args)
 
     p = subparsers.add_parser('findbest',
         help='reports the best moves found at certain positions after certain intervals of time.')
@@ -498,7 +347,8 @@ def main():
     p.add_argument('--times', type=int, nargs='+',
         help='a list of times (in seconds) at which to report the best move. Default is %(default)s.',
         default=[15, 30, 60, 120])
-    add_action(p, lambda n: findbest(n.file, n.times))
+    add_suite_arguments(p)
+    add_action(p, lambda n: findbest(n.file, n.times, n.nodes, n.processes or None, n.report, n.module))
 
     p = subparsers.add_parser('unstable',
         help='helps debug unstable positions')
@@ -508,16 +358,25 @@ def main():
         help='Search a few positions to a fixed depth (IID), and measure the time it took.')
     add_action(p, lambda n: benchmark())
 
+    p = subparsers.add_parser('bench',
+        help='search a fixed set of positions with a cold table and print a node signature.')
+    p.add_argument('module', type=str, default='sunfish', nargs='?',
+        help='sunfish.py or amwafish.py file (without .py).')
+    bench.add_arguments(p)
+    add_action(p, bench.run_args)
+
     # suite = unittest.defaultTestLoader.loadTestsFromTestCase(Tests)
     # p = subparsers.add_parser('unittest',
     #         help='Deprecated: use python -m unittest test.Tests')
     # add_action(p, lambda n: unittest.TextTestRunner().run(suite))
 
-    _args, unknown = parser.parse_known_args()
+    args, unknown = parser.parse_known_args()
     if unknown:
         print('Notice: unused arguments', ' '.join(unknown))
     if len(sys.argv) == 1:
         parser.print_help()
+    elif hasattr(args, '_action'):
+        args._action(args)
 
 # Old Python compatability
 if sys.version_info < (3,5):
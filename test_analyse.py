@@ -0,0 +1,46 @@
+import io
+import unittest
+
+import analyse
+
+
+class TestAnalyse(unittest.TestCase):
+
+    def test_read_positions(self):
+        epd = io.StringIO('1k1r4/pp1b1R2/3q2pp/4p3/2B5/4Q3/PPP2B2/2K5 b - - bm Qd1+; id "BK.01";\n')
+        jobs = list(analyse.read_positions(epd))
+        self.assertEqual(jobs, [{'fen': '1k1r4/pp1b1R2/3q2pp/4p3/2B5/4Q3/PPP2B2/2K5 b - - 0 1',
+                                 'id': 'BK.01'}])
+        pgn = io.StringIO('1. e4 e5 2. Nf3 *\n')
+        self.assertEqual([job['played'] for job in analyse.read_positions(pgn)],
+                         ['e2e4', 'e7e5', 'g1f3'])
+
+    def test_analyse_position(self):
+        for engine in ('sunfish', 'amwafish'):
+            job = {'fen': '6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1'}
+            res = analyse.analyse_position(job, engine, depth=3)
+            self.assertEqual((res['move'], res['depth']), ('d1d8', 3), engine)
+            self.assertEqual(res['pv'][0], 'd1d8')
+
+    def test_analyse_game(self):
+        """Every move gets a loss, and the move allowing mate is a blunder"""
+        pgn = io.StringIO('1. e4 e5 2. Qh5 Nc6 3. Bc4 Nf6 4. Qxf7# 1-0\n')
+        job = next(analyse.read_games(pgn))
+        for reverse in (False, True):
+            res = analyse.analyse_game(job, 'sunfish', depth=4, reverse=reverse)
+            self.assertEqual(len(res), 7)
+            self.assertEqual([r['ply'] for r in res if r['blunder']], [5])
+
+    def test_analyse_game_reuse(self):
+        """One searcher for the game costs less than a new one per position"""
+        pgn = io.StringIO('1. e4 e5 2. Nf3 Nc6 3. Bb5 a6 4. Ba4 Nf6 5. O-O Be7 *\n')
+        job = next(analyse.read_games(pgn))
+        cold = sum(analyse.analyse_position({'fen': fen}, 'sunfish', depth=4)['nodes']
+                   for fen in job['fens'])
+        for reverse in (False, True):
+            res = analyse.analyse_game(job, 'sunfish', depth=4, reverse=reverse)
+            self.assertLess(sum(r['nodes'] for r in res), cold, reverse)
+
+
+if __name__ == "__main__":
+    unittest.main()
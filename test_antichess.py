@@ -1,6 +1,8 @@
 import unittest
 import amwafish
 import chess
+import chess.variant
+import evaluation
 
 class TestAntiChess(unittest.TestCase):
 
@@ -14,6 +16,31 @@ class TestAntiChess(unittest.TestCase):
         depth, move, score = next(amwafish.search(self._searcher, board, 0.01, variant="giveaway"))
         self.assertEqual(move, chess.Move.from_uci('a2b4'))
 
+    def test_forced_move(self):
+        """A single legal move is played without search"""
+        board = chess.variant.AntichessBoard("6R1/8/8/8/1p6/8/N1P4P/6NR w - - 0 22")
+        results = list(self._searcher.search(board, evaluation.Antichess(), maxdepth=10))
+        self.assertEqual([(depth, move) for depth, move, _, _ in results], [(1, chess.Move.from_uci('a2b4'))])
+        self.assertEqual(self._searcher.nodes, 0)
+
+    def test_captures(self):
+        """When there are captures, only captures are searched"""
+        board = chess.variant.AntichessBoard("rnbqkbnr/pp1ppppp/8/2p5/1P1P4/8/P1P1PPPP/RNBQKBNR w - - 0 3")
+        for depth, move, score, moves in self._searcher.search(board, evaluation.Antichess(), maxdepth=4):
+            pass
+        self.assertIn(move.uci(), ('b4c5', 'd4c5'))
+        self.assertEqual(depth, 3)
+
+    def test_evaluation(self):
+        """Fewer pieces is better, and so is attacking the lowest piece last"""
+        ev = evaluation.Antichess()
+        score = lambda fen: ev(amwafish.Position(chess.variant.AntichessBoard(fen), ev))
+        self.assertEqual(score("k7/8/8/8/8/8/8/7K w - - 0 1"), 0)
+        self.assertEqual(score("k7/p7/8/8/8/8/8/7K w - - 0 1"), 100)
+        # The white king attacks the pawn, the pawn attacks the king
+        self.assertEqual(score("k7/8/8/8/8/8/1p6/K7 w - - 0 1"), 100 + -100 - -300)
+
+
 if __name__ == "__main__":
     import logging
     logging.basicConfig(level=logging.INFO)
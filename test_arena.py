@@ -0,0 +1,23 @@
+import unittest
+
+import arena
+
+
+class TestArena(unittest.TestCase):
+
+    def test_elo(self):
+        self.assertAlmostEqual(arena.elo(arena.expected_score(100)), 100)
+        e, err = arena.elo_interval([.5, .75, .25, .5])
+        self.assertAlmostEqual(e, 0)
+        self.assertGreater(err, 0)
+
+    def test_llr(self):
+        lower, upper = arena.sprt_bounds(.05, .05)
+        strong = [1, .75, .5, .75] * 50
+        weak = [0, .25, .5, .25] * 50
+        self.assertGreater(arena.llr(strong, 0, 10), upper)
+        self.assertLess(arena.llr(weak, 0, 10), lower)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,20 @@
+import unittest
+
+import amwafish
+import bench
+import sunfish
+
+
+class TestBench(unittest.TestCase):
+
+    def test_signature(self):
+        """The signature only depends on the search, not on the run"""
+        for module, depth in ((sunfish, 3), (amwafish, 1)):
+            first, second = bench.run(module, depth, verbose=False), bench.run(module, depth, verbose=False)
+            self.assertEqual(first['signature'], second['signature'], module.__name__)
+            self.assertEqual(first['signature'], sum(p['nodes'] for p in first['positions']))
+            self.assertEqual(len(first['positions']), len(bench.BENCH_POSITIONS))
+
+
+if __name__ == "__main__":
+    unittest.main()
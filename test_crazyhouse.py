@@ -1,6 +1,7 @@
 import unittest
 import amwafish
 import chess
+import chess.variant
 import evaluation
 
 class TestCrazyHouse(unittest.TestCase):
@@ -18,6 +19,37 @@ class TestCrazyHouse(unittest.TestCase):
         self.assertEqual(move, chess.Move.from_uci('d7e6'))
         print(score)
 
+    def test_pockets(self):
+        """Pieces in hand count as material, so a drop gains only its square"""
+        board = chess.variant.CrazyhouseBoard("4k3/8/8/8/8/8/8/4K3/Nq w - - 0 1")
+        ev = evaluation.get_evaluation_function("crazyhouse")
+        pos = amwafish.Position(board, ev)
+        self.assertEqual(ev(pos), evaluation.Classical()(pos) + 280 - 929)
+        self.assertEqual(pos.value(chess.Move.from_uci("N@e4")) - ev(pos),
+                         evaluation.psqt[chess.KNIGHT][evaluation.transform(chess.E4, chess.WHITE)])
+
+    def test_depth(self):
+        """Drops do not keep the search from reaching depth 3"""
+        board = chess.variant.CrazyhouseBoard(
+            "r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R/Pn w KQkq - 4 4")
+        depths = [depth for depth, _, _, _ in self._searcher.search(
+            board, evaluation.get_evaluation_function("crazyhouse"), maxdepth=4)]
+        self.assertEqual(depths, [1, 2, 3])
+
+    def test_only_drops(self):
+        """Quiet drops are not all pruned when there is nothing else, or in check"""
+        searcher = amwafish.Searcher()
+        searcher.is_tactical_drop = lambda board, move: False
+        ev = evaluation.get_evaluation_function("crazyhouse")
+        # The king and the pawn can't move, and in the second the king is in check
+        for fen in ("1r5k/8/8/8/8/p7/P7/K7/N w - - 0 1", "1r5k/8/8/8/8/p7/P7/K6r/N w - - 0 1"):
+            board = chess.variant.CrazyhouseBoard(fen)
+            self.assertTrue(all(move.drop for move in board.legal_moves))
+            for depth, move, score, _ in searcher.search(board, ev, maxdepth=2):
+                self.assertIsNotNone(move)
+                self.assertTrue(move.drop)
+                self.assertLess(abs(score), amwafish.MATE_LOWER)
+
 if __name__ == "__main__":
     import logging
     logging.basicConfig(level=logging.INFO)
@@ -0,0 +1,40 @@
+import unittest
+
+import enginepool
+
+
+class TestEnginePool(unittest.TestCase):
+
+    def test_games(self):
+        """Workers play a game per lease, and are replaced after max_games"""
+        with enginepool.EnginePool(1, max_games=1) as pool:
+            pids = set()
+            for _ in range(2):
+                with pool.acquire() as engine:
+                    pids.add(engine._worker.process.pid)
+                    for command in ('uci', 'ucinewgame', 'position startpos', 'go nodes 100'):
+                        engine.send(command)
+                    line = engine.readline()
+                    while not line.startswith('bestmove'):
+                        line = engine.readline()
+            self.assertEqual(len(pids), 2)
+
+    def test_dead_worker(self):
+        """A worker that dies ends its lease with EngineDied, and is replaced"""
+        with enginepool.EnginePool(1) as pool:
+            with pool.acquire() as engine:
+                pid = engine._worker.process.pid
+                engine._worker.process.kill()
+                with self.assertRaises(enginepool.EngineDied):
+                    engine.readline()
+                self.assertIsNone(engine.readline())
+                with self.assertRaises(enginepool.EngineDied):
+                    engine.send('uci')
+            with pool.acquire(timeout=5) as engine:
+                self.assertNotEqual(engine._worker.process.pid, pid)
+                engine.send('uci')
+                self.assertIsNotNone(engine.readline())
+
+
+if __name__ == "__main__":
+    unittest.main()
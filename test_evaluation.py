@@ -0,0 +1,112 @@
+import random
+import unittest
+
+import chess
+
+import amwafish
+import evaluation
+
+
+def random_boards(n, seed=0):
+    random.seed(seed)
+    board, boards = chess.Board(), []
+    for _ in range(n):
+        if board.is_game_over():
+            board = chess.Board()
+        board.push(random.choice(list(board.legal_moves)))
+        boards.append(board.copy(stack=False))
+    return boards
+
+
+class TestAttackMap(unittest.TestCase):
+
+    def test_attack_map(self):
+        """The map agrees with the attacks of python-chess"""
+        for board in random_boards(50):
+            attacks = evaluation.AttackMap(board)
+            for color in chess.COLORS:
+                for square in chess.SQUARES:
+                    attackers = board.attackers(color, square)
+                    self.assertEqual(attacks.is_attacked(color, square), bool(attackers))
+                    self.assertEqual(attacks.count(color, square), len(attackers))
+                    self.assertEqual(attacks.lowest_attacker(color, square),
+                                     min((board.piece_type_at(s) for s in attackers), default=None))
+            for square in chess.SquareSet(board.occupied):
+                self.assertEqual(attacks.mobility(square), len(board.attacks(square)))
+
+    def test_terms(self):
+        """Terms give the same scores with a shared map"""
+        for board in random_boards(50, seed=1):
+            pos = amwafish.Position(board, None, 0)
+            attacks = evaluation.AttackMap(board)
+            for color in chess.COLORS:
+                self.assertEqual(evaluation.piece_activity(pos, color),
+                                 evaluation.piece_activity(pos, color, attacks))
+                for square in chess.SQUARES:
+                    self.assertEqual(evaluation.activity(board, square),
+                                     evaluation.activity(board, square, attacks))
+
+
+class TestFuse(unittest.TestCase):
+
+    def test_fuse(self):
+        """A fused function equals walking the board once per term"""
+        terms = [evaluation.material(evaluation.pieces), evaluation.activity]
+        fused = evaluation.fuse(terms, [evaluation.psqt])
+        for board in random_boards(50, seed=2):
+            expected = 0
+            for square in chess.SquareSet(board.occupied):
+                color = board.color_at(square)
+                value = evaluation.psqt[board.piece_type_at(square)][evaluation.transform(square, color)]
+                value += sum(term(board, square) for term in terms)
+                expected += value if color == chess.WHITE else -value
+            self.assertEqual(fused(board), expected)
+
+
+class TestPawnHash(unittest.TestCase):
+
+    def test_structure(self):
+        board = chess.Board('8/p4k2/1p6/8/2P5/2P5/4PK2/8 w - - 0 1')
+        pawns = evaluation.PawnHash()
+        self.assertEqual(pawns.passed(board, chess.WHITE), chess.BB_E2)
+        self.assertEqual(pawns.passed(board, chess.BLACK), chess.BB_A7)
+        space = evaluation.Space()
+        pos = amwafish.Position(board, None, 0)
+        advance = space(pos, chess.WHITE) - space(pos, chess.BLACK)
+        # Doubled and isolated c pawns, isolated e pawn, both passed pawns on
+        # their second rank
+        self.assertEqual(pawns(pos), advance - 10 - 3 * 15 + 5 - 5)
+        self.assertEqual((pawns.hits, pawns.misses), (2, 1))
+
+    def test_hit_rate(self):
+        pawns = evaluation.PawnHash()
+        board = chess.Board('r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4')
+        searcher = amwafish.Searcher()
+        # Every evaluation probes the pawns, not just the ones the searcher has no score for
+        searcher.evalcache = None
+        for _ in searcher.search(board, evaluation.Classical(pawns), maxdepth=4):
+            pass
+        # Over 95% in longer searches
+        self.assertGreater(pawns.hits, 0.9 * (pawns.hits + pawns.misses))
+
+
+class TestEvaluateBatch(unittest.TestCase):
+
+    def test_evaluate_batch(self):
+        """The batch terms equal the terms of the single board evaluation"""
+        boards = random_boards(200)
+        scores = evaluation.evaluate_batch(boards)
+        material = evaluation.MaterialBalance(evaluation.Classical.pieces)
+        space = evaluation.Space()
+        for i, board in enumerate(boards):
+            pos = amwafish.Position(board, None, 0)
+            self.assertEqual(scores['psqt'][i], evaluation.Classical()(pos))
+            self.assertEqual(scores['material'][i], material(pos, chess.WHITE) - material(pos, chess.BLACK))
+            self.assertEqual(scores['space'][i], space(pos, chess.WHITE) - space(pos, chess.BLACK))
+
+    def test_empty(self):
+        self.assertEqual(len(evaluation.evaluate_batch([])['psqt']), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import random
+import unittest
+
+import chess
+
+import amwafish
+import evaluation
+import nnue
+
+
+class TestNNUE(unittest.TestCase):
+
+    def test_psqt_network(self):
+        """The psqt network evaluates like Classical, with incremental updates"""
+        ev = nnue.NNUE(nnue.Network(**nnue.psqt_network()))
+        board = chess.Board()
+        pos = amwafish.Position(board, ev, 0)
+        random.seed(1)
+        for _ in range(40):
+            board.push(random.choice(list(board.legal_moves)))
+            self.assertEqual(ev(pos), evaluation.Classical()(pos), board.fen())
+        self.assertEqual(ev.refreshes, 1)
+
+    def test_incremental(self):
+        """Updating the accumulators gives the same scores as refreshing them"""
+        network = nnue.Network(**nnue.psqt_network(hidden=8, l1=4, seed=1))
+        ev = nnue.NNUE(network)
+        board = chess.Board('r3k2r/pppq1ppp/2npbn2/4p3/2B1P3/2NP1N2/PPPQ1PPP/R3K2R w KQkq - 0 1')
+        pos = amwafish.Position(board, ev, 0)
+        for move in list(board.legal_moves):
+            board.push(move)
+            for reply in list(board.legal_moves)[:5]:
+                board.push(reply)
+                self.assertEqual(ev(pos), nnue.NNUE(network)(pos), board.fen())
+                board.pop()
+            board.pop()
+        self.assertGreater(ev.updates, ev.refreshes)
+
+    def test_search(self):
+        ev = nnue.NNUE(nnue.Network(**nnue.psqt_network()))
+        board = chess.Board('6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1')
+        for _, move, _, _ in amwafish.Searcher().search(board, ev, maxdepth=4):
+            pass
+        self.assertEqual(move.uci(), 'd1d8')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import tempfile
+import unittest
+
+import chess
+
+import positions
+import tools
+
+QUEEN_FEN = os.path.join(os.path.dirname(__file__), 'tests/queen.fen')
+
+
+class TestPositions(unittest.TestCase):
+
+    def setUp(self):
+        with open(QUEEN_FEN) as f:
+            self._fens = [line.split(';')[0] for line in f.readlines()[:50]]
+
+    def test_round_trip(self):
+        for fen in self._fens:
+            board = chess.Board(fen)
+            data = positions.from_board(board)
+            self.assertEqual(len(data), positions.POSITION_SIZE)
+            self.assertEqual(positions.to_fen(data), board.fen())
+            self.assertEqual(positions.to_position(data), tools.parseFEN(fen))
+
+    def test_dataset(self):
+        fd, path = tempfile.mkstemp(suffix='.bin')
+        os.close(fd)
+        try:
+            with positions.Writer(path) as writer:
+                for fen in self._fens:
+                    pos = tools.parseFEN(fen)
+                    move = next(pos.gen_moves())
+                    writer.write(positions.from_position(pos),
+                                 positions.encode_move(move, tools.get_color(pos)), 10, 1)
+            data = positions.Dataset(path)
+            self.assertEqual(len(data), len(self._fens))
+            pieces = data.pieces()
+            for i, fen in enumerate(self._fens):
+                board = data.board(i)
+                self.assertEqual(board.board_fen(), chess.Board(fen).board_fen())
+                self.assertIn(positions.decode_move(int(data[i]['move'])), board.pseudo_legal_moves)
+                for square in chess.SQUARES:
+                    piece = board.piece_at(square)
+                    self.assertEqual(pieces[i, square],
+                                     piece and positions.CODES[piece.color, piece.piece_type] or 0)
+            del data
+        finally:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    unittest.main()
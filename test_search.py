@@ -1,8 +1,11 @@
 import unittest
 import amwafish
 import chess
+import chess.variant
 import evaluation
 import time
+import types
+import uci
 from parameterized import parameterized
 
 class Dummy(object):
@@ -79,5 +82,94 @@ class BestMoveTest(unittest.TestCase):
         print(move)
         self.assertEqual(move, chess.Move.from_uci(best))
 
+class SeeTest(unittest.TestCase):
+
+    def see(self, fen, move):
+        return amwafish.see(chess.Board(fen), chess.Move.from_uci(move))
+
+    def test_see(self):
+        self.assertEqual(self.see('1k1r4/1pp4p/p7/4p3/8/P5P1/1PP4P/2K1R3 w - - 0 1', 'e1e5'), 100)
+        self.assertEqual(self.see('1k1r3q/1ppn3p/p4b2/4p3/8/P2N2P1/1PP1R1BP/2K1Q3 w - - 0 1', 'd3e5'), -180)
+        self.assertEqual(self.see('4k3/8/2p5/3p4/4P3/8/8/3QK3 w - - 0 1', 'd1d5'), 100 - 929 + 100)
+        self.assertEqual(self.see('3rk3/8/8/3r4/8/3R4/3R4/4K3 w - - 0 1', 'd3d5'), 479)
+        self.assertEqual(self.see('3rk3/8/8/3r4/8/3R4/2P5/4K3 b - - 0 1', 'd5d3'), 100)
+        self.assertEqual(self.see('4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 1', 'e5d6'), 100)
+        self.assertEqual(self.see('r3k3/1P6/8/8/8/8/8/4K3 w - - 0 1', 'b7b8q'), -100)
+
+
+class TableTest(unittest.TestCase):
+
+    def test_size(self):
+        """The table kept between searches never grows beyond TABLE_SIZE"""
+        size, amwafish.TABLE_SIZE = amwafish.TABLE_SIZE, 200
+        try:
+            searcher = amwafish.Searcher()
+            board = chess.Board('r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4')
+            ev = evaluation.get_evaluation_function()
+            for move in ('e1g1', 'f8c5', 'd2d3'):
+                for _ in searcher.search(board, ev, maxdepth=4):
+                    self.assertLessEqual(len(searcher._cache), amwafish.TABLE_SIZE + 1)
+                board.push_uci(move)
+        finally:
+            amwafish.TABLE_SIZE = size
+
+
+class EvalCacheTest(unittest.TestCase):
+
+    def test_clock(self):
+        """Entries used since the last sweep survive an eviction"""
+        cache = amwafish.EvalCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+    def test_search(self):
+        """The cache changes the speed of a search, not its result"""
+        board = chess.Board('r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4')
+        results = []
+        for cache in (None, amwafish.EvalCache()):
+            searcher = amwafish.Searcher()
+            searcher.evalcache = cache
+            results.append([(depth, move, score) for depth, move, score, _ in
+                            searcher.search(board, evaluation.Classical(), maxdepth=4)])
+        self.assertEqual(results[0], results[1])
+        self.assertGreater(cache.hits, 0)
+
+    def test_new_evaluation(self):
+        """Both caches are only kept for the same evaluation and variant"""
+        fen = 'r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4'
+        ev = evaluation.get_evaluation_function()
+        self.assertIs(ev, evaluation.get_evaluation_function('standard'))
+        searcher = amwafish.Searcher()
+        for board, ev, kept in ((chess.Board(fen), ev, False), (chess.Board(fen), ev, True),
+                                (chess.Board(fen), evaluation.Classical(), False),
+                                (chess.variant.AntichessBoard(fen), evaluation.Classical(), False)):
+            before = searcher.generation
+            for depth, _, _, _ in searcher.search(board, ev, maxdepth=3):
+                if depth == 1:
+                    old = [entry for entry in searcher._cache.values() if entry[4] == before]
+            self.assertEqual(bool(old), kept)
+
+    def test_uci_positions(self):
+        """A uci session keeps its evaluation, and so the caches, between positions"""
+        evaluations = []
+        class Searcher(amwafish.Searcher):
+            def search(self, board, evaluation, **kwargs):
+                evaluations.append(evaluation)
+                return super().search(board, evaluation, **kwargs)
+        engine = types.SimpleNamespace(Searcher=Searcher, Stats=amwafish.Stats)
+        position = 'position fen r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4'
+        commands = ['setoption name PawnStructure value true', position, 'go depth 2',
+                    position + ' moves e1g1', 'go depth 2',
+                    'setoption name PawnStructure value false', position, 'go depth 2']
+        uci.session(iter(commands), lambda line: None, engine)
+        self.assertIs(evaluations[0], evaluations[1])
+        self.assertIsNotNone(evaluations[0].pawns)
+        self.assertIs(evaluations[2], evaluation.get_evaluation_function())
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,22 @@
+import unittest
+
+import positions
+import selfplay
+
+
+class TestSelfplay(unittest.TestCase):
+
+    def test_play_game(self):
+        """Records are legal positions and moves, all with the final result"""
+        fen = '6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1'
+        records = selfplay.play_game(fen, seed=1, depth=2, random_plies=0)
+        self.assertTrue(records)
+        self.assertEqual(len({rec[-1] for rec in records}), 1)
+        self.assertEqual(records[0][-1], 2)
+        for pos, move, score, result in records:
+            board = positions.to_board(pos)
+            self.assertIn(positions.decode_move(move), board.legal_moves)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+import asyncio
+import json
+import unittest
+
+import server
+
+FEN = 'r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3'
+
+
+async def request(port, *requests):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    for req in requests:
+        writer.write((json.dumps(req) + '\n').encode())
+    await writer.drain()
+    return reader, writer
+
+
+async def results(reader, count):
+    messages = []
+    while sum(m['type'] != 'iteration' for m in messages) < count:
+        messages.append(json.loads(await reader.readline()))
+    return messages
+
+
+class TestServer(unittest.TestCase):
+
+    def run_server(self, test):
+        async def main():
+            srv = server.Server(processes=1)
+            listener = await server.start(srv, port=0)
+            try:
+                await test(srv, listener.sockets[0].getsockname()[1])
+            finally:
+                listener.close()
+                srv.close()
+        asyncio.run(main())
+
+    def test_analyse(self):
+        async def test(srv, port):
+            reader, writer = await request(port, {'id': 1, 'fen': FEN, 'depth': 2})
+            messages = await results(reader, 1)
+            self.assertEqual([m['type'] for m in messages], ['iteration', 'iteration', 'result'])
+            self.assertEqual(messages[-1]['depth'], 2)
+            self.assertTrue(messages[-1]['pv'])
+            writer.close()
+        self.run_server(test)
+
+    def test_dedup(self):
+        """Identical requests from two clients are searched once"""
+        async def test(srv, port):
+            req = {'fen': FEN, 'depth': 3}
+            r1, w1 = await request(port, dict(req, id='a'))
+            r2, w2 = await request(port, dict(req, id='b'))
+            m1, m2 = await results(r1, 1), await results(r2, 1)
+            self.assertEqual(srv.searches, 1)
+            self.assertEqual((m1[-1]['id'], m2[-1]['id']), ('a', 'b'))
+            self.assertEqual(m1[-1]['move'], m2[-1]['move'])
+            w1.close()
+            w2.close()
+        self.run_server(test)
+
+    def test_cancel(self):
+        async def test(srv, port):
+            reader, writer = await request(port, {'id': 1, 'fen': FEN, 'secs': 60},
+                                           {'op': 'cancel', 'id': 1},
+                                           {'id': 2, 'fen': FEN, 'depth': 1})
+            messages = await results(reader, 1)
+            self.assertEqual(messages[-1]['id'], 2)
+            writer.close()
+        self.run_server(test)
+
+    def test_error(self):
+        async def test(srv, port):
+            reader, writer = await request(port, {'id': 1, 'fen': 'not a fen', 'depth': 1})
+            messages = await results(reader, 1)
+            self.assertEqual(messages[-1]['type'], 'error')
+            writer.close()
+        self.run_server(test)
+
+    def test_malformed(self):
+        """Lines that are not json get an error without an id"""
+        async def test(srv, port):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b'not json\n')
+            self.assertEqual(json.loads(await reader.readline()),
+                             {'id': None, 'type': 'error', 'error': 'Expecting value: line 1 column 1 (char 0)'})
+            # Also after a valid request
+            writer.write((json.dumps({'id': 1, 'op': 'cancel'}) + '\nnot json\n').encode())
+            self.assertIsNone(json.loads(await reader.readline())['id'])
+            writer.close()
+        self.run_server(test)
+
+    def test_deadline(self):
+        """The deadline counts from the submission, also for a queued search"""
+        async def test(srv, port):
+            start = asyncio.get_running_loop().time()
+            reader, writer = await request(port, {'id': 1, 'fen': FEN, 'secs': 60, 'deadline': 2},
+                                           {'id': 2, 'fen': FEN, 'secs': 30, 'deadline': 2})
+            messages = await results(reader, 2)
+            self.assertLess(asyncio.get_running_loop().time() - start, 3.5)
+            self.assertEqual([m['stopped'] for m in messages if m['type'] == 'result'],
+                             ['deadline', 'deadline'])
+            writer.close()
+        self.run_server(test)
+
+    def test_dead_worker(self):
+        """The search of a worker that dies fails, and a new worker takes over"""
+        async def test(srv, port):
+            reader, writer = await request(port, {'id': 1, 'fen': FEN, 'secs': 60})
+            self.assertEqual(json.loads(await reader.readline())['type'], 'iteration')
+            srv.workers[0].process.kill()
+            messages = await results(reader, 1)
+            self.assertEqual((messages[-1]['id'], messages[-1]['type']), (1, 'error'))
+            writer.write((json.dumps({'id': 2, 'fen': FEN, 'depth': 1}) + '\n').encode())
+            messages = await results(reader, 1)
+            self.assertEqual((messages[-1]['id'], messages[-1]['type']), (2, 'result'))
+            writer.close()
+        self.run_server(test)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import json
+import os
+import tempfile
+import unittest
+
+import chess
+
+import suite
+
+MATE1_FEN = os.path.join(os.path.dirname(__file__), 'tests/mate1.fen')
+BACK_RANK = '6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - -'
+
+
+class TestSuite(unittest.TestCase):
+
+    def test_relative_score(self):
+        self.assertEqual(suite.relative_score(chess.Board(), 50), 50)
+        self.assertEqual(suite.relative_score(chess.Board(BACK_RANK.replace(' w ', ' b ')), 50), -50)
+
+    def test_mate(self):
+        """Solved when a mate score is found, within the node limit"""
+        with open(MATE1_FEN) as f:
+            line = suite.read_lines(f)[0]
+        res = suite.mate_task((0, line), nodes=20000)
+        self.assertTrue(res['solved'])
+        self.assertLessEqual(res['solution_time'], res['time'])
+
+    def test_findbest(self):
+        """Every checkpoint needs a good move, and the solution time is the
+        first of the iterations that all found one"""
+        res = suite.findbest_task((0, BACK_RANK + ' bm Rd8#; id "mate";'), times=(60, 120), nodes=5000)
+        self.assertEqual((res['id'], res['move'], res['points']), ('mate', 'd1d8', 2))
+        self.assertTrue(res['solved'])
+        self.assertEqual(res['marks'], ['Rd8#(1)', 'Rd8#(1)'])
+        self.assertIsNotNone(res['solution_time'])
+        # Nothing has finished at 0 seconds
+        res = suite.findbest_task((0, BACK_RANK + ' bm Rd8#;'), times=(0, 60), nodes=5000)
+        self.assertEqual((res['points'], res['solved'], res['marks'][0]), (1, False, '-(0)'))
+        res = suite.findbest_task((0, BACK_RANK + ' am Rd8#;'), times=(60,), nodes=5000)
+        self.assertEqual((res['solved'], res['solution_time']), (False, None))
+
+    def test_bound(self):
+        """Null window searches decide if a score is reached"""
+        res = suite.bound_task((0, BACK_RANK), maxdepth=3, gamma=1000)
+        self.assertTrue(res['solved'])
+        self.assertGreaterEqual(res['score'], 1000)
+        res = suite.bound_task((0, chess.STARTING_FEN), maxdepth=2, gamma=500)
+        self.assertEqual((res['solved'], res['solution_time'], res['depth']), (False, None, 2))
+
+    def test_run_suite(self):
+        with open(MATE1_FEN) as f:
+            lines = suite.read_lines(f)[:2]
+        fd, report = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            summary = suite.run_suite(suite.mate_task, lines, processes=2, report=report,
+                                      verbose=False, nodes=20000)
+            with open(report) as f:
+                self.assertEqual(json.load(f)['solved'], 2)
+        finally:
+            os.remove(report)
+        self.assertEqual((summary['total'], summary['solved'], summary['unsolved']), (2, 2, []))
+        self.assertEqual([r['index'] for r in summary['results']], [0, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
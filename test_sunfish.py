@@ -0,0 +1,131 @@
+import json
+import unittest
+import sunfish
+import tools
+
+
+def search_to_depth(searcher, pos, depth, history=()):
+    for d, move, score in searcher.search(pos, history):
+        if d == depth:
+            return move, score
+
+
+class TestSearcher(unittest.TestCase):
+
+    def setUp(self):
+        self._pos = tools.parseFEN(tools.FEN_INITIAL)
+
+    def test_table_reuse(self):
+        """The tables survive a search and make the next one cheaper"""
+        searcher = sunfish.Searcher()
+        move, score = search_to_depth(searcher, self._pos, 4, [self._pos])
+        cold = searcher.nodes
+        self.assertTrue(searcher.tp_score)
+        self.assertEqual(search_to_depth(searcher, self._pos, 4, [self._pos]), (move, score))
+        self.assertLess(searcher.nodes, cold)
+
+    def test_repetition_entries(self):
+        """Entries depending on the history are not reused by a later search"""
+        searcher = sunfish.Searcher()
+        pos1 = self._pos.move(tools.mparse(tools.WHITE, 'g1f3'))
+        search_to_depth(searcher, pos1, 6, [self._pos, pos1])
+        self.assertTrue(any(e.rep for e in searcher.tp_score.values()))
+        searcher.generation += 1
+        for (pos, depth, root), entry in searcher.tp_score.items():
+            if entry.rep:
+                self.assertIsNone(searcher.probe(pos, depth, root))
+
+    def test_history_growth(self):
+        """Entries searched before the game reached a position can't be reused,
+        as they never saw the repetitions of it"""
+        searcher = sunfish.Searcher()
+        search_to_depth(searcher, self._pos, 6, [self._pos])
+        pos1 = self._pos.move(tools.mparse(tools.WHITE, 'g1f3'))
+        pos2 = pos1.move(tools.mparse(tools.BLACK, 'g8f6'))
+        # From here black can go back to pos2 with g8f6
+        back = pos2.move(tools.mparse(tools.WHITE, 'f3g1'))
+        back = back.move(tools.mparse(tools.BLACK, 'f6g8'))
+        back = back.move(tools.mparse(tools.WHITE, 'g1f3'))
+        depths = [depth for pos, depth, root in searcher.tp_score if pos == back]
+        self.assertTrue(depths)
+        # The first iteration doesn't reach back
+        next(searcher.search(pos2, [self._pos, pos1, pos2]))
+        for depth in depths:
+            self.assertIsNone(searcher.probe(back, depth, False))
+        # The same history again does reuse the table
+        search_to_depth(searcher, pos2, 4, [self._pos, pos1, pos2])
+        cold = searcher.nodes
+        search_to_depth(searcher, pos2, 4, [self._pos, pos1, pos2])
+        self.assertLess(searcher.nodes, cold)
+
+    def test_game_reuse(self):
+        """Playing a game, the entries of earlier moves are still of use"""
+        warm, warm_nodes, cold_nodes = sunfish.Searcher(), 0, 0
+        history = [self._pos]
+        for i, move in enumerate('e2e4 e7e5 g1f3 b8c6 f1b5 a7a6 b5a4 g8f6'.split()):
+            search_to_depth(warm, history[-1], 4, history)
+            cold = sunfish.Searcher()
+            search_to_depth(cold, history[-1], 4, history)
+            warm_nodes += warm.nodes
+            cold_nodes += cold.nodes
+            color = tools.WHITE if i % 2 == 0 else tools.BLACK
+            history.append(history[-1].move(tools.mparse(color, move)))
+        self.assertLess(warm_nodes, cold_nodes)
+
+    def test_stats(self):
+        searcher = sunfish.Searcher(stats=sunfish.Stats())
+        search_to_depth(searcher, self._pos, 4)
+        stats = json.loads(searcher.stats.to_json())
+        self.assertEqual(stats['nodes'], searcher.nodes)
+        self.assertEqual([it['depth'] for it in stats['iterations']], [1, 2, 3, 4])
+        self.assertLessEqual(stats['tt_cutoffs'], stats['tt_hits'])
+        self.assertLessEqual(stats['first_cutoffs'], stats['cutoffs'])
+        self.assertGreater(stats['ebf'], 1)
+
+    def test_selectivity(self):
+        """Reductions and pruning make a search cheaper, and can be turned off"""
+        pos = tools.parseFEN('r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4')
+        searcher = sunfish.Searcher(stats=sunfish.Stats())
+        search_to_depth(searcher, pos, 5)
+        stats, nodes = searcher.stats, searcher.nodes
+        self.assertGreater(stats.reductions, stats.researches)
+        self.assertGreater(stats.futile + stats.razored, 0)
+        saved = sunfish.LMR, sunfish.FUTILITY_MARGIN, sunfish.RAZOR_MARGIN
+        try:
+            sunfish.LMR, sunfish.FUTILITY_MARGIN, sunfish.RAZOR_MARGIN = False, 0, 0
+            searcher = sunfish.Searcher(stats=sunfish.Stats())
+            search_to_depth(searcher, pos, 5)
+        finally:
+            sunfish.LMR, sunfish.FUTILITY_MARGIN, sunfish.RAZOR_MARGIN = saved
+        self.assertEqual(searcher.stats.reductions + searcher.stats.futile + searcher.stats.razored, 0)
+        self.assertLess(nodes, searcher.nodes)
+
+    def test_selective_mate(self):
+        """Pruning near the horizon does not hide a mate in two"""
+        pos = tools.parseFEN('8/1p3Qb1/p5pk/P1p1p1p1/1P2P1P1/2P1N2n/5P1P/4qB1K w - - 1 0')
+        move, score = search_to_depth(sunfish.Searcher(), pos, 4)
+        self.assertGreaterEqual(score, sunfish.MATE_LOWER)
+
+
+class TestSee(unittest.TestCase):
+
+    def see(self, fen, move):
+        pos = tools.parseFEN(fen)
+        color = tools.WHITE if fen.split()[1] == 'w' else tools.BLACK
+        return pos.see(tools.mparse(color, move))
+
+    def test_see(self):
+        # Undefended pawn, knight for a pawn, queen for two pawns
+        self.assertEqual(self.see('1k1r4/1pp4p/p7/4p3/8/P5P1/1PP4P/2K1R3 w - - 0 1', 'e1e5'), 100)
+        self.assertEqual(self.see('1k1r3q/1ppn3p/p4b2/4p3/8/P2N2P1/1PP1R1BP/2K1Q3 w - - 0 1', 'd3e5'), -180)
+        self.assertEqual(self.see('4k3/8/2p5/3p4/4P3/8/8/3QK3 w - - 0 1', 'd1d5'), 100 - 929 + 100)
+        # The rook behind the rook recaptures, also as black
+        self.assertEqual(self.see('3rk3/8/8/3r4/8/3R4/3R4/4K3 w - - 0 1', 'd3d5'), 479)
+        self.assertEqual(self.see('3rk3/8/8/3r4/8/3R4/2P5/4K3 b - - 0 1', 'd5d3'), 100)
+        # En passant, and a promotion the rook can take back
+        self.assertEqual(self.see('4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 1', 'e5d6'), 100)
+        self.assertEqual(self.see('r3k3/1P6/8/8/8/8/8/4K3 w - - 0 1', 'b7b8'), -100)
+
+
+if __name__ == "__main__":
+    unittest.main()
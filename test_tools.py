@@ -0,0 +1,84 @@
+import io
+import os
+import unittest
+import ingest
+import tools
+
+QUEEN_FEN = os.path.join(os.path.dirname(__file__), 'tests/queen.fen')
+
+
+class TestPerft(unittest.TestCase):
+
+    def setUp(self):
+        with open(QUEEN_FEN) as f:
+            self._lines = [line.split(';') for line in f.readlines()[:20]]
+
+    def test_perft(self):
+        """Counts agree with the suite up to depth 3"""
+        for parts in self._lines:
+            pos = tools.parseFEN(parts[0])
+            for depth in range(1, min(4, len(parts))):
+                self.assertEqual(tools.perft(pos, depth, {}), int(parts[depth]), parts[0])
+
+    def test_divide(self):
+        parts = self._lines[0]
+        pos = tools.parseFEN(parts[0])
+        self.assertEqual(sum(n for _, n in tools.divide(pos, 2)), int(parts[2]))
+
+    def test_is_legal(self):
+        """The fast legality test agrees with playing the opponent's moves"""
+        for parts in self._lines:
+            pos = tools.parseFEN(parts[0])
+            for move in pos.gen_moves():
+                self.assertEqual(tools.is_legal(pos, move),
+                                 not tools.can_kill_king(pos.move(move)))
+
+
+class TestPGN(unittest.TestCase):
+
+    def test_games(self):
+        """Games without headers are split at the result"""
+        pgn = io.StringIO('1. e4 e5 2. Nf3 {a comment\n 1-0} Nc6 (2... d6 3. d4) 1-0\n'
+                          '1. d4 d5 2. c4 0-1\n')
+        games = list(tools.readGames(pgn))
+        self.assertEqual(len(games), 2)
+        game, result, white = tools.parseGame(*games[0])
+        self.assertEqual([tools.mrender(pos, move) for pos, move in game],
+                         ['e2e4', 'e7e5', 'g1f3', 'b8c6'])
+        self.assertEqual((result, white), ('1-0', True))
+
+    def test_rest_of_line_comment(self):
+        """A ; comment ends at the end of its line, even one with a result"""
+        pgn = io.StringIO('1. e4 e5 ; king pawn 1-0\n2. Nf3 Nc6 3. Bb5 1-0\n1. d4 *\n')
+        games = list(tools.readGames(pgn))
+        self.assertEqual(len(games), 2)
+        game, result, white = tools.parseGame(*games[0])
+        self.assertEqual([tools.mrender(pos, move) for pos, move in game],
+                         ['e2e4', 'e7e5', 'g1f3', 'b8c6', 'f1b5'])
+        self.assertEqual(result, '1-0')
+        # Also in a game without a result, that ends at the next headers
+        pgn = io.StringIO('[Event "a"]\n\n1. e4 ; good\ne5 2. Nf3\n\n[Event "b"]\n\n1. d4 *\n')
+        game, result, white = tools.parseGame(*next(tools.readGames(pgn)))
+        self.assertEqual([tools.mrender(pos, move) for pos, move in game], ['e2e4', 'e7e5', 'g1f3'])
+
+    def test_malformed(self):
+        """Games sunfish can't read are skipped by ingest, whatever the error"""
+        pgn = io.StringIO('[FEN "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNX w KQkq - 0 1"]\n\n1. e4 *\n'
+                          '[FEN "8/8/8 w - - 0 1"]\n\n1. e4 *\n'
+                          '1. e4 e5 2. Zz9 1-0\n'
+                          '1. e4 e5 2. Nf3 1-0\n')
+        games = [ingest.game_records(game) for game in tools.readGames(pgn)]
+        self.assertEqual(games[:3], [None, None, None])
+        self.assertEqual(len(games[3]), 3)
+
+    def test_fen(self):
+        pgn = io.StringIO('[FEN "r3k3/8/8/8/8/8/8/4K2R b Kq - 0 1"]\n\n'
+                          '1... O-O-O 2. O-O Rd1 3. Rxd1 *\n')
+        game, result, white = tools.parseGame(*next(tools.readGames(pgn)))
+        self.assertEqual([tools.mrender(pos, move) for pos, move in game],
+                         ['e8c8', 'e1g1', 'd8d1', 'f1d1'])
+        self.assertEqual((result, white), ('*', False))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import unittest
+
+import chess
+import numpy as np
+
+import positions
+import tools
+import tune
+
+QUEEN_FEN = os.path.join(os.path.dirname(__file__), 'tests/queen.fen')
+
+
+class TestTune(unittest.TestCase):
+
+    def setUp(self):
+        with open(QUEEN_FEN) as f:
+            self._fens = [line.split(';')[0] for line in f.readlines()[:50]]
+        packed = [np.frombuffer(positions.from_board(chess.Board(fen)), np.uint8) for fen in self._fens]
+        self._index, self._sign = tune.features(positions.decode_pieces(np.array(packed)))
+
+    def test_features(self):
+        """The features with the sunfish weights give the sunfish score"""
+        evals = tune.evaluate(tune.initial_weights(), self._index, self._sign)
+        for fen, score in zip(self._fens, evals):
+            pos = tools.parseFEN(fen)
+            self.assertEqual(score, pos.score if tools.get_color(pos) == tools.WHITE else -pos.score)
+
+    def test_chunks(self):
+        """Features are compact, and chunks don't change the results"""
+        self.assertEqual((self._index.dtype, self._sign.dtype), (np.uint16, np.int8))
+        weights = tune.initial_weights() + np.arange(tune.NFEATURES + 1) % 7
+        results = np.array([i % 3 / 2 for i in range(len(self._fens))])
+        whole = tune.gradient(weights, self._index, self._sign, results, 1)
+        chunk, tune.CHUNK = tune.CHUNK, 7
+        try:
+            self.assertTrue(np.allclose(tune.gradient(weights, self._index, self._sign, results, 1), whole))
+        finally:
+            tune.CHUNK = chunk
+
+    def test_tune(self):
+        results = np.array([i % 3 / 2 for i in range(len(self._fens))])
+        weights = tune.initial_weights()
+        before = tune.loss(weights, self._index, self._sign, results, 1)
+        weights = tune.tune(self._index, self._sign, results, weights, 1, epochs=10, verbose=False)
+        self.assertLess(tune.loss(weights, self._index, self._sign, results, 1), before)
+
+
+if __name__ == "__main__":
+    unittest.main()
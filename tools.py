@@ -93,60 +93,101 @@ def renderSAN(pos, move):
     cap = 'x' if pos.board[j] != '.' else ''
     return p + src + cap + cdst + check
 
-def parseSAN(pos, msan):
-    ''' Assumes board is rotated to position of current player '''
-    # Normal moves
-    normal = re.match('([KQRBN])([a-h])?([1-8])?x?([a-h][1-8])', msan)
-    if normal:
-        p, fil, rank, dst = normal.groups()
-        src = (fil or '[a-h]')+(rank or '[1-8]')
-    # Pawn moves
-    pawn = re.match('([a-h])?x?([a-h][1-8])', msan)
-    if pawn:
-        assert not re.search('[RBN]$', msan), 'Sunfish only supports queen promotion in {}'.format(msan)
-        p, (fil, dst) = 'P', pawn.groups()
-        src = (fil or '[a-h]')+'[1-8]'
+def moveIndex(pos):
+    ''' Maps every target square to the pseudo legal moves going there '''
+    index = {}
+    for move in pos.gen_moves():
+        index.setdefault(move[1], []).append(move)
+    return index
+
+def parseSAN(pos, msan, index=None):
+    ''' Assumes board is rotated to position of current player. Rather than
+        matching every legal move against msan, we look up the moves going to
+        the target square, and only test legality if that is ambiguous. '''
+    rot = (lambda i: i) if get_color(pos) == WHITE else (lambda i: 119-i)
+    san = msan.rstrip('+#!?')
     # Castling
-    if re.match(msan, "O-O-O[+#]?"):
-        p, src, dst = 'K', 'e[18]', 'c[18]'
-    if re.match(msan, "O-O[+#]?"):
-        p, src, dst = 'K', 'e[18]', 'g[18]'
-    # Find possible match
-    assert 'p' in vars(), 'No piece to move with {}'.format(msan)
-    for (i, j), _ in gen_legal_moves(pos):
-        if get_color(pos) == WHITE:
-            csrc, cdst = sunfish.render(i), sunfish.render(j)
-        else: csrc, cdst = sunfish.render(119-i), sunfish.render(119-j)
-        if pos.board[i] == p and re.match(dst,cdst) and re.match(src,csrc):
-            return (i, j)
-    assert False, 'Couldn\'t find legal move matching {}. Had {}'.format(msan, {
-        'p':p, 'src':src, 'dst': dst, 'mvs':list(gen_legal_moves(pos))})
+    if san in ('O-O', 'O-O-O', '0-0', '0-0-0'):
+        rank = '1' if get_color(pos) == WHITE else '8'
+        p, src, dst = 'K', 'e' + rank, ('g' if len(san) == 3 else 'c') + rank
+    else:
+        if san[-1] in 'QRBN' and san[0] in 'abcdefgh':
+            # Pawn promotion, written as e8=Q or e8Q
+            assert san[-1] == 'Q', 'Sunfish only supports queen promotion in {}'.format(msan)
+            san = san.rstrip('QRBN=')
+        p = san[0] if san[0] in 'KQRBN' else 'P'
+        src, dst = san[p != 'P':-2].replace('x', ''), san[-2:]
+    assert len(dst) == 2 and dst[0] in 'abcdefgh' and dst[1] in '12345678', \
+        'No piece to move with {}'.format(msan)
+    if index is None:
+        index = moveIndex(pos)
+    # src holds the file and/or rank we need to disambiguate by
+    moves = [(i, j) for i, j in index.get(rot(sunfish.parse(dst)), ())
+             if pos.board[i] == p and all(c in sunfish.render(rot(i)) for c in src)]
+    if len(moves) > 1:
+        moves = [move for move in moves if is_legal(pos, move)]
+    assert len(moves) == 1, 'Couldn\'t find legal move matching {}. Had {}'.format(msan, {
+        'p': p, 'src': src, 'dst': dst, 'mvs': moves})
+    return moves[0]
+
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+# What parseFEN, parseSAN and so parseGame raise on input they can't read
+PARSE_ERRORS = (AssertionError, ValueError, KeyError, IndexError)
+
+def readGames(file):
+    """ Yields (headers, movetext) for every game. The file is read line by line,
+        and games end at a result token, or when the headers of the next game
+        start, so files with and without headers both work. The movetext keeps
+        its newlines, which end ; comments. """
+    headers, lines, comment = {}, [], 0
+    for line in file:
+        line = line.strip()
+        if not comment and line.startswith('['):
+            if lines:
+                yield headers, '\n'.join(lines)
+                headers, lines = {}, []
+            key, _, value = line[1:-1].partition(' ')
+            headers[key] = value.strip('"')
+        elif line:
+            lines.append(line)
+            # A ; comment runs to the end of the line
+            code = line if comment else re.sub(r'\{[^}]*\}', ' ', line).partition(';')[0]
+            comment += code.count('{') - code.count('}')
+            if not comment and code.split() and code.split()[-1] in RESULTS:
+                yield headers, '\n'.join(lines)
+                headers, lines = {}, []
+    if lines:
+        yield headers, '\n'.join(lines)
+
+def parseGame(headers, movetext):
+    """ Returns the [(pos, move), ...] list of a game, the result and whether the
+        first position has white to move. Games may start from a [FEN] header. """
+    # Remove comments, variations, annotations and move numbers.
+    movetext = re.sub(r'\{[^}]*\}|;[^\n]*|\$\d+|\d+\.+', ' ', movetext)
+    while '(' in movetext:
+        movetext = re.sub(r'\([^()]*\)', ' ', movetext)
+    msans = movetext.split()
+    result = headers.get('Result')
+    if msans and msans[-1] in RESULTS:
+        result = msans.pop()
+    fen = headers.get('FEN', FEN_INITIAL)
+    pos = parseFEN(fen)
+    game = []
+    for msan in msans:
+        move = parseSAN(pos, msan)
+        game.append((pos, move))
+        pos = pos.move(move)
+    return game, result, fen.split()[1] == 'w'
 
 def readPGN(file):
     """ Yields a number of [(pos, move), ...] lists. """
-    def _parse_single_pgn(lines):
-        # Remove comments and numbers.
-        parts = re.sub('{.*?}', '', ' '.join(lines)).split()
-        msans = [part for part in parts if not part[0].isdigit()]
-        pos = parseFEN(FEN_INITIAL)
-        for msan in msans:
-            try:
-                move = parseSAN(pos, msan)
-            except AssertionError:
-                print('PGN was:', ' '.join(lines))
-                raise
-            yield pos, move
-            pos = pos.move(move)
-
-    # TODO: Currently assumes all games start at the initial position.
-    current_game = []
-    for line in file:
-        if line.startswith('['):
-            if current_game:
-                yield ' '.join(current_game), list(_parse_single_pgn(current_game))
-            del current_game[:]
-        else:
-            current_game.append(line.strip())
+    for headers, movetext in readGames(file):
+        try:
+            game, _, _ = parseGame(headers, movetext)
+        except AssertionError:
+            print('PGN was:', movetext)
+            raise
+        yield movetext, game
 
 
 ################################################################################
@@ -258,6 +299,113 @@ def flatten_tree(tree, depth):
         for pos in flatten_tree(subtree, depth-1):
             yield pos
 
+################################################################################
+# Perft
+################################################################################
+
+def attacked(board, i):
+    ''' Is square i attacked by the opponent (the lower case pieces)? '''
+    N, E, S, W = sunfish.N, sunfish.E, sunfish.S, sunfish.W
+    if board[i+N+W] == 'p' or board[i+N+E] == 'p':
+        return True
+    for d in sunfish.directions['N']:
+        if board[i+d] == 'n':
+            return True
+    for d in sunfish.directions['K']:
+        j = i+d
+        if board[j] == 'k':
+            return True
+        while board[j] == '.':
+            j += d
+        q = board[j]
+        if q == 'q' or q == 'r' and d in (N, E, S, W) or q == 'b' and d not in (N, E, S, W):
+            return True
+    return False
+
+def is_legal(pos, move):
+    ''' Does the move not leave our king (or the squares it castled over) attacked?
+        This is the same test as can_kill_king(pos.move(move)), but without making
+        the full move or generating the opponent moves. '''
+    i, j = move
+    board, p = pos.board, pos.board[i]
+    board = board[:j] + p + board[j+1:]
+    board = board[:i] + '.' + board[i+1:]
+    if p == 'P' and j == pos.ep:
+        board = board[:j+sunfish.S] + '.' + board[j+sunfish.S+1:]
+    if p == 'K' and abs(j-i) == 2:
+        kp, r = (i+j)//2, sunfish.A1 if j < i else sunfish.H1
+        board = board[:r] + '.' + board[r+1:]
+        board = board[:kp] + 'R' + board[kp+1:]
+        return not any(attacked(board, k) for k in (i, kp, j))
+    return not attacked(board, j if p == 'K' else board.index('K'))
+
+def pinned(board, k):
+    ''' Squares of our pieces that are pinned against our king at square k '''
+    N, E, S, W = sunfish.N, sunfish.E, sunfish.S, sunfish.W
+    res = set()
+    for d in sunfish.directions['K']:
+        j = k+d
+        while board[j] == '.':
+            j += d
+        if not board[j].isupper():
+            continue
+        pin = j
+        j += d
+        while board[j] == '.':
+            j += d
+        q = board[j]
+        if q == 'q' or q == 'r' and d in (N, E, S, W) or q == 'b' and d not in (N, E, S, W):
+            res.add(pin)
+    return res
+
+def count_legal(pos):
+    ''' The number of legal moves. When we are not in check, only moves of the
+        king, of pinned pieces and en passant captures need testing. '''
+    board = pos.board
+    k = board.index('K')
+    if attacked(board, k):
+        return sum(1 for move in pos.gen_moves() if is_legal(pos, move))
+    unsafe = pinned(board, k)
+    unsafe.add(k)
+    n = 0
+    for move in pos.gen_moves():
+        if move[0] not in unsafe and (move[1] != pos.ep or board[move[0]] != 'P') \
+                or is_legal(pos, move):
+            n += 1
+    return n
+
+def perft(pos, depth, table=None):
+    ''' Counts the legal move sequences of length depth from pos. At depth 1
+        the moves are only counted, not made. Subtree counts are stored in the
+        table, if given, as transpositions are frequent. '''
+    if depth == 0:
+        return 1
+    if depth == 1:
+        return count_legal(pos)
+    if table is not None and (pos, depth) in table:
+        return table[pos, depth]
+    res = sum(perft(pos.move(move), depth-1, table)
+              for move in pos.gen_moves() if is_legal(pos, move))
+    if table is not None:
+        table[pos, depth] = res
+    return res
+
+def _perft_root(pos_move_depth):
+    pos, move, depth = pos_move_depth
+    return move, perft(pos.move(move), depth-1, {})
+
+def divide(pos, depth, pool=None):
+    ''' Yields (move, perft count) for every legal root move. If a
+        multiprocessing pool is given, the root moves are split over it. '''
+    jobs = [(pos, move, depth) for move in pos.gen_moves() if is_legal(pos, move)]
+    if depth <= 1 or pool is None:
+        table = {}
+        for _, move, _ in jobs:
+            yield move, perft(pos.move(move), depth-1, table)
+    else:
+        for move, res in pool.imap(_perft_root, jobs):
+            yield move, res
+
 ################################################################################
 # Non chess related tools
 ################################################################################
@@ -0,0 +1,224 @@
+#!/usr/bin/env pypy
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+from __future__ import division
+import argparse
+import importlib
+import sys
+
+import numpy as np
+
+import positions
+import sunfish
+
+################################################################################
+# Texel tuning of the sunfish piece-square tables. Every position of a dataset
+# is turned into at most 32 (feature, sign) pairs, one per piece, where a feature
+# is a (piece, table entry) pair and the sign is +1 for white and -1 for black.
+# The evaluation is then a sum of weights, and the logistic loss
+#
+#   (result - sigmoid(k * eval / 400))^2
+#
+# and its gradient are computed for all positions at once with NumPy.
+################################################################################
+
+PIECES = 'PNBRQK'
+TABLE = 64
+# Weights are the tables, followed by the piece values
+NFEATURES = len(PIECES) * TABLE + len(PIECES)
+# Features of empty squares point here, with sign 0
+DUMMY = NFEATURES
+# Positions are handled in chunks of this many rows, so the temporary arrays
+# stay small however large the dataset is
+CHUNK = 1 << 16
+
+
+def table_index(squares, black):
+    ''' Index into the (unpadded) sunfish tables of pieces on chess squares.
+        Sunfish looks up black pieces on the rotated, not mirrored, board. '''
+    rank, file = squares // 8, squares % 8
+    return np.where(black, rank*8 + 7 - file, (7 - rank)*8 + file)
+
+
+def features(pieces):
+    ''' Turns (n, 64) nibbles into (n, 64) feature indices and signs. Column k
+        is the table entry of the k'th piece on the board and column 32 + k its
+        piece value. Indices are uint16 and signs int8, 192 bytes a position. '''
+    index = np.empty((len(pieces), 64), dtype=np.uint16)
+    sign = np.empty((len(pieces), 64), dtype=np.int8)
+    for lo in range(0, len(pieces), CHUNK):
+        index[lo:lo+CHUNK], sign[lo:lo+CHUNK] = _features(pieces[lo:lo+CHUNK])
+    return index, sign
+
+
+def _features(pieces):
+    # Move the occupied squares to the front of every row
+    order = np.argsort(pieces == 0, axis=1, kind='stable')[:, :32]
+    nibbles = np.take_along_axis(pieces, order, axis=1).astype(np.int64)
+    occupied = nibbles != 0
+    black = nibbles >= 8
+    kind = (nibbles & 7) - 1
+    psq = kind*TABLE + table_index(order, black)
+    value = len(PIECES)*TABLE + kind
+    sign = np.where(black, -1, 1) * occupied
+    index = np.concatenate((np.where(occupied, psq, DUMMY), np.where(occupied, value, DUMMY)), axis=1)
+    return index, np.concatenate((sign, sign), axis=1)
+
+
+def initial_weights(module=sunfish):
+    ''' Reads the weights back from the padded tables of a sunfish module '''
+    weights = np.zeros(NFEATURES + 1)
+    for k, p in enumerate(PIECES):
+        value = module.piece[p]
+        for t in range(TABLE):
+            weights[k*TABLE + t] = module.pst[p][21 + t//8*10 + t%8] - value
+        weights[len(PIECES)*TABLE + k] = value
+    return weights
+
+
+def evaluate(weights, index, sign):
+    evals = np.empty(len(index))
+    for lo in range(0, len(index), CHUNK):
+        evals[lo:lo+CHUNK] = (weights[index[lo:lo+CHUNK]] * sign[lo:lo+CHUNK]).sum(axis=1)
+    return evals
+
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+
+def loss(weights, index, sign, results, k):
+    return np.mean((results - sigmoid(k * evaluate(weights, index, sign) / 400))**2)
+
+
+def gradient(weights, index, sign, results, k):
+    p = sigmoid(k * evaluate(weights, index, sign) / 400)
+    # d loss / d eval for every position
+    g = -2 * (results - p) * p * (1 - p) * k / 400 / len(results)
+    grad = np.zeros(len(weights))
+    for lo in range(0, len(g), CHUNK):
+        grad += np.bincount(index[lo:lo+CHUNK].ravel().astype(np.intp),
+                            weights=(g[lo:lo+CHUNK, None] * sign[lo:lo+CHUNK]).ravel(),
+                            minlength=len(weights))
+    return grad
+
+
+def fit_k(weights, index, sign, results):
+    ''' The scaling constant that best fits the current evaluation '''
+    evals = evaluate(weights, index, sign)
+    ks = np.linspace(.1, 3, 59)
+    losses = [np.mean((results - sigmoid(k * evals / 400))**2) for k in ks]
+    return ks[int(np.argmin(losses))]
+
+
+def frozen(weights):
+    ''' Weights that are never used or don't change the evaluation: pawns on the
+        first and last ranks, and the king value, which always cancels. '''
+    mask = np.zeros(len(weights), dtype=bool)
+    mask[0:8] = mask[56:64] = True
+    mask[len(PIECES)*TABLE + PIECES.index('K')] = True
+    mask[DUMMY] = True
+    return mask
+
+
+def tune(index, sign, results, weights, k, epochs=100, rate=1.0, batch=None,
+         regularization=0.0, verbose=True, seed=0):
+    ''' Adam gradient descent on minibatches. Regularization pulls the weights
+        towards the initial ones, which also settles the piece values, that are
+        otherwise interchangeable with a constant on their table. '''
+    weights = weights.copy()
+    start, mask = weights.copy(), frozen(weights)
+    m, v = np.zeros_like(weights), np.zeros_like(weights)
+    beta1, beta2, eps = .9, .999, 1e-8
+    rng = np.random.default_rng(seed)
+    n = len(results)
+    batch = batch or n
+    step = 0
+    for epoch in range(epochs):
+        perm = rng.permutation(n) if batch < n else np.arange(n)
+        for lo in range(0, n, batch):
+            b = perm[lo:lo+batch]
+            g = gradient(weights, index[b], sign[b], results[b], k)
+            g += regularization * (weights - start) / n
+            g[mask] = 0
+            step += 1
+            m = beta1*m + (1-beta1)*g
+            v = beta2*v + (1-beta2)*g*g
+            weights -= rate * (m / (1-beta1**step)) / (np.sqrt(v / (1-beta2**step)) + eps)
+        if verbose and (epoch + 1) % max(1, epochs // 20) == 0:
+            print('Epoch {}/{}: loss {:.6f}'.format(epoch+1, epochs, loss(weights, index, sign, results, k)),
+                  file=sys.stderr)
+    return weights
+
+
+def load(dataset, quiet=True):
+    ''' Returns the features and results (1, .5 or 0 for white) of the labelled
+        records of a dataset. With quiet, positions where the move played is a
+        capture are left out, as their static evaluation is meaningless. '''
+    data = positions.Dataset(dataset)
+    keep = data[:]['result'] >= 0
+    pieces = data.pieces()
+    if quiet:
+        to = data[:]['move'] >> 6 & 63
+        keep &= pieces[np.arange(len(pieces)), to] == 0
+    index, sign = features(pieces[keep])
+    return index, sign, data[:]['result'][keep] / 2
+
+
+def export(weights, file):
+    ''' Writes a module in the format of the top of sunfish.py, for --tables '''
+    rounded = np.rint(weights).astype(int)
+    print('# Tuned piece-square tables, load with xboard.py --tables', file=file)
+    print('piece = {{ {} }}'.format(', '.join(
+        "'{}': {}".format(p, rounded[len(PIECES)*TABLE + k])
+        for k, p in enumerate(PIECES))), file=file)
+    print('pst = {', file=file)
+    for k, p in enumerate(PIECES):
+        rows = [', '.join('{:>4}'.format(x) for x in rounded[k*TABLE + r*8:k*TABLE + r*8 + 8])
+                for r in range(8)]
+        print("    '{}': ({},".format(p, rows[0]), file=file)
+        for row in rows[1:-1]:
+            print('          {},'.format(row), file=file)
+        print('          {}),'.format(rows[-1]), file=file)
+    print('}', file=file)
+    print('''# Pad tables and join piece and pst dictionaries
+for k, table in pst.items():
+    padrow = lambda row: (0,) + tuple(x+piece[k] for x in row) + (0,)
+    pst[k] = sum((padrow(table[i*8:i*8+8]) for i in range(8)), ())
+    pst[k] = (0,)*20 + pst[k] + (0,)*20''', file=file)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Tune the sunfish piece-square tables on a dataset of positions with results.')
+    parser.add_argument('dataset', help='dataset file, as written by ingest.py --dataset.')
+    parser.add_argument('--output', type=argparse.FileType('w'), default=sys.stdout,
+        help='python module to write the tables to. Default is stdout.')
+    parser.add_argument('--tables', type=str, default='sunfish',
+        help='module with the tables to start from. Default=%(default)s.')
+    parser.add_argument('--epochs', type=int, default=100)
+    parser.add_argument('--rate', type=float, default=1.0,
+        help='learning rate, in centipawns per step. Default=%(default)s.')
+    parser.add_argument('--batch', type=int, default=None,
+        help='minibatch size. Default is the whole dataset.')
+    parser.add_argument('--k', type=float, default=None,
+        help='scaling constant of the sigmoid. Default is to fit it first.')
+    parser.add_argument('--regularization', type=float, default=0.0)
+    parser.add_argument('--all', action='store_true',
+        help='also use positions where a capture was played.')
+    args = parser.parse_args()
+
+    weights = initial_weights(importlib.import_module(args.tables))
+    index, sign, results = load(args.dataset, quiet=not args.all)
+    print('{} positions'.format(len(results)), file=sys.stderr)
+    k = args.k or fit_k(weights, index, sign, results)
+    print('k = {:.2f}, initial loss {:.6f}'.format(k, loss(weights, index, sign, results, k)),
+          file=sys.stderr)
+    weights = tune(index, sign, results, weights, k, args.epochs, args.rate, args.batch,
+                   args.regularization)
+    export(weights, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -42,18 +42,32 @@ def main():
     def output(line):
         print(line, file=out)
         logging.debug(line)
+    session(iter(input, None), output, amwafish)
+
+
+def session(commands, output, amwafish, fresh_games=False):
+    """ Runs the protocol on an iterator of commands, until quit or until the
+        commands run out. With fresh_games, ucinewgame also starts a new
+        searcher, such that nothing carries over between games. """
     pos = chess.Board()
     searcher = amwafish.Searcher()
     our_time, opp_time = 1000, 1000 # time in centi-seconds
     show_thinking = True
     options = {}
-    eval_function = evaluation.get_evaluation_function()
+    # The evaluation of standard chess is only built again when an option
+    # changes it, so the searcher can keep its tables between positions
+    standard = eval_function = evaluation.get_evaluation_function()
+    network = None
+    pawns = None
     stack = []
     while True:
         logging.debug(f'>>> in loop ')
         if stack:
             smove = stack.pop()
-        else: smove = input()
+        else:
+            smove = next(commands, None)
+            if smove is None:
+                break
 
         logging.debug(f'>>> {smove} ')
         if smove.startswith('setoption'):
@@ -61,6 +75,17 @@ def main():
             match = optionMatcher.match(smove)
             if match:
                 options[match.group("name")] = match.group("value")
+                if match.group("name") == "EvalFile":
+                    # Only standard chess has a network, numpy is needed for it
+                    import nnue
+                    network = nnue.load(match.group("value"))
+                    standard = eval_function = nnue.NNUE(network)
+                elif match.group("name") == "PawnStructure":
+                    # One table for the session, so it stays warm between searches
+                    pawns = evaluation.PawnHash() if match.group("value") == "true" else None
+                    if not network:
+                        standard = eval_function = evaluation.Classical(pawns) if pawns \
+                            else evaluation.get_evaluation_function()
 
         if smove == 'quit':
             break
@@ -70,10 +95,19 @@ def main():
             output('id author Sven Wambecq')
             output('uciok')
 
+        elif smove.startswith('debug'):
+            # In debug mode we collect search statistics and report them after each search
+            if smove.split()[-1] == 'on':
+                searcher.stats = amwafish.Stats()
+            else:
+                searcher.stats = None
+
         elif smove == 'isready':
             output('readyok')
 
         elif smove == 'ucinewgame':
+            if fresh_games:
+                searcher = amwafish.Searcher(stats=searcher.stats and amwafish.Stats())
             stack.append('position fen ' + chess.STARTING_FEN)
 
         elif smove.startswith('position fen'):
@@ -94,7 +128,7 @@ def main():
                 eval_function = evaluation.get_evaluation_function(options["UCI_Variant"])
             except KeyError:
                 board = chess.Board()
-                eval_function = evaluation.Classical()
+                eval_function = standard
             for move in moves:
                 board.push(chess.Move.from_uci(move))
             pos = board
@@ -111,6 +145,7 @@ def main():
             #  default options
             depth = 1000
             movetime = -1
+            nodes = None
 
             _, *params = smove.split(' ')
             for param, val in zip(*2*(iter(params),)):
@@ -118,6 +153,8 @@ def main():
                     depth = int(val)
                 if param == 'movetime':
                     movetime = int(val)
+                if param == 'nodes':
+                    nodes = int(val)
                 if param == 'wtime':
                     our_time = int(val)
                 if param == 'btime':
@@ -125,9 +162,11 @@ def main():
 
             moves_remain = 40
 
-            for sdepth, _move, _score in searcher.search(pos, eval_function, maxdepth=depth, maxtime=our_time/moves_remain/1000):
+            for sdepth, _move, _score, _ in searcher.search(pos, eval_function, maxdepth=depth, maxtime=our_time/moves_remain/1000, maxnodes=nodes):
                 pass
             else:
+                if searcher.stats:
+                    output('info string stats ' + searcher.stats.to_json())
                 if _move:
                     output('bestmove ' + _move.uci())
 
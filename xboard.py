@@ -70,12 +70,16 @@ def main():
             print('feature option="qs_limit -spin {} -100 1000"'.format(sunfish.QS_LIMIT))
             print('feature option="eval_roughness -spin {} 1 1000"'.format(sunfish.EVAL_ROUGHNESS))
             print('feature option="draw_test -spin {} 0 1"'.format(int(sunfish.DRAW_TEST)))
+            print('feature option="qs_see -spin {} 0 1"'.format(int(sunfish.QS_SEE)))
+            print('feature option="lmr -spin {} 0 1"'.format(int(sunfish.LMR)))
+            print('feature option="futility_margin -spin {} 0 1000"'.format(sunfish.FUTILITY_MARGIN))
+            print('feature option="razor_margin -spin {} 0 1000"'.format(sunfish.RAZOR_MARGIN))
             print('feature done=1')
 
         elif smove == 'new':
             stack.append('setboard ' + tools.FEN_INITIAL)
-            # Clear out the old searcher, including the tables
-            searcher = sunfish.Searcher()
+            # We keep the searcher, and thus the tables, between games. Entries
+            # that depended on the old history are ignored by the next search.
             del history[:]
 
         elif smove.startswith('setboard'):
@@ -98,6 +102,14 @@ def main():
                 sunfish.EVAL_ROUGHNESS = int(val)
             if name == 'draw_test':
                 sunfish.DRAW_TEST = bool(int(val))
+            if name == 'qs_see':
+                sunfish.QS_SEE = bool(int(val))
+            if name == 'lmr':
+                sunfish.LMR = bool(int(val))
+            if name == 'futility_margin':
+                sunfish.FUTILITY_MARGIN = int(val)
+            if name == 'razor_margin':
+                sunfish.RAZOR_MARGIN = int(val)
             options[name] = val
 
         elif smove == 'go':
@@ -111,7 +123,7 @@ def main():
 
             start = time.time()
             for ply, move, score in searcher.search(pos, history):
-                entry = searcher.tp_score.get((pos, ply, True))
+                entry = searcher.probe(pos, ply)
                 score = int(round((entry.lower + entry.upper)/2))
                 if show_thinking:
                     used = int((time.time() - start)*100 + .5)
@@ -155,10 +167,29 @@ def main():
             opp_time = int(smove.split()[1])
 
         elif smove.startswith('perft'):
+            # 'perft' counts to increasing depths, 'perft N' divides the count
+            # at depth N over the root moves.
             start = time.time()
-            for d in range(1,10):
-                res = sum(1 for _ in tools.collect_tree_depth(tools.expand_position(pos), d))
-                print('{:>8} {:>8}'.format(res, time.time()-start))
+            if len(smove.split()) > 1:
+                depth = int(smove.split()[1])
+                total = 0
+                for move, res in tools.divide(pos, depth):
+                    print('# {}: {}'.format(tools.mrender(pos, move), res))
+                    total += res
+                print('# Nodes: {}, {:.3f}s'.format(total, time.time()-start))
+            else:
+                table = {}
+                for d in range(1,10):
+                    res = tools.perft(pos, d, table)
+                    print('{:>8} {:>8}'.format(res, time.time()-start))
+
+        elif smove == 'stats':
+            # Statistics are only collected once asked for, as they cost a little speed
+            if searcher.stats is None:
+                searcher.stats = sunfish.Stats()
+                print('# Collecting search statistics from the next search.')
+            else:
+                print('# Stats:', searcher.stats.to_json())
 
         elif smove.startswith('post'):
             show_thinking = True